@@ -0,0 +1,38 @@
+'''
+authentication backend that resolves the logged in user of a session from a
+cache shared by the workers, instead of a query on every request
+'''
+
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import caches
+from django.db import transaction
+
+
+def user_key(user_id) -> str:
+    return f'user:{user_id}'
+
+
+def forget_user(user_id):
+    '''
+    the next request of this user reads it from the database again, forgotten
+    now and again once the write is committed, a worker may have cached the
+    old user in between
+    '''
+    def forget():
+        caches[settings.USER_CACHE_ALIAS].delete(user_key(user_id))
+    forget()
+    transaction.on_commit(forget)
+
+
+class CachedModelBackend(ModelBackend):
+
+    def get_user(self, user_id):
+        cache = caches[settings.USER_CACHE_ALIAS]
+        user = cache.get(user_key(user_id))
+        if user is None:
+            user = super().get_user(user_id)
+            # a user read in a transaction may yet be rolled back
+            if user is not None and not transaction.get_connection().in_atomic_block:
+                cache.set(user_key(user_id), user, settings.USER_CACHE_TIMEOUT)
+        return user
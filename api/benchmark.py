@@ -0,0 +1,497 @@
+'''
+load benchmark of every route in urls.py, on synthetic users, papers with
+small pdfs, authors, citations, papersets, comments and stars seeded from a
+fixed random seed, see the benchmark command
+
+a route is benchmarked by preparing its requests, untimed, which may create
+the rows a request deletes, then sending them from concurrent clients, each
+logged in as a seeded user, through the test client or to a running server
+'''
+
+import base64
+import json
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, timedelta
+from hashlib import md5
+from http.cookiejar import CookieJar
+from io import StringIO
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import HTTPCookieProcessor, Request, build_opener
+
+import fitz  # PyMuPDF
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings, setup_test_environment, \
+        teardown_test_environment
+
+from .citations import add_citations
+from .models import Paper, PaperByScholar, PaperCited, PaperSet, PaperSetContent, PaperSetTextComments, \
+        PaperStarComments, PaperTextComments, bump_generation
+from .rowcache import outdate_rows
+from .storage import object_name, object_storage
+from .urls import urlpatterns
+
+# papers seeded at each scale
+SCALES = {'tiny': 100, '10k': 10_000, '100k': 100_000, '1m': 1_000_000}
+USER_PREFIX = 'bench_'
+# of the users seeded in the throwaway database only, a server gets its own
+PASSWORD = 'benchmark'
+BATCH_SIZE = 5000
+# distinct pdfs shared by the papers, they are stored once by their md5
+PDF_COUNT = 16
+WORDS = '''
+    attention graph learning neural network sparse dense retrieval language model
+    vision transformer kernel convex optimization gradient descent stochastic
+    bayesian inference causal robust adversarial federated quantum protein
+    molecule reinforcement policy agent benchmark dataset efficient scalable
+    distributed database index query compiler memory cache parallel
+'''.split()
+JOURNALS = ['NeurIPS', 'ICML', 'ICLR', 'CVPR', 'ACL', 'SIGMOD', 'VLDB', 'OSDI', 'Nature', 'Science']
+
+
+@contextmanager
+def throwaway_database():
+    ''' a migrated database file and a media directory, removed afterwards '''
+    with tempfile.TemporaryDirectory() as directory:
+        # a file, so that every client thread connects to the same database
+        connection.settings_dict['TEST']['NAME'] = os.path.join(directory, 'benchmark.sqlite3')
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        setup_test_environment()
+        try:
+            with override_settings(MEDIA_ROOT=directory, FILE_UPLOAD_TEMP_DIR=directory,
+                                   PREVIEW_CACHE_DIR=os.path.join(directory, 'previews')):
+                yield
+        finally:
+            teardown_test_environment()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def make_pdf(num_pages: int, text: str = '') -> bytes:
+    ''' each page reads "<text>, page <n>", or "page <n>" without text '''
+    document = fitz.open()
+    for i in range(num_pages):
+        document.new_page().insert_text((72, 72), f'{text}, page {i + 1}' if text else f'page {i + 1}')
+    pdf_bytes = document.tobytes()
+    document.close()
+    return pdf_bytes
+
+
+def store_pdf(pdf_bytes: bytes) -> str:
+    ''' stored like uploads are, return the name for Paper.file_content '''
+    return object_storage.save(object_name(md5(pdf_bytes).hexdigest()), ContentFile(pdf_bytes))
+
+
+def words(rng: random.Random, count: int) -> str:
+    return ' '.join(rng.choices(WORDS, k=count))
+
+
+def seed_data(papers: int, seed: int = 0, password: str = PASSWORD):
+    '''
+    seed a database with papers papers, and users of password, papersets,
+    comments and stars in proportion, the same seed gives the same rows
+    '''
+    rng = random.Random(seed)
+    password = make_password(password)
+    User.objects.bulk_create([User(username=f'{USER_PREFIX}{i}', password=password)
+                              for i in range(max(8, papers // 100))])
+    user_ids = list(User.objects.filter(username__startswith=USER_PREFIX).values_list('id', flat=True))
+    pdfs = [store_pdf(make_pdf(rng.randint(1, 3), f'benchmark pdf {i}')) for i in range(PDF_COUNT)]
+    paper_ids: list[int] = []
+    for start in range(0, papers, BATCH_SIZE):
+        batch = Paper.objects.bulk_create([Paper(
+                user_id=rng.choice(user_ids),
+                title=f'{words(rng, 6)} {i}',
+                abstract=words(rng, 40),
+                file_name=f'paper_{i}.pdf',
+                file_content=rng.choice(pdfs),
+                publication_date=date(2000, 1, 1) + timedelta(days=rng.randrange(9000)),
+                journal=rng.choice(JOURNALS),
+                private=rng.random() < 0.1,
+                ) for i in range(start, min(papers, start + BATCH_SIZE))])
+        PaperByScholar.objects.bulk_create([
+                PaperByScholar(paper=paper, scholar=f'scholar {rng.randrange(papers // 4 + 1)}', order=order)
+                for paper in batch for order in range(rng.randint(1, 4))])
+        # papers cite earlier papers
+        PaperCited.objects.bulk_create([
+                PaperCited(cite_paper=paper, paper_id=cited)
+                for paper in batch for cited in rng.sample(paper_ids, min(len(paper_ids), rng.randint(0, 5)))])
+        paper_ids.extend(i.id for i in batch)
+    papersets = PaperSet.objects.bulk_create([
+            PaperSet(user_id=rng.choice(user_ids), name=words(rng, 3), description=words(rng, 12),
+                     private=rng.random() < 0.1)
+            for _ in range(max(4, papers // 50))])
+    PaperSetContent.objects.bulk_create([
+            PaperSetContent(paper_set=paperset, paper_id=paper)
+            for paperset in papersets for paper in rng.sample(paper_ids, min(len(paper_ids), 20))],
+            batch_size=BATCH_SIZE)
+    PaperTextComments.objects.bulk_create([
+            PaperTextComments(paper_id=rng.choice(paper_ids), user_id=rng.choice(user_ids), comment=words(rng, 20))
+            for _ in range(papers // 2)], batch_size=BATCH_SIZE)
+    PaperSetTextComments.objects.bulk_create([
+            PaperSetTextComments(paperset=rng.choice(papersets), user_id=rng.choice(user_ids), comment=words(rng, 20))
+            for _ in range(len(papersets) * 2)], batch_size=BATCH_SIZE)
+    stars = {(rng.choice(paper_ids), rng.choice(user_ids)) for _ in range(papers // 2)}
+    PaperStarComments.objects.bulk_create([
+            PaperStarComments(paper_id=paper, user_id=user, star=rng.randint(1, 5)) for paper, user in stars],
+            batch_size=BATCH_SIZE)
+    # the derived columns, bulk_create sends no signals
+    call_command('repair_ratings', stdout=StringIO())
+    call_command('compute_pagerank', stdout=StringIO())
+    bump_generation()
+    outdate_rows()
+
+
+class Dataset:
+    ''' the seeded rows the requests pick from, and the password of the users '''
+
+    def __init__(self, password: str = PASSWORD):
+        self.password = password
+        self.users = list(User.objects.filter(username__startswith=USER_PREFIX).order_by('id'))
+        if not self.users:
+            raise ValueError('no benchmark users, seed the database first')
+        self.papers = list(Paper.objects.filter(private=False).values_list('id', flat=True))
+        self.papersets = list(PaperSet.objects.filter(private=False).values_list('id', flat=True))
+        # a stored pdf, for the papers made for the requests changing them
+        self.file_content = Paper.objects.values_list('file_content', flat=True).first()
+        # uploaded by the insert requests
+        self.pdf_base64 = base64.b64encode(make_pdf(1, 'uploaded')).decode()
+
+
+class Call:
+    '''
+    a request to send, from the worker's client unless fresh, then from a
+    new client logged in as user, or anonymous if user is None
+    '''
+
+    def __init__(self, method: str, params: dict | None = None, data: dict | None = None,
+                 user: User | None = None, fresh: bool = False):
+        self.method = method
+        self.params = params or {}
+        self.data = data
+        self.user = user
+        self.fresh = fresh
+        self.client = None
+
+
+# route: prepare(dataset, user, rng) -> Call
+ROUTES = {}
+
+
+def route(name: str):
+    def decor(func):
+        ROUTES[name] = func
+        return func
+    return decor
+
+
+def paper_form(dataset: Dataset, rng: random.Random) -> dict:
+    return {
+            'title': f'{words(rng, 5)} {rng.getrandbits(64):x}',
+            'abstract': words(rng, 40),
+            'authors': [f'scholar {rng.randrange(100)}' for _ in range(2)],
+            'publication_date': '2024-01-01',
+            'journal': rng.choice(JOURNALS),
+            'file_name': 'upload.pdf',
+            'file_content': dataset.pdf_base64,
+            }
+
+
+def new_user(dataset: Dataset, rng: random.Random) -> User:
+    return User.objects.create_user(username=f'{USER_PREFIX}new_{rng.getrandbits(64):x}', password=dataset.password)
+
+
+def own_paper(dataset: Dataset, user: User, rng: random.Random) -> Paper:
+    ''' a new paper of user, for the requests changing or deleting it '''
+    return Paper.objects.create(
+            user=user, title=f'{words(rng, 5)} {rng.getrandbits(64):x}', abstract=words(rng, 40),
+            file_name='own.pdf', file_content=dataset.file_content, publication_date=date(2024, 1, 1),
+            journal=rng.choice(JOURNALS))
+
+
+def own_paperset(user: User, rng: random.Random) -> PaperSet:
+    return PaperSet.objects.create(user=user, name=words(rng, 3), description=words(rng, 12))
+
+
+@route('login')
+def login_call(dataset, user, rng):
+    return Call('POST', data={'username': user.username, 'password': dataset.password}, fresh=True)
+
+
+@route('logout')
+def logout_call(dataset, user, rng):
+    return Call('POST', user=user, fresh=True)
+
+
+@route('signup')
+def signup_call(dataset, user, rng):
+    username = f'{USER_PREFIX}signup_{rng.getrandbits(64):x}'
+    return Call('POST', data={'username': username, 'password': dataset.password, 'email': f'{username}@example.com'}, fresh=True)
+
+
+@route('logoff')
+def logoff_call(dataset, user, rng):
+    return Call('POST', user=new_user(dataset, rng), fresh=True)
+
+
+@route('get_user_detail')
+@route('get_user_loggedin')
+@route('userid')
+def user_call(dataset, user, rng):
+    return Call('GET')
+
+
+@route('insert_paper')
+def insert_paper_call(dataset, user, rng):
+    return Call('POST', data=paper_form(dataset, rng))
+
+
+@route('insert_papers')
+def insert_papers_call(dataset, user, rng):
+    return Call('POST', data={'papers': [paper_form(dataset, rng) for _ in range(10)]})
+
+
+@route('add_citations')
+def add_citations_call(dataset, user, rng):
+    paper = own_paper(dataset, user, rng)
+    return Call('POST', data={'paperid': paper.id, 'paperid_list': rng.sample(dataset.papers, 5)})
+
+
+@route('delete_citations')
+def delete_citations_call(dataset, user, rng):
+    paper = own_paper(dataset, user, rng)
+    cited = rng.sample(dataset.papers, 5)
+    add_citations(paper, cited)
+    return Call('POST', data={'paperid': paper.id, 'paperid_list': cited})
+
+
+@route('citation_graph')
+def citation_graph_call(dataset, user, rng):
+    return Call('GET', {'paperid': rng.choice(dataset.papers), 'depth': 2})
+
+
+@route('delete_paper')
+def delete_paper_call(dataset, user, rng):
+    return Call('POST', data={'paperid': own_paper(dataset, user, rng).id})
+
+
+@route('modify_paper')
+def modify_paper_call(dataset, user, rng):
+    return Call('POST', data={'paperid': own_paper(dataset, user, rng).id, 'abstract': words(rng, 40)})
+
+
+@route('search_paper')
+def search_paper_call(dataset, user, rng):
+    return Call('GET', {'keyword': rng.choice(WORDS), 'per_page': 20, 'order': rng.choice(['', 'rating', 'influence'])})
+
+
+@route('search_paperset')
+def search_paperset_call(dataset, user, rng):
+    return Call('GET', {'name': rng.choice(WORDS), 'per_page': 20})
+
+
+@route('paper_detail')
+@route('get_paper_review')
+@route('get_papers_paperset')
+def paper_call(dataset, user, rng):
+    return Call('GET', {'paperid': rng.choice(dataset.papers)})
+
+
+@route('paper_content')
+def paper_content_call(dataset, user, rng):
+    return Call('GET', {'paperid': rng.choice(dataset.papers), 'type': 'bytes'})
+
+
+@route('search_paper_comment')
+def search_paper_comment_call(dataset, user, rng):
+    return Call('GET', {'paperid': rng.choice(dataset.papers), 'per_page': 20})
+
+
+@route('search_paperset_comment')
+def search_paperset_comment_call(dataset, user, rng):
+    return Call('GET', {'papersetid': rng.choice(dataset.papersets), 'per_page': 20})
+
+
+@route('comment_paper')
+def comment_paper_call(dataset, user, rng):
+    return Call('POST', data={'paperid': rng.choice(dataset.papers), 'comment': words(rng, 20)})
+
+
+@route('review_paper')
+def review_paper_call(dataset, user, rng):
+    return Call('POST', data={'paperid': rng.choice(dataset.papers), 'star': rng.randint(1, 5)})
+
+
+@route('comment_paperset')
+def comment_paperset_call(dataset, user, rng):
+    return Call('POST', data={'papersetid': rng.choice(dataset.papersets), 'comment': words(rng, 20)})
+
+
+@route('insert_paperset')
+def insert_paperset_call(dataset, user, rng):
+    return Call('POST', data={'name': words(rng, 3), 'description': words(rng, 12)})
+
+
+@route('change_paperset')
+def change_paperset_call(dataset, user, rng):
+    return Call('POST', data={'papersetid': own_paperset(user, rng).id, 'description': words(rng, 12)})
+
+
+@route('delete_paperset')
+def delete_paperset_call(dataset, user, rng):
+    return Call('POST', data={'papersetid': own_paperset(user, rng).id})
+
+
+@route('add_to_paperset')
+def add_to_paperset_call(dataset, user, rng):
+    return Call('POST', data={'papersetid': own_paperset(user, rng).id, 'paperid_list': rng.sample(dataset.papers, 5)})
+
+
+@route('delete_from_paperset')
+def delete_from_paperset_call(dataset, user, rng):
+    paperset = own_paperset(user, rng)
+    papers = rng.sample(dataset.papers, 5)
+    PaperSetContent.objects.bulk_create([PaperSetContent(paper_set=paperset, paper_id=i) for i in papers])
+    return Call('POST', data={'papersetid': paperset.id, 'paperid_list': papers})
+
+
+def missing_routes() -> list[str]:
+    ''' routes of urls.py nothing benchmarks '''
+    return [str(i.pattern) for i in urlpatterns if str(i.pattern) not in ROUTES]
+
+
+class TestClientTarget:
+    ''' requests through the test client, counting the queries of each '''
+    count_queries = True
+
+    def client(self, user: User | None):
+        # a view raising counts as a failed request, like on a server
+        client = Client(raise_request_exception=False)
+        if user is not None:
+            client.force_login(user)
+        return client
+
+    def send(self, client, name: str, call: Call) -> int:
+        path = f'/api/{name}'
+        if call.method == 'GET':
+            return client.get(path, call.params).status_code
+        return client.post(path, call.data or {}, content_type='application/json').status_code
+
+
+class ServerTarget:
+    ''' requests to a running server, which doesn't tell its query counts '''
+    count_queries = False
+
+    def __init__(self, url: str, password: str):
+        self.url = url.rstrip('/')
+        self.password = password
+
+    def client(self, user: User | None):
+        client = build_opener(HTTPCookieProcessor(CookieJar()))
+        if user is not None:
+            call = Call('POST', data={'username': user.username, 'password': self.password})
+            if self.send(client, 'login', call) != 200:
+                raise ValueError(f'{user.username} could not log in to {self.url}')
+        return client
+
+    def send(self, client, name: str, call: Call) -> int:
+        url = f'{self.url}/api/{name}'
+        if call.params:
+            url = f'{url}?{urlencode(call.params)}'
+        body = None if call.method == 'GET' else json.dumps(call.data or {}).encode()
+        request = Request(url, data=body, method=call.method, headers={'Content-Type': 'application/json'})
+        try:
+            with client.open(request) as response:
+                response.read()
+                return response.status
+        except HTTPError as err:
+            return err.code
+
+
+def percentile(values: list[float], q: int) -> float:
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method='inclusive')[q - 1]
+
+
+def run_route(target, dataset: Dataset, name: str, requests: int, concurrency: int, seed: int = 0) -> dict:
+    '''
+    send requests requests of route name from concurrency clients, return the
+    latency percentiles in ms, the throughput in requests per second and the
+    mean query count, None from a server
+    '''
+    rng = random.Random(f'{seed}:{name}')
+    users = [dataset.users[i % len(dataset.users)] for i in range(concurrency)]
+    clients = [target.client(i) for i in users]
+    calls = [[] for _ in range(concurrency)]
+    for i in range(requests):
+        call = ROUTES[name](dataset, users[i % concurrency], rng)
+        if call.fresh:
+            call.client = target.client(call.user)
+        calls[i % concurrency].append(call)
+    results = []
+    lock = threading.Lock()
+
+    def work(client, worker_calls):
+        for call in worker_calls:
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                status = target.send(call.client or client, name, call)
+                elapsed = time.perf_counter() - start
+            with lock:
+                results.append((elapsed, status, len(queries)))
+
+    def thread_work(client, worker_calls):
+        try:
+            work(client, worker_calls)
+        finally:
+            connections.close_all()
+
+    start = time.perf_counter()
+    if concurrency == 1:
+        work(clients[0], calls[0])
+    else:
+        threads = [threading.Thread(target=thread_work, args=args) for args in zip(clients, calls)]
+        for i in threads:
+            i.start()
+        for i in threads:
+            i.join()
+    wall = time.perf_counter() - start
+    latencies = sorted(i[0] * 1000 for i in results)
+    return {
+            'requests': len(results),
+            'errors': sum(1 for i in results if i[1] >= 400),
+            'p50_ms': round(percentile(latencies, 50), 3),
+            'p95_ms': round(percentile(latencies, 95), 3),
+            'p99_ms': round(percentile(latencies, 99), 3),
+            'throughput': round(len(results) / wall, 1),
+            'queries': round(statistics.mean(i[2] for i in results), 1) if target.count_queries else None,
+            }
+
+
+def regressions(results: dict[str, dict], baseline: dict[str, dict], tolerance: float) -> list[str]:
+    '''
+    the routes slower than the baseline by more than tolerance at p95, or
+    running more queries, routes missing from either are not compared
+    '''
+    found = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if result['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+            found.append(f'{name}: p95 {result["p95_ms"]}ms, baseline {base["p95_ms"]}ms')
+        if result['queries'] is not None and base.get('queries') is not None and result['queries'] > base['queries']:
+            found.append(f'{name}: {result["queries"]} queries, baseline {base["queries"]}')
+    return found
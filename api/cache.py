@@ -0,0 +1,39 @@
+'''
+cache of search responses, keyed by the normalized query params and who can
+see the results, a write that may change any result replaces the generation
+token in the key, so outdated responses are never read again and expire
+'''
+
+import hashlib
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import models
+
+from .models import generation
+
+
+def search_cache():
+    return caches[settings.SEARCH_CACHE_ALIAS]
+
+
+def visibility_scope(user: User, private_models: list[type[models.Model]]) -> str:
+    '''
+    'public' when no private row of the user is among private_models, so the
+    user sees what everyone else sees and shares their cached responses
+    '''
+    for i in private_models:
+        if i.objects.filter(user=user, private=True).exists():
+            return f'user{user.id}'
+    return 'public'
+
+
+def params_digest(params) -> str:
+    ''' the same for the same params in any order '''
+    items = sorted((key, value) for key in params for value in params.getlist(key))
+    return hashlib.sha1(repr(items).encode()).hexdigest()
+
+
+def response_key(view: str, params, scope: str) -> str:
+    return f'{view}:{generation()}:{scope}:{params_digest(params)}'
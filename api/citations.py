@@ -0,0 +1,95 @@
+'''
+the citation graph of papers, PaperCited(paper, cite_paper) is an edge from
+the citing cite_paper to the cited paper, total_citations of a paper is the
+number of edges to it and reference_count the number of edges from it, kept
+up to date by every change of the edges
+'''
+
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import F
+
+from .models import Paper, PaperCited, bump_generation
+from .rowcache import outdate_rows
+
+# direction: (column of the current paper, column of its neighbours)
+DIRECTIONS = {
+        # papers citing the current one
+        'cited_by': ('paper_id', 'cite_paper_id'),
+        # papers the current one cites
+        'cites': ('cite_paper_id', 'paper_id'),
+        }
+
+
+def count_citations(paper_ids: list[int], delta: int):
+    if paper_ids:
+        Paper.objects.filter(id__in=paper_ids).update(total_citations=F('total_citations') + delta)
+        bump_generation()
+        outdate_rows()
+
+
+def count_references(paper_ids: list[int], delta: int):
+    if paper_ids:
+        Paper.objects.filter(id__in=paper_ids).update(reference_count=F('reference_count') + delta)
+
+
+def add_citations(paper: Paper, cited: list[int]) -> list[int]:
+    ''' paper cites every paper of cited, return the ones it already cited '''
+    cited = list(dict.fromkeys(cited))
+    with transaction.atomic():
+        existing = set(PaperCited.objects.filter(cite_paper=paper, paper_id__in=cited).values_list('paper_id', flat=True))
+        added = [i for i in cited if i not in existing]
+        PaperCited.objects.bulk_create([PaperCited(paper_id=i, cite_paper=paper) for i in added])
+        count_citations(added, 1)
+        if added:
+            count_references([paper.id], len(added))
+    return [i for i in cited if i in existing]
+
+
+def remove_citations(paper: Paper, cited: list[int]) -> list[int]:
+    ''' paper no longer cites any paper of cited, return the ones it didn't cite '''
+    cited = list(dict.fromkeys(cited))
+    with transaction.atomic():
+        edges = PaperCited.objects.filter(cite_paper=paper, paper_id__in=cited)
+        existing = set(edges.values_list('paper_id', flat=True))
+        edges.delete()
+        count_citations(list(existing), -1)
+        if existing:
+            count_references([paper.id], -len(existing))
+    return [i for i in cited if i not in existing]
+
+
+def uncount_citations_of(paper: Paper):
+    '''
+    the papers cited by paper, which is about to be deleted, lose a citation,
+    the papers citing it a reference
+    '''
+    count_citations(list(PaperCited.objects.filter(cite_paper=paper).values_list('paper_id', flat=True)), -1)
+    count_references(list(PaperCited.objects.filter(paper=paper).values_list('cite_paper_id', flat=True)), -1)
+
+
+def neighborhood(paper: Paper, user: User, direction: str, depth: int, fanout: int, limit: int) -> dict[int, int]:
+    '''
+    the papers within depth hops of paper in direction, and the hops to each
+    at most fanout neighbours of a paper are followed, and at most limit
+    papers are visited, papers user can't view are neither returned nor
+    followed, one recursive query
+    '''
+    current, neighbour = DIRECTIONS[direction]
+    table = PaperCited._meta.db_table
+    papers = Paper._meta.db_table
+    sql = f'''
+        WITH RECURSIVE hop(id, depth) AS (
+            SELECT %s, 0
+            UNION
+            SELECT p.id, hop.depth + 1 FROM hop
+            JOIN {papers} p ON p.id IN (
+                SELECT {neighbour} FROM {table} WHERE {current} = hop.id ORDER BY {neighbour} LIMIT %s)
+            WHERE hop.depth < %s AND (p.private = %s OR p.user_id = %s)
+            LIMIT %s
+        )
+        SELECT id, MIN(depth) FROM hop GROUP BY id
+    '''
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [paper.id, fanout, depth, False, user.id, limit])
+        return dict(cursor.fetchall())
@@ -0,0 +1,30 @@
+'''
+sqlite tuned for several workers writing at once, the pragmas are applied to
+every new connection, and write views wait and retry while the database is
+locked by another writer
+'''
+
+from django.conf import settings
+from django.db import OperationalError
+
+
+def sqlite_pragmas() -> dict[str, str | int]:
+    return {
+            # readers don't block the writer, nor the writer readers
+            'journal_mode': settings.SQLITE_JOURNAL_MODE,
+            # with wal, normal only risks the last commits on power loss
+            'synchronous': settings.SQLITE_SYNCHRONOUS,
+            'mmap_size': settings.SQLITE_MMAP_SIZE,
+            # milliseconds a statement waits for another writer's lock
+            'busy_timeout': settings.SQLITE_BUSY_TIMEOUT,
+            }
+
+
+def apply_pragmas(cursor):
+    for name, value in sqlite_pragmas().items():
+        cursor.execute(f'PRAGMA {name} = {value}')
+
+
+def is_locked(err: OperationalError) -> bool:
+    ''' another writer held the lock for longer than the busy timeout '''
+    return 'database is locked' in str(err) or 'database table is locked' in str(err)
@@ -0,0 +1,71 @@
+''' full-text search over papers, backed by an SQLite FTS5 table '''
+
+from django.db import connection, connections
+from django.db.models import FloatField, QuerySet
+from django.db.models.expressions import RawSQL
+
+FTS_TABLE = 'api_paper_fts'
+
+
+def fts_available() -> bool:
+    ''' the index only exists on SQLite, other backends use the icontains filters '''
+    return connection.vendor == 'sqlite'
+
+
+def fts_match(text: str, column: str | None = None) -> str | None:
+    '''
+    turn user input into an FTS5 MATCH expression, every word is quoted so
+    that user input can't inject FTS5 syntax, and matched as a prefix
+    return None if there is nothing to search for
+    '''
+    words = [i for i in text.split() if any(c.isalnum() for c in i)]
+    if not words:
+        return None
+    expression = ' AND '.join('"{}"*'.format(i.replace('"', '""')) for i in words)
+    if column is None:
+        return expression
+    return f'{column} : ({expression})'
+
+
+def fts_filter(queryset: QuerySet, match: str) -> QuerySet:
+    return queryset.filter(id__in=RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', (match,)))
+
+
+def fts_rank(queryset: QuerySet, match: str) -> QuerySet:
+    ''' annotate fts_rank, the bm25 score of each paper, lower is better '''
+    table = connection.ops.quote_name(queryset.model._meta.db_table)
+    return queryset.annotate(fts_rank=RawSQL(
+        f'SELECT bm25({FTS_TABLE}) FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s AND rowid = {table}.id',
+        (match,), output_field=FloatField()))
+
+
+# SQLite drops the triggers of a table whenever a migration rebuilds it, so
+# they are created again after every migrate, see ensure_fts_triggers
+TRIGGER_SQL = [
+    f'''CREATE TRIGGER IF NOT EXISTS api_paper_fts_insert AFTER INSERT ON api_paper BEGIN
+        INSERT INTO {FTS_TABLE} (rowid, title, abstract, journal, authors)
+        VALUES (new.id, new.title, new.abstract, new.journal, '');
+    END''',
+    f'''CREATE TRIGGER IF NOT EXISTS api_paper_fts_update AFTER UPDATE OF title, abstract, journal ON api_paper BEGIN
+        UPDATE {FTS_TABLE} SET title = new.title, abstract = new.abstract, journal = new.journal
+        WHERE rowid = new.id;
+    END''',
+    f'''CREATE TRIGGER IF NOT EXISTS api_paper_fts_delete AFTER DELETE ON api_paper BEGIN
+        DELETE FROM {FTS_TABLE} WHERE rowid = old.id;
+    END''',
+]
+for event, row in [('INSERT', 'new'), ('DELETE', 'old'), ('UPDATE', 'new')]:
+    TRIGGER_SQL.append(f'''CREATE TRIGGER IF NOT EXISTS api_paperbyscholar_fts_{event.lower()} AFTER {event} ON api_paperbyscholar BEGIN
+        UPDATE {FTS_TABLE} SET authors = coalesce(
+            (SELECT group_concat(scholar, ' ') FROM api_paperbyscholar WHERE paper_id = {row}.paper_id), '')
+        WHERE rowid = {row}.paper_id;
+    END''')
+
+
+def ensure_fts_triggers(using: str):
+    ''' create the triggers keeping the index in sync, if the index exists '''
+    with connections[using].cursor() as cursor:
+        if connections[using].vendor != 'sqlite' or FTS_TABLE not in connections[using].introspection.table_names(cursor):
+            return
+        for sql in TRIGGER_SQL:
+            cursor.execute(sql)
@@ -0,0 +1,104 @@
+''' load benchmark of every route, see api/benchmark.py '''
+
+import json
+import secrets
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api import benchmark
+
+
+class Command(BaseCommand):
+    help = '''
+        seed synthetic data and benchmark every route, by default through the
+        test client on a throwaway database, with --server on a running server
+        using the configured database, already seeded, or seeded by
+        --seed-server with users of a random password, printed for later runs,
+        and only when DEBUG unless --force, a failed request fails the run
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', default='tiny',
+                            help=f'papers to seed, one of {", ".join(benchmark.SCALES)} or a number')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--requests', type=int, default=50, help='requests per route')
+        parser.add_argument('--concurrency', type=int, default=4)
+        parser.add_argument('--routes', help='comma separated routes to run, all by default')
+        parser.add_argument('--server', help='url of a running server, such as http://127.0.0.1:8000')
+        parser.add_argument('--seed-server', action='store_true', help='with --server, seed the configured database first')
+        parser.add_argument('--force', action='store_true', help='seed the configured database even when not DEBUG')
+        parser.add_argument('--password', help='with --server, the password of the seeded users, random when seeding')
+        parser.add_argument('--baseline', help='json file of earlier results, a regression fails the run')
+        parser.add_argument('--save-baseline', action='store_true', help='write the results to --baseline')
+        parser.add_argument('--tolerance', type=float, default=0.2, help='p95 slowdown allowed over the baseline')
+        parser.add_argument('--output', help='also write the results as json to this file')
+
+    def handle(self, *args, **options):
+        scale = options['scale']
+        try:
+            papers = benchmark.SCALES[scale] if scale in benchmark.SCALES else int(scale)
+        except ValueError:
+            raise CommandError(f'invalid scale {scale}')
+        missing = benchmark.missing_routes()
+        if missing:
+            raise CommandError(f'no benchmark for the routes {", ".join(missing)}')
+        names = options['routes'].split(',') if options['routes'] else list(benchmark.ROUTES)
+        unknown = [i for i in names if i not in benchmark.ROUTES]
+        if unknown:
+            raise CommandError(f'unknown routes {", ".join(unknown)}')
+        if options['requests'] < 1 or options['concurrency'] < 1:
+            raise CommandError('requests and concurrency should be positive')
+        if options['server']:
+            results = self.run_on_server(papers, names, options)
+        else:
+            results = self.run_on_test_database(papers, names, options)
+        self.report(results)
+        if options['output']:
+            self.write(options['output'], papers, results)
+        errors = [name for name, result in results.items() if result['errors']]
+        if errors:
+            raise CommandError(f'requests failed on {", ".join(errors)}')
+        if options['baseline'] and options['save_baseline']:
+            self.write(options['baseline'], papers, results)
+        elif options['baseline']:
+            with open(options['baseline']) as file:
+                baseline = json.load(file)
+            if baseline['papers'] != papers:
+                raise CommandError(f'the baseline is of {baseline["papers"]} papers, not {papers}')
+            found = benchmark.regressions(results, baseline['routes'], options['tolerance'])
+            if found:
+                raise CommandError('regressions:\n' + '\n'.join(found))
+
+    def run_on_test_database(self, papers: int, names: list[str], options) -> dict[str, dict]:
+        with benchmark.throwaway_database():
+            benchmark.seed_data(papers, options['seed'])
+            return self.run(benchmark.TestClientTarget(), benchmark.Dataset(), names, options)
+
+    def run_on_server(self, papers: int, names: list[str], options) -> dict[str, dict]:
+        password = options['password']
+        if options['seed_server']:
+            if not settings.DEBUG and not options['force']:
+                raise CommandError('not seeding the configured database when DEBUG is off, unless --force')
+            if password is None:
+                password = secrets.token_urlsafe(16)
+                self.stdout.write(f'the seeded users have the password {password}')
+            benchmark.seed_data(papers, options['seed'], password)
+        elif password is None:
+            raise CommandError('--server needs the --password of the seeded users, or --seed-server')
+        return self.run(benchmark.ServerTarget(options['server'], password), benchmark.Dataset(password), names, options)
+
+    def run(self, target, dataset: benchmark.Dataset, names: list[str], options) -> dict[str, dict]:
+        return {name: benchmark.run_route(target, dataset, name, options['requests'], options['concurrency'], options['seed'])
+                for name in names}
+
+    def report(self, results: dict[str, dict]):
+        self.stdout.write(f'{"route":<26}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}{"req/s":>10}{"queries":>9}{"errors":>8}')
+        for name, result in results.items():
+            queries = '-' if result['queries'] is None else result['queries']
+            self.stdout.write(f'{name:<26}{result["p50_ms"]:>10}{result["p95_ms"]:>10}{result["p99_ms"]:>10}'
+                              f'{result["throughput"]:>10}{queries:>9}{result["errors"]:>8}')
+
+    def write(self, path: str, papers: int, results: dict[str, dict]):
+        with open(path, 'w') as file:
+            json.dump({'papers': papers, 'routes': results}, file, indent=2)
@@ -0,0 +1,68 @@
+''' rank papers by their influence in the citation graph '''
+
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection, transaction
+
+from api import pagerank
+from api.database import is_locked
+from api.models import Paper, bump_generation
+from api.rowcache import outdate_rows
+
+
+class Command(BaseCommand):
+    help = 'compute the pagerank of every paper, and repair total_citations and reference_count'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--damping', type=float, default=0.85)
+        parser.add_argument('--tolerance', type=float, default=1e-9,
+                            help='stop once the scores change by less than this in total')
+        parser.add_argument('--max-iterations', type=int, default=100)
+        parser.add_argument('--from-scratch', action='store_true',
+                            help='start from uniform scores, not from the stored ones')
+
+    def handle(self, *args, **options):
+        # the graph is read and the scores written in one transaction, a
+        # writer committing in between locks the write out, then it's all
+        # read and ranked again
+        attempt = 1
+        while True:
+            try:
+                with transaction.atomic():
+                    size, iterations, updated = self.rank(options)
+                break
+            except OperationalError as err:
+                if not is_locked(err) or attempt >= settings.WRITE_RETRY_ATTEMPTS:
+                    raise
+            time.sleep(settings.WRITE_RETRY_DELAY * 2 ** (attempt - 1))
+            attempt += 1
+        engine = 'numpy' if pagerank.numpy is not None else 'python'
+        self.stdout.write(self.style.SUCCESS(
+            f'ranked {size} papers in {iterations} iterations with {engine}, updated {updated}'))
+
+    def rank(self, options) -> tuple[int, int, int]:
+        ''' the number of papers, of iterations, and of rows updated '''
+        ids, scores, sources, targets = pagerank.load_graph()
+        start = None if options['from_scratch'] else scores
+        ranks, iterations = pagerank.pagerank(len(ids), sources, targets, start, options['damping'],
+                                              options['tolerance'], options['max_iterations'])
+        citations, references = pagerank.degrees(len(ids), sources, targets)
+        table = Paper._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT id, total_citations, reference_count FROM {table}')
+            counts = {}
+            while rows := cursor.fetchmany(pagerank.FETCH_SIZE):
+                counts.update((i[0], i[1:]) for i in rows)
+            # only the rows that changed are written, a score within the
+            # tolerance of the stored one is kept
+            changed = [(ranks[i], citations[i], references[i], ids[i]) for i in range(len(ids))
+                       if abs(ranks[i] - scores[i]) > options['tolerance']
+                       or counts.get(ids[i]) != (citations[i], references[i])]
+            cursor.executemany(f'UPDATE {table} SET pagerank = %s, total_citations = %s, reference_count = %s WHERE id = %s',
+                               changed)
+        if changed:
+            bump_generation()
+            outdate_rows()
+        return len(ids), iterations, len(changed)
@@ -0,0 +1,38 @@
+''' remove stored files that no paper refers to '''
+
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.models import Paper
+from api.previews import invalidate_previews
+from api.storage import object_storage
+
+
+class Command(BaseCommand):
+    help = 'remove files under objects/ that no paper refers to'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='only report what would be removed')
+        parser.add_argument('--grace', type=int, default=settings.OBJECT_STORE_GRACE_SECONDS,
+                            help='keep files saved or reused within this many seconds')
+
+    def handle(self, *args, **options):
+        referenced = set(Paper.objects.values_list('file_content', flat=True).iterator())
+        removed = freed = 0
+        for name in object_storage.iter_objects():
+            if name in referenced or not object_storage.is_stale(name, options['grace']):
+                continue
+            # a paper may have started referring to it since the scan
+            if Paper.objects.filter(file_content=name).exists():
+                continue
+            size = object_storage.size(name)
+            if options['dry_run']:
+                self.stdout.write(f'would remove {name}')
+            else:
+                object_storage.delete(name)
+                invalidate_previews(os.path.basename(name))
+            removed += 1
+            freed += size
+        self.stdout.write(self.style.SUCCESS(f'removed {removed} files, {freed} bytes'))
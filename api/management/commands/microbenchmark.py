@@ -0,0 +1,41 @@
+''' micro benchmarks of the building blocks of the views, see api/microbench.py '''
+
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api import microbench
+from api.benchmark import throwaway_database
+
+
+def int_list(value: str) -> list[int]:
+    return [int(i) for i in value.split(',')]
+
+
+class Command(BaseCommand):
+    help = 'time and trace the memory of the building blocks of the views, on a throwaway database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--groups', default=','.join(microbench.GROUPS),
+                            help=f'comma separated, of {", ".join(microbench.GROUPS)}')
+        parser.add_argument('--repeat', type=int, default=5, help='timed runs of each case')
+        parser.add_argument('--authors', type=int_list, default=[1, 10, 100], help='authors of the serialized papers')
+        parser.add_argument('--sizes', type=int_list, default=[1, 10, 100], help='upload sizes in MB')
+        parser.add_argument('--pages', type=int_list, default=[10, 100, 1000], help='pages of the previewed pdfs')
+        parser.add_argument('--output', help='also write the results as json to this file')
+
+    def handle(self, *args, **options):
+        groups = options['groups'].split(',')
+        unknown = [i for i in groups if i not in microbench.GROUPS]
+        if unknown:
+            raise CommandError(f'unknown groups {", ".join(unknown)}')
+        if options['repeat'] < 1:
+            raise CommandError('repeat should be positive')
+        with throwaway_database():
+            results = microbench.run(groups, options['repeat'], options['authors'], options['sizes'], options['pages'])
+        self.stdout.write(f'{"case":<44}{"mean ms":>12}{"min ms":>12}{"peak KB":>12}')
+        for name, result in results.items():
+            self.stdout.write(f'{name:<44}{result["mean_ms"]:>12}{result["min_ms"]:>12}{result["peak_kb"]:>12}')
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(results, file, indent=2)
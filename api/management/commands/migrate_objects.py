@@ -0,0 +1,71 @@
+''' move paper files from the flat objects/ directory to the content addressed layout '''
+
+import os
+import shutil
+from hashlib import md5
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.models import Paper, bump_generation
+from api.rowcache import outdate_rows
+from api.storage import object_name, object_storage
+from api.uploads import CHUNK_SIZE
+
+
+def link(source: str, target: str):
+    ''' a second name of source, or a copy where links aren't supported '''
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+
+def hash_file(path: str) -> str:
+    hasher = md5()
+    with open(path, 'rb') as file:
+        while chunk := file.read(CHUNK_SIZE):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+class Command(BaseCommand):
+    help = 'move paper files to objects/<2 hex>/<2 hex>/<md5>, storing identical files once'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='only report what would be moved')
+
+    def handle(self, *args, **options):
+        moved = merged = missing = 0
+        names = Paper.objects.order_by().values_list('file_content', flat=True).distinct()
+        for name in list(names.iterator()):
+            old_path = object_storage.path(name)
+            if not os.path.exists(old_path):
+                missing += 1
+                self.stderr.write(f'missing file {name}')
+                continue
+            # names with a suffix from the old storage are hashed again
+            new_name = object_name(hash_file(old_path))
+            if new_name == name:
+                continue
+            new_path = object_storage.path(new_name)
+            if options['dry_run']:
+                self.stdout.write(f'{name} -> {new_name}')
+                continue
+            # the file is at both paths until the papers refer to the new one,
+            # stopped at any point, the papers refer to a file that exists
+            with transaction.atomic():
+                if os.path.exists(new_path):
+                    # another file had the same content, gc_objects removes this copy
+                    merged += 1
+                else:
+                    os.makedirs(os.path.dirname(new_path), exist_ok=True)
+                    link(old_path, new_path)
+                    transaction.on_commit(lambda old_path=old_path: os.remove(old_path))
+                    moved += 1
+                Paper.objects.filter(file_content=name).update(file_content=new_name)
+        if moved or merged:
+            # a bulk update sends no signals, cached rows keep the old names otherwise
+            bump_generation()
+            outdate_rows()
+        self.stdout.write(self.style.SUCCESS(f'moved {moved}, merged {merged} duplicates, {missing} missing'))
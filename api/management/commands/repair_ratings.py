@@ -0,0 +1,29 @@
+''' recompute the rating aggregates stored on papers '''
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Avg, Count, F, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from api.models import Paper, PaperStarComments, bump_generation
+from api.rowcache import outdate_rows
+
+
+class Command(BaseCommand):
+    help = 'recompute star_count, star_sum and rating of every paper from its reviews'
+
+    def handle(self, *args, **options):
+        stars = PaperStarComments.objects.filter(paper=OuterRef('pk')).order_by().values('paper')
+        star_count = Coalesce(Subquery(stars.annotate(n=Count('id')).values('n')), 0)
+        star_sum = Coalesce(Subquery(stars.annotate(n=Sum('star')).values('n')), 0)
+        rating = Coalesce(Subquery(stars.annotate(n=Avg('star')).values('n')), Value(0.0))
+        with transaction.atomic():
+            drifted = Paper.objects.alias(real_count=star_count, real_sum=star_sum) \
+                    .filter(~Q(star_count=F('real_count')) | ~Q(star_sum=F('real_sum')))
+            repaired = drifted.update(star_count=star_count, star_sum=star_sum, rating=rating)
+            # a bulk update sends no signals, cached rows and responses keep
+            # the old rating otherwise
+            if repaired:
+                bump_generation()
+                outdate_rows()
+        self.stdout.write(self.style.SUCCESS(f'repaired the ratings of {repaired} papers'))
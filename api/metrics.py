@@ -0,0 +1,252 @@
+'''
+per route metrics, latency histograms, requests by status, sql queries and
+their time, and bytes out, in the prometheus text format at /metrics
+
+every worker counts in memory, and writes its counts to its own file in
+settings.METRICS_DIR at most every settings.METRICS_FLUSH_INTERVAL seconds,
+/metrics sums the files of every worker, those of the exited ones included,
+so the counters never go down, the files of exited workers are merged into
+one when /metrics is read, so that restarts don't add files forever
+'''
+
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from uuid import uuid4
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+# upper bounds of the latency buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+UNMATCHED = 'unmatched'
+# the counts of the exited workers, and the lock of merging them
+EXITED = 'exited.json'
+LOCK = 'metrics.lock'
+
+# [queries, seconds] of the current request
+request_queries: ContextVar[list | None] = ContextVar('request_queries', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    ''' execute wrapper of every connection, counts the queries of a request '''
+    queries = request_queries.get()
+    if queries is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        queries[0] += 1
+        queries[1] += time.perf_counter() - start
+
+
+# a route's counts, the requests in each latency bucket and over the last,
+# then the totals of the following
+SECONDS, QUERIES, QUERY_SECONDS, BYTES = range(len(BUCKETS) + 1, len(BUCKETS) + 5)
+
+
+class Store:
+    ''' the counts of this worker '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.name = f'{os.getpid()}_{uuid4().hex}.json'
+        self.flush_at = 0.0
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            # (route, status): requests
+            self.requests: dict[tuple[str, int], int] = {}
+            self.routes: dict[str, list] = {}
+
+    def record(self, route: str, status: int, seconds: float, queries: list, size: int):
+        with self.lock:
+            key = (route, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            counts = self.routes.get(route)
+            if counts is None:
+                counts = self.routes[route] = [0] * (len(BUCKETS) + 1) + [0.0, 0, 0.0, 0]
+            counts[bisect_left(BUCKETS, seconds)] += 1
+            counts[SECONDS] += seconds
+            counts[QUERIES] += queries[0]
+            counts[QUERY_SECONDS] += queries[1]
+            counts[BYTES] += size
+        if time.monotonic() >= self.flush_at:
+            self.flush()
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                    'requests': [[route, status, n] for (route, status), n in self.requests.items()],
+                    'routes': {route: list(i) for route, i in self.routes.items()},
+                    }
+
+    def flush(self):
+        ''' replace this worker's file with its counts '''
+        self.flush_at = time.monotonic() + settings.METRICS_FLUSH_INTERVAL
+        directory = str(settings.METRICS_DIR)
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as file:
+            json.dump(self.snapshot(), file)
+        os.replace(temp_path, os.path.join(directory, self.name))
+
+
+store = Store()
+
+
+def add(requests: dict[tuple[str, int], int], routes: dict[str, list], counts: dict):
+    ''' add the counts of a file '''
+    for route, status, n in counts['requests']:
+        requests[route, status] = requests.get((route, status), 0) + n
+    for route, values in counts['routes'].items():
+        routes[route] = [a + b for a, b in zip(routes[route], values)] if route in routes else values
+
+
+def read(path: str) -> dict | None:
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def exited(name: str) -> bool:
+    ''' if the worker of a file, named by its pid, is no longer running '''
+    pid = name.split('_', 1)[0]
+    if not pid.isdigit() or int(pid) == os.getpid():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass
+    return False
+
+
+def merge_exited(directory: str, names: list[str]) -> list[str]:
+    ''' merge the files of the exited workers into EXITED, return the names left '''
+    dead = [i for i in names if i != EXITED and exited(i)]
+    if not dead:
+        return names
+    requests: dict[tuple[str, int], int] = {}
+    routes: dict[str, list] = {}
+    for name in [EXITED] + dead:
+        counts = read(os.path.join(directory, name))
+        if counts is not None:
+            add(requests, routes, counts)
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'w') as file:
+        json.dump({'requests': [[route, status, n] for (route, status), n in requests.items()], 'routes': routes}, file)
+    os.replace(temp_path, os.path.join(directory, EXITED))
+    for name in dead:
+        os.remove(os.path.join(directory, name))
+    return [i for i in names if i not in dead] + ([] if EXITED in names else [EXITED])
+
+
+def collect() -> tuple[dict[tuple[str, int], int], dict[str, list]]:
+    ''' the counts of every worker, summed '''
+    store.flush()
+    requests: dict[tuple[str, int], int] = {}
+    routes: dict[str, list] = {}
+    directory = str(settings.METRICS_DIR)
+    # one reader at a time, which sees the files of exited workers either
+    # before they are merged or after
+    with open(os.path.join(directory, LOCK), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        names = merge_exited(directory, [i for i in os.listdir(directory) if i.endswith('.json')])
+        for name in names:
+            counts = read(os.path.join(directory, name))
+            if counts is not None:
+                add(requests, routes, counts)
+    return requests, routes
+
+
+def label(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render(requests: dict[tuple[str, int], int], routes: dict[str, list]) -> str:
+    ''' the prometheus text exposition format '''
+    lines = [
+            '# HELP paperlist_requests_total Requests by route and status.',
+            '# TYPE paperlist_requests_total counter',
+            ]
+    for (route, status), n in sorted(requests.items()):
+        lines.append(f'paperlist_requests_total{{route="{label(route)}",status="{status}"}} {n}')
+    lines += [
+            '# HELP paperlist_request_duration_seconds Time until the response is returned, streamed bodies excluded.',
+            '# TYPE paperlist_request_duration_seconds histogram',
+            ]
+    for route, counts in sorted(routes.items()):
+        total = 0
+        for bound, n in zip(BUCKETS + ('+Inf',), counts):
+            total += n
+            lines.append(f'paperlist_request_duration_seconds_bucket{{route="{label(route)}",le="{bound}"}} {total}')
+        lines.append(f'paperlist_request_duration_seconds_sum{{route="{label(route)}"}} {counts[SECONDS]}')
+        lines.append(f'paperlist_request_duration_seconds_count{{route="{label(route)}"}} {total}')
+    for index, name, help_text in [
+            (QUERIES, 'paperlist_db_queries_total', 'SQL queries run by requests.'),
+            (QUERY_SECONDS, 'paperlist_db_query_seconds_total', 'Time spent in the SQL queries of requests.'),
+            (BYTES, 'paperlist_response_bytes_total', 'Bytes of the response bodies of known length.'),
+            ]:
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+        for route, counts in sorted(routes.items()):
+            lines.append(f'{name}{{route="{label(route)}"}} {counts[index]}')
+    return '\n'.join(lines) + '\n'
+
+
+def response_size(response) -> int:
+    ''' streamed bodies count by their Content-Length, 0 if unknown '''
+    if not response.streaming:
+        return len(response.content)
+    return int(response.headers.get('Content-Length', 0))
+
+
+class MetricsMiddleware:
+    ''' the first middleware, so that the others are timed too '''
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        queries = [0, 0.0]
+        token = request_queries.set(queries)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            request_queries.reset(token)
+        self.record(request, response, time.perf_counter() - start, queries)
+        return response
+
+    async def __acall__(self, request):
+        queries = [0, 0.0]
+        token = request_queries.set(queries)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            request_queries.reset(token)
+        self.record(request, response, time.perf_counter() - start, queries)
+        return response
+
+    def record(self, request, response, seconds: float, queries: list):
+        match = request.resolver_match
+        route = match.route if match is not None else UNMATCHED
+        store.record(route, response.status_code, seconds, queries, response_size(response))
@@ -0,0 +1,150 @@
+'''
+micro benchmarks of the building blocks of the views, the serializers, the
+decorator stacks, the hashing of uploads, pdf previews and the metrics
+middleware, see the microbenchmark command
+
+each case reports its time, and the peak of the memory python allocated in
+a separate traced run, mupdf's own allocations are not traced
+'''
+
+import base64
+import io
+import time
+import tracemalloc
+from datetime import date
+
+from django.contrib.auth.models import User
+from django.http import JsonResponse
+from django.test import RequestFactory, override_settings
+
+from .benchmark import make_pdf, store_pdf
+from .decorators import allow_methods, has_json_payload, has_query_params, login_required, paperid_exist, \
+        retry_when_locked, user_can_comment_paper, user_can_view_paper
+from .metrics import MetricsMiddleware
+from .models import Paper, PaperByScholar, PaperSet
+from .uploads import receive_raw_upload
+from .widgets import file_md5
+
+MB = 0x100000
+GROUPS = ['serializers', 'decorators', 'upload', 'preview', 'metrics']
+
+
+def measure(func, repeat: int) -> dict:
+    ''' the mean and best time of repeat runs in ms, and the peak memory in KB '''
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {
+            'mean_ms': round(sum(times) / len(times) * 1000, 3),
+            'min_ms': round(min(times) * 1000, 3),
+            'peak_kb': round(peak / 1024, 1),
+            }
+
+
+def make_paper(user: User, title: str, file_content: str, authors: int) -> Paper:
+    paper = Paper.objects.create(
+            user=user, title=title, abstract='abstract ' * 100, file_name=f'{title}.pdf', file_content=file_content,
+            publication_date=date(2024, 1, 1), journal='journal')
+    PaperByScholar.objects.bulk_create([PaperByScholar(paper=paper, scholar=f'scholar {i}', order=i)
+                                        for i in range(authors)])
+    return paper
+
+
+def serializer_cases(user: User, authors: list[int]):
+    ''' the json of a paper with each number of authors, read from the database each time like the views do '''
+    file_content = store_pdf(make_pdf(1, 'serialized'))
+    paperset = PaperSet.objects.create(user=user, name='paperset', description='description ' * 50)
+    for count in authors:
+        paper = make_paper(user, f'serialized {count}', file_content, count)
+        yield f'Paper.simple_json authors={count}', \
+                lambda paper=paper: Paper.objects.select_related('user').get(pk=paper.id).simple_json
+        yield f'Paper.full_json authors={count}', \
+                lambda paper=paper: Paper.objects.select_related('user').get(pk=paper.id).full_json
+    yield 'PaperSet.json', lambda: PaperSet.objects.select_related('user').get(pk=paperset.id).json
+
+
+def view(request):
+    return JsonResponse({'status': 'ok'})
+
+
+def decorator_cases(user: User):
+    ''' the checks of a read and of a write view, around a view doing nothing '''
+    paper = make_paper(user, 'decorated', store_pdf(make_pdf(1, 'decorated')), 1)
+    factory = RequestFactory()
+    read_view = allow_methods(['GET'])(login_required()(has_query_params(['paperid'])(
+            paperid_exist('GET')(user_can_view_paper()(view)))))
+    write_view = allow_methods(['POST'])(login_required()(has_json_payload()(
+            paperid_exist('POST')(user_can_comment_paper()(retry_when_locked()(view))))))
+
+    def read():
+        request = factory.get('/api/get_paper_review', {'paperid': paper.id})
+        request.user = user
+        return read_view(request)
+
+    def write():
+        request = factory.post('/api/comment_paper', {'paperid': paper.id, 'comment': 'comment'},
+                               content_type='application/json')
+        request.user = user
+        return write_view(request)
+
+    yield 'decorators of get_paper_review', read
+    yield 'decorators of comment_paper', write
+
+
+def upload_cases(sizes: list[int]):
+    '''
+    the md5 of an upload of each size in MB, from base64 in a json payload,
+    decoded whole by file_md5, or from a raw body, streamed to a temporary
+    file by receive_raw_upload
+    '''
+    for size in sizes:
+        content = bytes(size * MB)
+        encoded = base64.b64encode(content).decode()
+        yield f'file_md5 {size} MB', lambda encoded=encoded: file_md5(encoded)
+
+        def stream(content=content):
+            request = io.BytesIO(content)
+            # sizes past the upload limit are measured too
+            with override_settings(MAX_PAPER_UPLOAD_SIZE=len(content)):
+                receive_raw_upload(request).close()
+        yield f'receive_raw_upload {size} MB', stream
+
+
+def preview_cases(user: User, pages: list[int]):
+    ''' the first page of pdfs of each number of pages, rendered each time '''
+    for count in pages:
+        paper = make_paper(user, f'previewed {count}', store_pdf(make_pdf(count, f'previewed {count}')), 1)
+        yield f'Paper.file_bytes_preview pages={count}', paper.file_bytes_preview
+
+
+def metrics_cases():
+    ''' the overhead of the metrics middleware around a view doing nothing '''
+    request = RequestFactory().get('/api/userid')
+    response = JsonResponse({'status': 'ok'})
+    middleware = MetricsMiddleware(lambda request: response)
+
+    def requests():
+        for _ in range(1000):
+            middleware(request)
+    yield 'MetricsMiddleware 1000 requests', requests
+
+
+def run(groups: list[str], repeat: int, authors: list[int], sizes: list[int], pages: list[int]) -> dict[str, dict]:
+    ''' on the current database, which gets a user and a few papers '''
+    user = User.objects.create_user(username='microbenchmark')
+    cases = {
+            'serializers': lambda: serializer_cases(user, authors),
+            'decorators': lambda: decorator_cases(user),
+            'upload': lambda: upload_cases(sizes),
+            'preview': lambda: preview_cases(user, pages),
+            'metrics': metrics_cases,
+            }
+    return {name: measure(func, repeat) for group in groups for name, func in cases[group]()}
@@ -0,0 +1,66 @@
+# Generated by Django 5.0.4 on 2026-10-17 09:12
+
+from django.db import migrations
+
+FTS_TABLE = 'api_paper_fts'
+
+CREATE_SQL = [
+    f'''CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(title, abstract, journal, authors, tokenize = 'unicode61 remove_diacritics 2')''',
+    f'''INSERT INTO {FTS_TABLE} (rowid, title, abstract, journal, authors)
+        SELECT p.id, p.title, p.abstract, p.journal,
+            coalesce((SELECT group_concat(a.scholar, ' ') FROM api_paperbyscholar a WHERE a.paper_id = p.id), '')
+        FROM api_paper p''',
+    f'''CREATE TRIGGER api_paper_fts_insert AFTER INSERT ON api_paper BEGIN
+        INSERT INTO {FTS_TABLE} (rowid, title, abstract, journal, authors)
+        VALUES (new.id, new.title, new.abstract, new.journal, '');
+    END''',
+    f'''CREATE TRIGGER api_paper_fts_update AFTER UPDATE OF title, abstract, journal ON api_paper BEGIN
+        UPDATE {FTS_TABLE} SET title = new.title, abstract = new.abstract, journal = new.journal
+        WHERE rowid = new.id;
+    END''',
+    f'''CREATE TRIGGER api_paper_fts_delete AFTER DELETE ON api_paper BEGIN
+        DELETE FROM {FTS_TABLE} WHERE rowid = old.id;
+    END''',
+]
+# authors live in another table, rebuild the authors column of the paper whenever they change
+for event, row in [('INSERT', 'new'), ('DELETE', 'old'), ('UPDATE', 'new')]:
+    CREATE_SQL.append(f'''CREATE TRIGGER api_paperbyscholar_fts_{event.lower()} AFTER {event} ON api_paperbyscholar BEGIN
+        UPDATE {FTS_TABLE} SET authors = coalesce(
+            (SELECT group_concat(scholar, ' ') FROM api_paperbyscholar WHERE paper_id = {row}.paper_id), '')
+        WHERE rowid = {row}.paper_id;
+    END''')
+
+DROP_SQL = [
+    'DROP TRIGGER IF EXISTS api_paperbyscholar_fts_update',
+    'DROP TRIGGER IF EXISTS api_paperbyscholar_fts_delete',
+    'DROP TRIGGER IF EXISTS api_paperbyscholar_fts_insert',
+    'DROP TRIGGER IF EXISTS api_paper_fts_delete',
+    'DROP TRIGGER IF EXISTS api_paper_fts_update',
+    'DROP TRIGGER IF EXISTS api_paper_fts_insert',
+    f'DROP TABLE IF EXISTS {FTS_TABLE}',
+]
+
+
+def create_fts(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for sql in CREATE_SQL:
+        schema_editor.execute(sql)
+
+
+def drop_fts(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for sql in DROP_SQL:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_papersettextcomments'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts, drop_fts),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.0.4 on 2026-10-17 10:31
+
+import api.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_paper_fts'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='paper',
+            name='file_content',
+            field=models.FileField(db_index=True, storage=api.storage.ContentAddressedStorage(), upload_to=api.storage.content_path),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.0.4 on 2026-10-17 10:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_paper_content_addressed_file'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='paperbyscholar',
+            options={'ordering': ['order', 'id']},
+        ),
+        migrations.AddField(
+            model_name='paperbyscholar',
+            name='order',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.0.4 on 2026-10-17 10:36
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Avg, Count, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def compute_ratings(apps, schema_editor):
+    Paper = apps.get_model('api', 'Paper')
+    PaperStarComments = apps.get_model('api', 'PaperStarComments')
+    stars = PaperStarComments.objects.filter(paper=OuterRef('pk')).order_by().values('paper')
+    Paper.objects.update(
+            star_count=Coalesce(Subquery(stars.annotate(n=Count('id')).values('n')), 0),
+            star_sum=Coalesce(Subquery(stars.annotate(n=Sum('star')).values('n')), 0),
+            rating=Coalesce(Subquery(stars.annotate(n=Avg('star')).values('n')), Value(0.0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_paperbyscholar_order'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paper',
+            name='rating',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='paper',
+            name='star_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='paper',
+            name='star_sum',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='paper',
+            index=models.Index(fields=['-rating', 'id'], name='paper_rating_idx'),
+        ),
+        migrations.RunPython(compute_ratings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.0.4 on 2026-10-17 10:53
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_paper_rating'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='paper',
+            index=models.Index(fields=['title'], name='paper_title_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='paper',
+            index=models.Index(condition=models.Q(('private', True)), fields=['user'], name='paper_private_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='paperbyscholar',
+            index=models.Index(fields=['paper', 'order', 'id'], name='paperbyscholar_order_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='paperset',
+            index=models.Index(condition=models.Q(('private', True)), fields=['user'], name='paperset_private_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='papersetcontent',
+            index=models.Index(fields=['paper_set', 'paper'], name='paperset_content_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='papersettextcomments',
+            index=models.Index(fields=['paperset', 'commented_on', 'id'], name='paperset_comment_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='papertextcomments',
+            index=models.Index(fields=['paper', 'commented_on', 'id'], name='paper_comment_idx'),
+        ),
+    ]
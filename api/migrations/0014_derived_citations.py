@@ -0,0 +1,34 @@
+# Generated by Django 5.0.4 on 2026-10-17 10:55
+
+import django.core.validators
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_citations(apps, schema_editor):
+    ''' total_citations was typed in by the uploader, now it's counted from the citations '''
+    Paper = apps.get_model('api', 'Paper')
+    PaperCited = apps.get_model('api', 'PaperCited')
+    citations = PaperCited.objects.filter(paper=OuterRef('pk')).order_by().values('paper')
+    Paper.objects.update(total_citations=Coalesce(Subquery(citations.annotate(n=Count('id')).values('n')), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='paper',
+            name='total_citations',
+            field=models.IntegerField(default=0, validators=[django.core.validators.MinValueValidator(0, message='citations must be at least 0')]),
+        ),
+        migrations.AddIndex(
+            model_name='papercited',
+            index=models.Index(fields=['cite_paper', 'paper'], name='papercited_citing_idx'),
+        ),
+        migrations.RunPython(count_citations, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.0.4 on 2026-10-17 10:59
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_references(apps, schema_editor):
+    ''' the pageranks are left for compute_pagerank '''
+    Paper = apps.get_model('api', 'Paper')
+    PaperCited = apps.get_model('api', 'PaperCited')
+    references = PaperCited.objects.filter(cite_paper=OuterRef('pk')).order_by().values('cite_paper')
+    Paper.objects.update(reference_count=Coalesce(Subquery(references.annotate(n=Count('id')).values('n')), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_derived_citations'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paper',
+            name='pagerank',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='paper',
+            name='reference_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='paper',
+            index=models.Index(fields=['-pagerank', 'id'], name='paper_pagerank_idx'),
+        ),
+        migrations.RunPython(count_references, migrations.RunPython.noop),
+    ]
@@ -1,13 +1,18 @@
-import base64
-import fitz  # PyMuPDF
+import os
 
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator, MaxValueValidator
-from django.db import models
-from django.db.models import UniqueConstraint, ObjectDoesNotExist
-from django.core.files.base import ContentFile
+from django.db import OperationalError, models
+from django.db.models import Case, F, OuterRef, Q, Subquery, UniqueConstraint, Value, When
+from django.db.models.functions import Cast
+from django.db.models.lookups import GreaterThan
+from django.core.files.base import ContentFile, File
 from django.db import transaction
 
+from .previews import invalidate_previews, preview_path, render_preview
+from .rowcache import outdate_rows, outdate_stamp, read_stamp
+from .storage import content_path, object_storage
 from .widgets import file_md5
 
 class TypedModel(models.Model):
@@ -24,33 +29,56 @@ class Paper(TypedModel):
     # linked to Author by PaperToAuthor
     abstract = models.CharField(max_length=0x20000)
     file_name = models.CharField(max_length=1024)
-    file_content = models.FileField(upload_to='objects/')
+    file_content = models.FileField(upload_to=content_path, storage=object_storage, db_index=True)
     publication_date = models.DateField()
     journal = models.CharField(max_length=1024)
-    total_citations = models.IntegerField(validators=[MinValueValidator(0, message='citations must be at least 0')])
+    # the number of papers citing this one, see citations.py
+    total_citations = models.IntegerField(default=0, validators=[MinValueValidator(0, message='citations must be at least 0')])
+    # the number of papers this one cites
+    reference_count = models.IntegerField(default=0)
+    # influence in the citation graph, computed by compute_pagerank
+    pagerank = models.FloatField(default=0)
     private = models.BooleanField(default=False)
+    # PaperStarComments of this paper, kept up to date by review_paper and
+    # repaired by the repair_ratings command
+    star_count = models.IntegerField(default=0)
+    star_sum = models.IntegerField(default=0)
+    # star_sum / star_count, stored so that it can be indexed
+    rating = models.FloatField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-rating', 'id'], name='paper_rating_idx'),
+            models.Index(fields=['-pagerank', 'id'], name='paper_pagerank_idx'),
+            # duplicate titles are checked on insert
+            models.Index(fields=['title'], name='paper_title_idx'),
+            # if a user has private papers, a few rows of the many
+            models.Index(fields=['user'], condition=Q(private=True), name='paper_private_user_idx'),
+        ]
 
     @property
-    def file_bytes(self):
-        with open(self.file_content.name, 'rb') as file:
-            return file.read()
+    def review(self) -> float:
+        return round(self.rating, 1)
 
     @property
-    def file_bytes_base64(self):
-        return base64.b64encode(self.file_bytes).decode('utf-8')
+    def content_id(self):
+        ''' files are named by the md5 of their content '''
+        return os.path.basename(self.file_content.name)
+
+    @property
+    def file_etag(self):
+        return f'"{self.content_id}"'
 
     def file_bytes_preview(self, num_pages: int = 1):
-        document = fitz.open(self.file_content.name)
-        new_pdf = fitz.open()
-        for page_num in range(min(num_pages, len(document))):
-            new_pdf.insert_pdf(document, from_page=page_num, to_page=page_num)
-        pdf_bytes = new_pdf.tobytes()
-        new_pdf.close()
-        document.close()
-        return pdf_bytes
+        return render_preview(self.file_content.path, 0, num_pages - 1)
+
+    def file_preview_path(self, first: int, last: int) -> str:
+        ''' cached preview of pages first to last, 0-based and inclusive, up to the last page '''
+        return preview_path(self.file_content.path, self.content_id, first, last)
 
     @property
     def full_json(self):
+        ''' the file is described by its hash and size, not inlined '''
         return {
                 'paperid': str(self.id),
                 'userid': str(self.user.id),
@@ -58,12 +86,13 @@ class Paper(TypedModel):
                 'title': self.title,
                 'abstract': self.abstract,
                 'file_name': self.file_name,
-                'file_content': self.file_bytes_base64,
+                'file_md5': self.content_id,
+                'file_size': os.path.getsize(self.file_content.path),
                 'publication_date': str(self.publication_date),
                 'journal': self.journal,
                 'total_citations': self.total_citations,
                 'is_private': self.private,
-                'authors': [i.scholar for i in PaperByScholar.objects.filter(paper=self)]
+                'authors': [i.scholar for i in self.paperbyscholar_set.all()]
                 }
 
     @property
@@ -78,79 +107,189 @@ class Paper(TypedModel):
                 'journal': self.journal,
                 'total_citations': self.total_citations,
                 'is_private': self.private,
-                'authors': [i.scholar for i in PaperByScholar.objects.filter(paper=self)]
+                'authors': [i.scholar for i in self.paperbyscholar_set.all()]
                 }
 
-    def try_change_to(self, json_payload: dict[str, str]) -> tuple[bool, str]:
+    def set_authors(self, authors: list[str]) -> bool:
+        '''
+        make authors, in this order, the authors of this saved paper, return if
+        anything changed
+        reads the current authors once, then at most one bulk delete, one bulk
+        insert and one bulk update of the order
+        '''
+        # a name is an author once
+        authors = list(dict.fromkeys(authors))
+        current: dict[str, PaperByScholar] = {}
+        stale: list[int] = []
+        for i in PaperByScholar.objects.filter(paper=self):
+            if i.scholar in current or i.scholar not in authors:
+                stale.append(i.id)
+            else:
+                current[i.scholar] = i
+        created: list[PaperByScholar] = []
+        reordered: list[PaperByScholar] = []
+        for order, scholar in enumerate(authors):
+            if scholar not in current:
+                created.append(PaperByScholar(paper=self, scholar=scholar, order=order))
+            elif current[scholar].order != order:
+                current[scholar].order = order
+                reordered.append(current[scholar])
+        if stale:
+            PaperByScholar.objects.filter(id__in=stale).delete()
+        if created:
+            PaperByScholar.objects.bulk_create(created)
+        if reordered:
+            PaperByScholar.objects.bulk_update(reordered, ['order'])
+        if stale or created or reordered:
+            bump_generation()
+            return True
+        return False
+
+    def try_change_to(self, json_payload: dict[str, str], uploaded_file: File | None = None) -> tuple[bool, str]:
         '''
         an input from json_payload, trying to change to that, return if changed,
-        will save()
+        will save() the changed fields only, leaving the counts and scores other
+        requests and commands update
+        the new file is uploaded_file if given, named by its md5, or the base64
+        in file_content
         return error message if any errors occurred
         '''
-        modified = False
+        changed: list[str] = []
         # change title
         title = json_payload.get('title')
         if title and title != self.title:
             self.title = title
-            modified = True
+            changed.append('title')
         # change abstract
         abstract = json_payload.get('abstract')
         if abstract and abstract != self.abstract:
             self.abstract = abstract
-            modified = True
+            changed.append('abstract')
         # change file_name
         file_name = json_payload.get('file_name')
         if file_name and file_name != self.file_name:
             self.file_name = file_name
-            modified = True
+            changed.append('file_name')
         # change file_content
         file_content = json_payload.get('file_content')
-        if file_content:
+        replaced_name = None
+        if uploaded_file is not None:
+            if self.content_id != uploaded_file.name:
+                replaced_name = self.file_content.name
+                self.file_content = uploaded_file
+                changed.append('file_content')
+        elif file_content:
             file_binary, file_name = file_md5(file_content)
-            if self.file_content.name != file_name:
+            if self.content_id != file_name:
+                replaced_name = self.file_content.name
                 self.file_content = ContentFile(content=file_binary, name=file_name)
-                modified = True
+                changed.append('file_content')
         # change publication_date
         publication_date = json_payload.get('publication_date')
         if publication_date and publication_date != self.publication_date:
             self.publication_date = publication_date
-            modified = True
+            changed.append('publication_date')
         # change journal
         journal = json_payload.get('journal')
         if journal and journal != self.journal:
             self.journal = journal
-            modified = True
-        # change total_citations
-        total_citations = json_payload.get('total_citations')
-        if total_citations and total_citations != self.total_citations:
-            self.total_citations = total_citations
-            modified = True
+            changed.append('journal')
         # change private
         private = json_payload.get('private')
         if private and private != self.private:
             self.private = private
-            modified = True
+            changed.append('private')
         authors = json_payload.get('authors')
+        modified = bool(changed)
         try:
             with transaction.atomic():
-                if authors is not None:
-                    for i in authors:
-                        try:
-                            PaperByScholar.objects.get(paper=self, scholar=i)
-                        except ObjectDoesNotExist:
-                            PaperByScholar.objects.create(paper=self, scholar=i)
-                            modified = True
-                    for i in PaperByScholar.objects.filter(paper=self):
-                        if i.scholar not in authors:
-                            i.delete()
-                            modified = True
-                if modified:
-                    self.save()
+                if authors is not None and self.set_authors(authors):
+                    modified = True
+                if changed:
+                    self.save(update_fields=changed)
+        except OperationalError:
+            # a locked database is retried by the view
+            raise
         except Exception as err:
             return modified, f'exception occured: {err}'
+        if replaced_name:
+            invalidate_previews(os.path.basename(replaced_name))
+            transaction.on_commit(lambda: release_file(replaced_name))
         return modified, ''
 
 
+def add_stars(paper_id: int, count_delta: int, sum_delta: int):
+    ''' change the rating aggregates of a paper in one UPDATE '''
+    star_count = F('star_count') + count_delta
+    star_sum = F('star_sum') + sum_delta
+    Paper.objects.filter(pk=paper_id).update(
+            star_count=star_count,
+            star_sum=star_sum,
+            rating=Case(
+                When(GreaterThan(star_count, 0), then=Cast(star_sum, models.FloatField()) / star_count),
+                default=Value(0.0)))
+    bump_generation()
+    outdate_rows()
+
+
+def remove_stars_of(user_id: int):
+    '''
+    take the reviews of a user out of the rating aggregates of the papers, in
+    one UPDATE of every paper reviewed, a user reviews a paper once
+    '''
+    reviews = PaperStarComments.objects.filter(user_id=user_id)
+    star_count = F('star_count') - 1
+    star_sum = F('star_sum') - Subquery(reviews.filter(paper=OuterRef('pk')).values('star'))
+    updated = Paper.objects.filter(pk__in=reviews.values('paper')).update(
+            star_count=star_count,
+            star_sum=star_sum,
+            rating=Case(
+                When(GreaterThan(star_count, 0), then=Cast(star_sum, models.FloatField()) / star_count),
+                default=Value(0.0)))
+    if updated:
+        bump_generation()
+        outdate_rows()
+
+
+def review_paper(paper: Paper, user: User, star: int) -> bool:
+    ''' star the paper as user, return if a previous review was changed '''
+    with transaction.atomic():
+        review = PaperStarComments.objects.filter(paper=paper, user=user).first()
+        if review is None:
+            PaperStarComments.objects.create(paper=paper, user=user, star=star)
+            add_stars(paper.id, 1, star)
+            return False
+        if review.star != star:
+            add_stars(paper.id, 0, star - review.star)
+            review.star = star
+            review.save(update_fields=['star'])
+        return True
+
+
+def release_file(name: str):
+    '''
+    remove a stored file once no paper refers to it, files saved or reused
+    within the grace period are left for gc_objects
+    '''
+    if Paper.objects.filter(file_content=name).exists() or not object_storage.is_stale(name):
+        return
+    object_storage.delete(name)
+    invalidate_previews(os.path.basename(name))
+
+
+def generation() -> str:
+    '''
+    the token of the cached search responses, read from a stamp file shared
+    by the workers, not queried on every cache hit
+    '''
+    return read_stamp(settings.SEARCH_CACHE_STAMP)
+
+
+def bump_generation():
+    ''' outdate every response cached under the current token '''
+    outdate_stamp(settings.SEARCH_CACHE_STAMP)
+
+
 #class Scholar(TypedModel):
 #    name = models.CharField(max_length=1024)
 #    email = models.CharField(max_length=1024)
@@ -160,10 +299,19 @@ class PaperByScholar(TypedModel):
     ''' paper created by scholar '''
     paper = models.ForeignKey(Paper, on_delete=models.CASCADE)
     scholar = models.CharField(max_length=256)
+    # position in the author list
+    order = models.PositiveIntegerField(default=0)
     # scholar = models.ForeignKey(Scholar, on_delete=models.CASCADE)
     # 1st, or comu...
     # scholar_role = models.CharField(max_length=256)
 
+    class Meta:
+        ordering = ['order', 'id']
+        indexes = [
+            # the authors of papers in order, without sorting them
+            models.Index(fields=['paper', 'order', 'id'], name='paperbyscholar_order_idx'),
+        ]
+
 
 class PaperCited(TypedModel):
     ''' the cite_paper cites paper '''
@@ -174,6 +322,10 @@ class PaperCited(TypedModel):
         constraints = [
             UniqueConstraint(fields=['paper', 'cite_paper'], name='unique_paper_cites')
         ]
+        indexes = [
+            # the papers a paper cites, in order
+            models.Index(fields=['cite_paper', 'paper'], name='papercited_citing_idx'),
+        ]
 
 
 
@@ -187,6 +339,11 @@ class PaperSet(TypedModel):
     can_comment = models.BooleanField(default=True)
     # tags = models.CharField(max_length=4096, null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user'], condition=Q(private=True), name='paperset_private_user_idx'),
+        ]
+
     @property
     def json(self):
         return {
@@ -210,6 +367,10 @@ class PaperSetContent(TypedModel):
         constraints = [
             UniqueConstraint(fields=['paper', 'paper_set'], name='unique_paper_in_sets')
         ]
+        indexes = [
+            # the papers of a paperset, without reading the rows
+            models.Index(fields=['paper_set', 'paper'], name='paperset_content_idx'),
+        ]
 
 
 class PaperSetTextComments(TypedModel):
@@ -219,6 +380,12 @@ class PaperSetTextComments(TypedModel):
     comment = models.CharField(max_length=4096)
     commented_on = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # a page of comments in order, without sorting them
+            models.Index(fields=['paperset', 'commented_on', 'id'], name='paperset_comment_idx'),
+        ]
+
     @property
     def json(self):
         return {
@@ -237,6 +404,12 @@ class PaperTextComments(TypedModel):
     comment = models.CharField(max_length=4096)
     commented_on = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # a page of comments in order, without sorting them
+            models.Index(fields=['paper', 'commented_on', 'id'], name='paper_comment_idx'),
+        ]
+
     @property
     def json(self):
         return {
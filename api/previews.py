@@ -0,0 +1,105 @@
+'''
+disk cache of pdf previews, keyed by the md5 of the paper's content and the
+page range, least recently used previews are removed when the cache grows
+past settings.PREVIEW_CACHE_SIZE
+'''
+
+import glob
+import os
+import tempfile
+import time
+from functools import lru_cache
+
+import fitz  # PyMuPDF
+from django.conf import settings
+
+# a preview that was just used is never evicted, so a worker can still open
+# the file it is about to send
+EVICTION_GRACE_SECONDS = 60
+
+
+def render_preview(source: str, first: int, last: int) -> bytes:
+    ''' a new pdf of pages first to last (0-based, inclusive) of source '''
+    document = fitz.open(source)
+    new_pdf = fitz.open()
+    last = min(last, len(document) - 1)
+    if first <= last:
+        new_pdf.insert_pdf(document, from_page=first, to_page=last)
+    pdf_bytes = new_pdf.tobytes()
+    new_pdf.close()
+    document.close()
+    return pdf_bytes
+
+
+def cache_dir() -> str:
+    directory = str(settings.PREVIEW_CACHE_DIR)
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def preview_name(content_id: str, first: int, last: int) -> str:
+    return f'{content_id}_{first}_{last}.pdf'
+
+
+@lru_cache(maxsize=4096)
+def page_count(source: str, content_id: str) -> int:
+    ''' of the pdf named by the md5 of its content, which never changes '''
+    with fitz.open(source) as document:
+        return len(document)
+
+
+def preview_path(source: str, content_id: str, first: int, last: int) -> str:
+    '''
+    path of the cached preview, render and cache it on a miss, last is
+    clamped to the last page first, so every range past the end is one preview
+    '''
+    last = min(last, page_count(source, content_id) - 1)
+    path = os.path.join(cache_dir(), preview_name(content_id, first, last))
+    try:
+        # mark as recently used
+        os.utime(path)
+        return path
+    except FileNotFoundError:
+        pass
+    pdf_bytes = render_preview(source, first, last)
+    # write then rename, other workers never see a half written preview
+    fd, temp_path = tempfile.mkstemp(dir=cache_dir(), suffix='.tmp')
+    with os.fdopen(fd, 'wb') as file:
+        file.write(pdf_bytes)
+    os.replace(temp_path, path)
+    evict(settings.PREVIEW_CACHE_SIZE)
+    return path
+
+
+def evict(max_size: int):
+    ''' remove least recently used previews until the cache fits in max_size bytes '''
+    entries = []
+    for i in os.scandir(cache_dir()):
+        if not i.name.endswith('.pdf'):
+            continue
+        try:
+            stat = i.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, i.path))
+    total = sum(i[1] for i in entries)
+    if total <= max_size:
+        return
+    now = time.time()
+    for mtime, size, path in sorted(entries):
+        if total <= max_size or now - mtime < EVICTION_GRACE_SECONDS:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def invalidate_previews(content_id: str):
+    ''' remove every cached preview of this content '''
+    for path in glob.glob(os.path.join(cache_dir(), glob.escape(f'{content_id}_') + '*.pdf')):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
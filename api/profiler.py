@@ -0,0 +1,200 @@
+'''
+profile a sampled fraction of requests, settings.PROFILE_SAMPLE_RATE, and
+the requests of staff users sending an X-Profile: 1 header, when
+settings.PROFILER_ENABLED
+
+every call and return of the thread running the request is recorded, with
+the decorators, the view, serialization and the queries, and written to
+settings.PROFILE_DIR as a speedscope evented profile, open it at
+https://www.speedscope.app, next to the sql of the request, the newest
+settings.PROFILE_KEEP profiles are kept, the response names them in its
+X-Profile-Id header, only the user running the server can read them, and the
+params of the queries of users and sessions, with password hashes and session
+keys, are left out
+
+async views are run from a thread for the profile, the sync_to_async parts,
+the checks and queries, run in that thread and are profiled, the coroutine
+in between runs on the event loop and shows as time waiting for it
+'''
+
+import json
+import os
+import random
+import sys
+import time
+from uuid import uuid4
+
+from asgiref.sync import async_to_sync, iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+
+HEADER = 'X-Profile'
+SPEEDSCOPE_SCHEMA = 'https://www.speedscope.app/file-format-schema.json'
+# the tables whose query params are not written
+SECRET_TABLES = (User._meta.db_table, Session._meta.db_table)
+REDACTED = '(redacted)'
+
+
+class Tracer:
+    ''' a profile function of sys.setprofile, recording when each frame opens and closes '''
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.frames: list[dict] = []
+        self.index: dict[tuple, int] = {}
+        # (O or C, frame, ms)
+        self.events: list[tuple[str, int, float]] = []
+        self.stack: list[int] = []
+
+    def now(self) -> float:
+        return (time.perf_counter() - self.start) * 1000
+
+    def frame(self, key: tuple[str, str, int]) -> int:
+        index = self.index.get(key)
+        if index is None:
+            index = self.index[key] = len(self.frames)
+            name, file, line = key
+            self.frames.append({'name': name, 'file': file, 'line': line} if file else {'name': name})
+        return index
+
+    def __call__(self, frame, event: str, arg):
+        if event == 'call':
+            code = frame.f_code
+            key = (code.co_qualname, code.co_filename, code.co_firstlineno)
+        elif event == 'c_call':
+            key = (f'{getattr(arg, "__module__", None) or "builtins"}.{getattr(arg, "__qualname__", arg)}', '', 0)
+        else:
+            # the frames open before the profile began return without a call
+            if self.stack:
+                self.events.append(('C', self.stack.pop(), self.now()))
+            return
+        index = self.frame(key)
+        self.stack.append(index)
+        self.events.append(('O', index, self.now()))
+
+    def run(self, func, *args):
+        sys.setprofile(self)
+        try:
+            return func(*args)
+        finally:
+            sys.setprofile(None)
+            end = self.now()
+            while self.stack:
+                self.events.append(('C', self.stack.pop(), end))
+
+    def speedscope(self, name: str) -> dict:
+        end = self.events[-1][2] if self.events else 0
+        return {
+                '$schema': SPEEDSCOPE_SCHEMA,
+                'name': name,
+                'exporter': 'paperlist-backend',
+                'shared': {'frames': self.frames},
+                'profiles': [{
+                    'type': 'evented',
+                    'name': name,
+                    'unit': 'milliseconds',
+                    'startValue': 0,
+                    'endValue': end,
+                    'events': [{'type': kind, 'frame': frame, 'at': at} for kind, frame, at in self.events],
+                    }],
+                }
+
+
+def redact(sql: str, params) -> str:
+    if any(table in sql for table in SECRET_TABLES):
+        return REDACTED
+    return repr(params)
+
+
+class QueryLog:
+    ''' execute wrapper keeping the sql of the request '''
+
+    def __init__(self, tracer: Tracer):
+        self.tracer = tracer
+        self.queries: list[tuple[float, float, str, str]] = []
+
+    def __call__(self, execute, sql, params, many, context):
+        at = self.tracer.now()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((at, self.tracer.now() - at, sql, redact(sql, params)))
+
+    def text(self) -> str:
+        return ''.join(f'-- at {at:.3f} ms, took {took:.3f} ms, params {params}\n{sql};\n\n'
+                       for at, took, sql, params in self.queries)
+
+
+def rotate(directory: str):
+    ''' remove the oldest profiles past settings.PROFILE_KEEP '''
+    names = sorted(i.removesuffix('.speedscope.json') for i in os.listdir(directory) if i.endswith('.speedscope.json'))
+    for name in names[:max(0, len(names) - settings.PROFILE_KEEP)]:
+        for suffix in ['.speedscope.json', '.sql']:
+            try:
+                os.remove(os.path.join(directory, name + suffix))
+            except FileNotFoundError:
+                pass
+
+
+def private_file(path: str):
+    ''' a new file only its owner can read '''
+    return os.fdopen(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), 'w')
+
+
+def save(request, tracer: Tracer, queries: QueryLog) -> str:
+    ''' write the profile and the sql, return their name '''
+    directory = str(settings.PROFILE_DIR)
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    # made before, or with a umask taking more away
+    os.chmod(directory, 0o700)
+    title = f'{request.method} {request.get_full_path()}'
+    # sorted by time, then rotated oldest first
+    now = time.time()
+    name = f'{time.strftime("%Y%m%dT%H%M%S", time.gmtime(now))}.{int(now % 1 * 10 ** 6):06d}_{uuid4().hex[:8]}'
+    with private_file(os.path.join(directory, f'{name}.sql')) as file:
+        file.write(f'-- {title}\n\n{queries.text()}')
+    with private_file(os.path.join(directory, f'{name}.speedscope.json')) as file:
+        json.dump(tracer.speedscope(title), file)
+    rotate(directory)
+    return name
+
+
+def sampled() -> bool:
+    return random.random() < settings.PROFILE_SAMPLE_RATE
+
+
+class ProfilerMiddleware:
+    ''' after the authentication middleware, which the header check needs '''
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.PROFILER_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if sampled() or (request.headers.get(HEADER) == '1' and request.user.is_staff):
+            return self.profile(request, self.get_response)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        if sampled() or (request.headers.get(HEADER) == '1' and (await request.auser()).is_staff):
+            return await sync_to_async(self.profile)(request, async_to_sync(self.get_response))
+        return await self.get_response(request)
+
+    def profile(self, request, get_response):
+        tracer = Tracer()
+        queries = QueryLog(tracer)
+        with connection.execute_wrapper(queries):
+            response = tracer.run(get_response, request)
+        response[f'{HEADER}-Id'] = save(request, tracer, queries)
+        return response
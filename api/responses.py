@@ -0,0 +1,138 @@
+''' file responses that stream from disk instead of loading whole files '''
+
+import base64
+import json
+import os
+import re
+from http import HTTPStatus
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.http import content_disposition_header, parse_etags
+
+CHUNK_SIZE = 0x10000  # 64 KB
+# a multiple of 3 bytes, so base64 chunks can be concatenated
+BASE64_CHUNK_SIZE = 3 * 0x4000  # 48 KB
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def parse_range(header: str, size: int) -> tuple[int, int] | None:
+    '''
+    the first and last byte asked for by a single range Range header
+    return None if the header should be ignored, raise ValueError if the
+    range can't be satisfied
+    '''
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        # multiple ranges or other units, answer with the whole file
+        return None
+    first, last = match.groups()
+    if first == '' and last == '':
+        return None
+    if first == '':
+        # suffix range, the last n bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError('empty suffix range')
+        return max(0, size - length), size - 1
+    first = int(first)
+    last = size - 1 if last == '' else min(int(last), size - 1)
+    if first > last:
+        raise ValueError('range not satisfiable')
+    return first, last
+
+
+def read_chunks(path: str, first: int, length: int):
+    with open(path, 'rb') as file:
+        file.seek(first)
+        while length > 0:
+            chunk = file.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                return
+            length -= len(chunk)
+            yield chunk
+
+
+async def aread_chunks(path: str, first: int, length: int, chunk_size: int = CHUNK_SIZE):
+    ''' read_chunks for asgi, the file is read in worker threads, not the event loop '''
+    file = await sync_to_async(open, thread_sensitive=False)(path, 'rb')
+    try:
+        await sync_to_async(file.seek, thread_sensitive=False)(first)
+        while length > 0:
+            chunk = await sync_to_async(file.read, thread_sensitive=False)(min(chunk_size, length))
+            if not chunk:
+                return
+            length -= len(chunk)
+            yield chunk
+    finally:
+        file.close()
+
+
+def file_response(request, path: str, etag: str, file_name: str, content_type: str = 'application/pdf') -> HttpResponse:
+    '''
+    serve the file at path with a strong etag, a matching If-None-Match gets
+    304, a Range header gets 206 with only that part of the file
+    under asgi the file is streamed by an async iterator, so a slow client
+    holds no thread
+    '''
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match and (etag in parse_etags(if_none_match) or if_none_match.strip() == '*'):
+        response = HttpResponse(status=HTTPStatus.NOT_MODIFIED)
+        response.headers['ETag'] = etag
+        return response
+    size = os.path.getsize(path)
+    byte_range = None
+    range_header = request.headers.get('Range')
+    # If-Range: only honour the range if the client has the current version
+    if range_header and request.headers.get('If-Range', etag) == etag:
+        try:
+            byte_range = parse_range(range_header, size)
+        except ValueError:
+            response = HttpResponse(status=HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+            response.headers['Content-Range'] = f'bytes */{size}'
+            return response
+    asynchronous = isinstance(request, ASGIRequest)
+    if byte_range is None and not asynchronous:
+        # FileResponse hands the file to wsgi.file_wrapper, which may use sendfile
+        response = FileResponse(open(path, 'rb'), content_type=content_type, filename=file_name)
+    else:
+        first, last = byte_range or (0, size - 1)
+        chunks = (aread_chunks if asynchronous else read_chunks)(path, first, last - first + 1)
+        if byte_range is None:
+            response = StreamingHttpResponse(chunks, content_type=content_type)
+            response.headers['Content-Disposition'] = content_disposition_header(False, file_name)
+        else:
+            response = StreamingHttpResponse(chunks, content_type=content_type, status=HTTPStatus.PARTIAL_CONTENT)
+            response.headers['Content-Range'] = f'bytes {first}-{last}/{size}'
+        response.headers['Content-Length'] = str(last - first + 1)
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.headers['ETag'] = etag
+    return response
+
+
+def json_with_file_response(request, data: dict, field: str, path: str) -> StreamingHttpResponse:
+    '''
+    {"status": "ok", "data": data} with the file at path in data[field] as
+    base64, encoded chunk by chunk as the response is sent, by an async
+    iterator under asgi
+    '''
+    # field is the last key, its empty string value ends with the opening
+    # quote of the base64 string, which closes with the tail
+    head = json.dumps({'status': 'ok', 'data': {**data, field: ''}}, cls=DjangoJSONEncoder)
+    tail = '"}}'
+
+    def stream():
+        yield head[:-len(tail)]
+        with open(path, 'rb') as file:
+            while chunk := file.read(BASE64_CHUNK_SIZE):
+                yield base64.b64encode(chunk)
+        yield tail
+
+    async def astream():
+        yield head[:-len(tail)]
+        async for chunk in aread_chunks(path, 0, os.path.getsize(path), BASE64_CHUNK_SIZE):
+            yield base64.b64encode(chunk)
+        yield tail
+    return StreamingHttpResponse(astream() if isinstance(request, ASGIRequest) else stream(), content_type='application/json')
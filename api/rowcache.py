@@ -0,0 +1,91 @@
+'''
+in process cache of the rows loaded by the permission decorators, with the
+owner's id and username, every worker drops its rows when a write replaces
+the version stamp, a small file shared by the workers
+'''
+
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from uuid import uuid4
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import DEFAULT_DB_ALIAS, models, transaction
+
+
+def read_stamp(path: str) -> str:
+    ''' the version in a stamp file, shared by the workers of a host '''
+    try:
+        with open(path) as file:
+            return file.read()
+    except FileNotFoundError:
+        return ''
+
+
+def write_stamp(path: str):
+    ''' replace the version, at once for every reader '''
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'w') as file:
+        file.write(uuid4().hex)
+    os.replace(temp_path, path)
+
+
+def outdate_stamp(path: str):
+    '''
+    replace the version now and again once the write is committed, a worker
+    may have cached what the write replaces in between
+    '''
+    write_stamp(path)
+    transaction.on_commit(lambda: write_stamp(path))
+
+
+def outdate_rows():
+    ''' drop the cached rows of every worker '''
+    outdate_stamp(settings.ROW_CACHE_STAMP)
+
+
+class RowCache:
+    ''' the settings.ROW_CACHE_SIZE least recently used rows of model '''
+
+    def __init__(self, model: type[models.Model]):
+        self.model = model
+        self.rows: OrderedDict[int, tuple] = OrderedDict()
+        self.stamp = None
+        self.lock = threading.Lock()
+
+    def load(self, pk: int) -> tuple:
+        instance = self.model.objects.select_related('user').get(pk=pk)
+        values = tuple(getattr(instance, i.attname) for i in self.model._meta.concrete_fields)
+        return values, instance.user.username
+
+    def get(self, pk: int) -> models.Model:
+        '''
+        a new instance of the row each time, with its user loaded with only
+        id and username, raise model.DoesNotExist like objects.get
+        '''
+        size = settings.ROW_CACHE_SIZE
+        stamp = read_stamp(settings.ROW_CACHE_STAMP)
+        with self.lock:
+            if stamp != self.stamp:
+                self.rows.clear()
+                self.stamp = stamp
+            row = self.rows.get(pk)
+            if row is not None:
+                self.rows.move_to_end(pk)
+        if row is None:
+            row = self.load(pk)
+            # not kept if a write came while loading, or if the row was read
+            # in a transaction, which may yet be rolled back
+            fresh = read_stamp(settings.ROW_CACHE_STAMP) == stamp and not transaction.get_connection().in_atomic_block
+            with self.lock:
+                if size > 0 and fresh and stamp == self.stamp:
+                    self.rows[pk] = row
+                    while len(self.rows) > size:
+                        self.rows.popitem(last=False)
+        values, username = row
+        names = [i.attname for i in self.model._meta.concrete_fields]
+        instance = self.model.from_db(DEFAULT_DB_ALIAS, names, values)
+        instance.user = User.from_db(DEFAULT_DB_ALIAS, ['id', 'username'], [instance.user_id, username])
+        return instance
@@ -0,0 +1,29 @@
+''' serialize a whole page of model objects with a fixed number of queries '''
+
+from typing import Iterable
+
+from django.db.models import prefetch_related_objects
+
+from .models import Paper, PaperSet, PaperSetTextComments, PaperTextComments
+
+
+def paper_list_json(papers: Iterable[Paper]) -> list[dict]:
+    '''
+    simple_json of every paper, the uploader and the authors are loaded
+    with one query each no matter how many papers there are
+    '''
+    papers = list(papers)
+    prefetch_related_objects(papers, 'user', 'paperbyscholar_set')
+    return [i.simple_json for i in papers]
+
+
+def paperset_list_json(papersets: Iterable[PaperSet]) -> list[dict]:
+    papersets = list(papersets)
+    prefetch_related_objects(papersets, 'user')
+    return [i.json for i in papersets]
+
+
+def comment_list_json(comments: Iterable[PaperTextComments | PaperSetTextComments]) -> list[dict]:
+    comments = list(comments)
+    prefetch_related_objects(comments, 'user')
+    return [i.json for i in comments]
@@ -0,0 +1,80 @@
+''' signal receivers, connected in ApiConfig.ready '''
+
+from django.contrib.auth.models import User
+from django.contrib.auth.signals import user_logged_out
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_migrate, post_save, pre_delete
+from django.dispatch import receiver
+
+from .backends import forget_user
+from .citations import uncount_citations_of
+from .database import apply_pragmas
+from .fts import ensure_fts_triggers
+from .metrics import record_query
+from .rowcache import outdate_rows
+from .models import Paper, PaperSet, bump_generation, release_file, remove_stars_of
+
+
+@receiver(pre_delete, sender=Paper)
+def uncount_deleted_citations(sender, instance: Paper, **kwargs):
+    # before the citations are deleted with the paper
+    uncount_citations_of(instance)
+
+
+@receiver(post_delete, sender=Paper)
+def release_deleted_paper_file(sender, instance: Paper, **kwargs):
+    name = instance.file_content.name
+    if name:
+        transaction.on_commit(lambda: release_file(name))
+
+
+@receiver(post_migrate)
+def restore_fts_triggers(sender, using: str, **kwargs):
+    if sender.name == 'api':
+        ensure_fts_triggers(using)
+
+
+@receiver(pre_delete, sender=User)
+def remove_deleted_stars(sender, instance: User, **kwargs):
+    # reviews are only deleted with their user, whose stars are taken out
+    # before, or with the paper, which then needs no update, a receiver of
+    # PaperStarComments would make the deletion send one update per review
+    remove_stars_of(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Paper)
+@receiver([post_save, post_delete], sender=PaperSet)
+def outdate_search_responses(sender, **kwargs):
+    # bulk writes, which send no signals, bump the generation themselves
+    bump_generation()
+    outdate_rows()
+
+
+@receiver([post_save, post_delete], sender=User)
+def outdate_owner_rows(sender, update_fields=None, **kwargs):
+    # cached rows and search responses keep their owner's username, and
+    # searches filter by it, logging in only sets last_login
+    if update_fields is None or 'username' in update_fields:
+        bump_generation()
+        outdate_rows()
+
+
+@receiver([post_save, post_delete], sender=User)
+def forget_cached_user(sender, instance: User, **kwargs):
+    # a new password, a deleted account by logoff, or any other change
+    forget_user(instance.pk)
+
+
+@receiver(user_logged_out)
+def forget_logged_out_user(sender, user: User | None, **kwargs):
+    if user is not None:
+        forget_user(user.pk)
+
+
+@receiver(connection_created)
+def configure_connection(sender, connection, **kwargs):
+    connection.execute_wrappers.append(record_query)
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            apply_pragmas(cursor)
@@ -0,0 +1,16 @@
+'''
+the sqlite backend, where the transactions of the write views begin
+immediately, taking the write lock first and waiting for it up to the busy
+timeout, a deferred transaction reading first fails at once when it tries to
+write while another connection writes
+'''
+
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    # set by retry_when_locked while it opens the transaction of a view
+    begin_immediate = False
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute('BEGIN IMMEDIATE' if self.begin_immediate else 'BEGIN')
@@ -0,0 +1,79 @@
+'''
+content addressed storage for paper files, a file is stored once under the
+md5 of its content, in objects/<2 hex>/<2 hex>/<md5> so no directory grows
+too large
+'''
+
+import os
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+OBJECTS_DIR = 'objects'
+
+
+def object_name(content_md5: str) -> str:
+    return f'{OBJECTS_DIR}/{content_md5[:2]}/{content_md5[2:4]}/{content_md5}'
+
+
+def content_path(instance, filename: str) -> str:
+    ''' upload_to of paper files, which are always named by their md5 '''
+    return object_name(filename)
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    '''
+    a name is the hash of the content, so saving a name that exists keeps the
+    stored file instead of writing a copy under another name
+    '''
+
+    def get_available_name(self, name, max_length=None):
+        return name
+
+    def _save(self, name, content):
+        full_path = self.path(name)
+        if os.path.exists(full_path):
+            # mark as in use, so it isn't removed as unreferenced before the
+            # paper referring to it is committed
+            os.utime(full_path)
+            return name
+        directory = os.path.dirname(full_path)
+        os.makedirs(directory, exist_ok=True)
+        # move or write next to the destination, then rename, other writers
+        # of the same content can only ever replace it with the same bytes
+        if hasattr(content, 'temporary_file_path'):
+            file_move_safe(content.temporary_file_path(), full_path, allow_overwrite=True)
+        else:
+            fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as file:
+                for chunk in content.chunks():
+                    file.write(chunk)
+            os.replace(temp_path, full_path)
+        if self.file_permissions_mode is not None:
+            os.chmod(full_path, self.file_permissions_mode)
+        return name
+
+    def is_stale(self, name: str, grace: int | None = None) -> bool:
+        ''' not saved or used within grace seconds, settings.OBJECT_STORE_GRACE_SECONDS by default '''
+        if grace is None:
+            grace = settings.OBJECT_STORE_GRACE_SECONDS
+        try:
+            age = time.time() - os.path.getmtime(self.path(name))
+        except FileNotFoundError:
+            return False
+        return age >= grace
+
+    def iter_objects(self):
+        ''' names of every stored file '''
+        root = self.path(OBJECTS_DIR)
+        for directory, _, files in os.walk(root):
+            for i in files:
+                yield os.path.relpath(os.path.join(directory, i), self.location).replace('\\', '/')
+
+
+object_storage = ContentAddressedStorage()
@@ -1,3 +1,1576 @@
-from django.test import TestCase
+import base64
+import json
+import os
+import re
+import sqlite3
+import tempfile
+from array import array
+from datetime import date
+from hashlib import md5
+from io import StringIO
+from unittest import mock
+from urllib.parse import quote
 
-# Create your tests here.
+import fitz  # PyMuPDF
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import OperationalError, connection, transaction
+from django.http import JsonResponse, QueryDict
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from . import benchmark, metrics, microbench, pagerank, profiler
+from .benchmark import make_pdf
+from .cache import search_cache
+from .database import apply_pragmas
+from .fts import fts_match, fts_rank
+from .decorators import retry_when_locked
+from .models import Paper, PaperByScholar, PaperCited, PaperSet, PaperSetContent, PaperTextComments, \
+        PaperSetTextComments, PaperStarComments
+from .previews import evict
+from .rowcache import read_stamp
+from .storage import object_name, object_storage
+from .views import search_paper, search_paperset
+from .widgets import encode_cursor
+
+
+def make_paper(user: User, title: str, authors: list[str] | None = None, **kwargs) -> Paper:
+    fields = {
+            'user': user,
+            'title': title,
+            'abstract': f'abstract of {title}',
+            'file_name': f'{title}.pdf',
+            'file_content': f'objects/{title}',
+            'publication_date': date(2024, 1, 1),
+            'journal': 'journal',
+            'total_citations': 0,
+            }
+    fields.update(kwargs)
+    paper = Paper.objects.create(**fields)
+    for i in authors or []:
+        PaperByScholar.objects.create(paper=paper, scholar=i)
+    return paper
+
+
+def write_object(content: bytes) -> str:
+    ''' store content like uploads are stored, named by its md5 '''
+    name = object_name(md5(content).hexdigest())
+    os.makedirs(os.path.dirname(object_storage.path(name)), exist_ok=True)
+    with open(object_storage.path(name), 'wb') as file:
+        file.write(content)
+    return name
+
+
+def read_object(paper: Paper) -> bytes:
+    with paper.file_content.open('rb') as file:
+        return file.read()
+
+
+class TemporaryMediaMixin:
+    ''' files and previews go to a temporary directory during each test '''
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        override = override_settings(
+                MEDIA_ROOT=self.directory.name,
+                FILE_UPLOAD_TEMP_DIR=self.directory.name,
+                PREVIEW_CACHE_DIR=os.path.join(self.directory.name, 'previews'))
+        override.enable()
+        self.addCleanup(override.disable)
+
+
+def pdf_pages_text(pdf_bytes: bytes) -> list[str]:
+    with fitz.open(stream=pdf_bytes, filetype='pdf') as document:
+        return [i.get_text().strip() for i in document]
+
+
+class ListQueryCountTest(TestCase):
+    ''' list endpoints should not issue one query per row '''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='owner', password='password')
+        cls.others = [User.objects.create_user(username=f'user{i}', password='password') for i in range(4)]
+        cls.paperset = PaperSet.objects.create(user=cls.user, name='set', description='set')
+        for i in range(30):
+            uploader = cls.others[i % len(cls.others)]
+            paper = make_paper(uploader, f'paper {i}', authors=[f'author {i}', f'author {i + 1}'])
+            PaperSetContent.objects.create(paper=paper, paper_set=cls.paperset)
+            PaperTextComments.objects.create(paper=paper, user=uploader, comment='nice')
+            PaperSetTextComments.objects.create(paperset=cls.paperset, user=uploader, comment='nice')
+            PaperSet.objects.create(user=uploader, name=f'set {i}', description='set')
+        cls.paper = Paper.objects.first()
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def count_queries(self, url: str, params: dict) -> int:
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def assert_constant(self, url: str, params: dict | None = None):
+        params = params or {}
+        small = self.count_queries(url, {**params, 'per_page': 2})
+        large = self.count_queries(url, {**params, 'per_page': 25})
+        self.assertEqual(small, large)
+
+    def test_search_paper(self):
+        self.assert_constant('/api/search_paper')
+
+    def test_search_paperset(self):
+        self.assert_constant('/api/search_paperset')
+
+    def test_search_paper_comment(self):
+        self.assert_constant('/api/search_paper_comment', {'paperid': self.paper.id})
+
+    def test_search_paperset_comment(self):
+        self.assert_constant('/api/search_paperset_comment', {'papersetid': self.paperset.id})
+
+    def test_serialized_authors(self):
+        response = self.client.get('/api/search_paper', {'title': 'paper 3', 'per_page': 1})
+        data = response.json()['data']['data_list'][0]
+        self.assertEqual(data['authors'], ['author 3', 'author 4'])
+        self.assertEqual(data['username'], 'user3')
+
+
+class FullTextSearchTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='owner', password='password')
+        cls.attention = make_paper(cls.user, 'Attention is all you need', authors=['Ashish Vaswani'],
+                                   abstract='the transformer, based solely on attention')
+        cls.bert = make_paper(cls.user, 'BERT pre-training of deep bidirectional transformers', authors=['Jacob Devlin'],
+                              abstract='a language representation model')
+        cls.resnet = make_paper(cls.user, 'Deep residual learning', authors=['Kaiming He'], journal='CVPR')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def search(self, **params) -> list[str]:
+        response = self.client.get('/api/search_paper', {'per_page': 10, **params})
+        self.assertEqual(response.status_code, 200)
+        return [i['title'] for i in response.json()['data']['data_list']]
+
+    def test_keyword_ranked(self):
+        self.assertEqual(self.search(keyword='attention'), [self.attention.title])
+        self.assertEqual(self.search(keyword='transform'), [self.attention.title, self.bert.title])
+
+    def test_column_filters(self):
+        self.assertEqual(self.search(title='deep'), [self.bert.title, self.resnet.title])
+        self.assertEqual(self.search(journal='cvpr'), [self.resnet.title])
+        self.assertEqual(self.search(author='devl'), [self.bert.title])
+
+    def test_index_follows_writes(self):
+        PaperByScholar.objects.create(paper=self.resnet, scholar='Xiangyu Zhang')
+        self.assertEqual(self.search(author='zhang'), [self.resnet.title])
+        self.resnet.title = 'Identity mappings'
+        self.resnet.save()
+        self.assertEqual(self.search(title='identity'), [self.resnet.title])
+        self.resnet.delete()
+        self.assertEqual(self.search(author='zhang'), [])
+
+    def test_fallback(self):
+        self.assertEqual(self.search(title='ention', fts='false'), [self.attention.title])
+        self.assertEqual(self.search(title='ention'), [])
+        self.assertEqual(self.search(title='^Deep', regex='true'), [self.resnet.title])
+
+    def test_no_words(self):
+        # nothing for the index, the filters still apply as substrings
+        punctuated = make_paper(self.user, 'What?!!! A survey', authors=['-'])
+        self.assertEqual(self.search(title='!!!'), [punctuated.title])
+        self.assertEqual(self.search(author='-'), [punctuated.title])
+        self.assertEqual(self.search(keyword='?!'), [punctuated.title])
+        self.assertEqual(self.search(keyword='-', fts='false'), [self.bert.title, punctuated.title])
+
+    def test_rank_follows_the_table(self):
+        sql = str(fts_rank(Paper.objects.all(), fts_match('attention')).query)
+        self.assertIn(f'rowid = "{Paper._meta.db_table}".id', sql)
+
+    def test_quotes_are_escaped(self):
+        self.assertEqual(self.search(keyword='"attention all" -'), [self.attention.title])
+
+    def test_paperset_by_keyword(self):
+        paperset = PaperSet.objects.create(user=self.user, name='set', description='set')
+        PaperSetContent.objects.create(paper=self.bert, paper_set=paperset)
+        response = self.client.get('/api/search_paperset', {'paperkeyword': 'bidirectional'})
+        self.assertEqual([i['name'] for i in response.json()['data']['data_list']], ['set'])
+
+
+class CursorPaginationTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='owner', password='password')
+        cls.paper = make_paper(cls.user, 'paper', abstract='deep')
+        for i in range(7):
+            make_paper(cls.user, f'deep paper {i}', abstract='deep ' * i)
+            PaperTextComments.objects.create(paper=cls.paper, user=cls.user, comment=f'comment {i}')
+        # same timestamp for every comment, the id breaks the tie
+        PaperTextComments.objects.update(commented_on=PaperTextComments.objects.first().commented_on)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def walk(self, url: str, list_key: str, params: dict) -> list[dict]:
+        rows, after = [], ''
+        while after is not None:
+            response = self.client.get(url, {**params, 'per_page': 3, 'after': after})
+            self.assertEqual(response.status_code, 200)
+            data = response.json()['data']
+            self.assertNotIn('total_page', data)
+            rows += data[list_key]
+            after = data['next_cursor']
+        return rows
+
+    def test_search_paper(self):
+        rows = self.walk('/api/search_paper', 'data_list', {})
+        self.assertEqual([int(i['paperid']) for i in rows], list(Paper.objects.order_by('id').values_list('id', flat=True)))
+
+    def test_search_paper_ranked(self):
+        rows = self.walk('/api/search_paper', 'data_list', {'keyword': 'deep'})
+        response = self.client.get('/api/search_paper', {'keyword': 'deep', 'per_page': 10})
+        self.assertEqual(rows, response.json()['data']['data_list'])
+        self.assertEqual(len(rows), 8)
+
+    def test_search_paper_comment(self):
+        rows = self.walk('/api/search_paper_comment', 'comment_list', {'paperid': self.paper.id})
+        self.assertEqual([i['comment'] for i in rows], [f'comment {i}' for i in range(7)])
+
+    def test_with_total(self):
+        response = self.client.get('/api/search_paper', {'per_page': 3, 'after': '', 'with_total': 'true'})
+        self.assertEqual(response.json()['data']['total_page'], 3)
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/search_paper', {'after': 'not a cursor'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/api/search_paper', {'after': encode_cursor([1, 2])})
+        self.assertEqual(response.status_code, 400)
+
+    def test_tampered_cursor(self):
+        for url, params, cursor in [
+                ('/api/search_paper', {}, [{'a': 1}]),
+                ('/api/search_paper', {}, ['one']),
+                ('/api/search_paper', {'keyword': 'deep'}, [[1], 1]),
+                ('/api/search_paper_comment', {'paperid': self.paper.id}, ['notadate', 1]),
+                ('/api/search_paper_comment', {'paperid': self.paper.id}, [{}, 1])]:
+            response = self.client.get(url, {**params, 'after': encode_cursor(cursor)})
+            self.assertEqual(response.status_code, 400, cursor)
+            self.assertEqual(response.json()['status'], 'error')
+
+
+class PaperContentTest(TemporaryMediaMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='owner', password='password')
+
+    def setUp(self):
+        super().setUp()
+        self.content = bytes(range(256)) * 1000
+        self.paper = make_paper(self.user, 'paper', file_content=write_object(self.content))
+        self.etag = f'"{md5(self.content).hexdigest()}"'
+        self.client.force_login(self.user)
+
+    def get(self, **headers):
+        return self.client.get('/api/paper_content', {'paperid': self.paper.id, 'type': 'bytes'}, headers=headers)
+
+    def test_whole_file(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(response.headers['ETag'], self.etag)
+        self.assertEqual(response.headers['Accept-Ranges'], 'bytes')
+        self.assertEqual(response.headers['Content-Type'], 'application/pdf')
+
+    def test_not_modified(self):
+        response = self.get(If_None_Match=self.etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(self.get(If_None_Match='"stale"').status_code, 200)
+
+    def test_range(self):
+        response = self.get(Range='bytes=100-1099')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), self.content[100:1100])
+        self.assertEqual(response.headers['Content-Range'], f'bytes 100-1099/{len(self.content)}')
+        response = self.get(Range='bytes=-10')
+        self.assertEqual(b''.join(response.streaming_content), self.content[-10:])
+        response = self.get(Range='bytes=250000-')
+        self.assertEqual(b''.join(response.streaming_content), self.content[250000:])
+
+    def test_range_not_satisfiable(self):
+        response = self.get(Range=f'bytes={len(self.content)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response.headers['Content-Range'], f'bytes */{len(self.content)}')
+
+    def test_if_range(self):
+        self.assertEqual(self.get(Range='bytes=0-9', If_Range=self.etag).status_code, 206)
+        self.assertEqual(self.get(Range='bytes=0-9', If_Range='"stale"').status_code, 200)
+
+    def test_detail_without_bytes(self):
+        response = self.client.get('/api/paper_content', {'paperid': self.paper.id})
+        data = response.json()['data']
+        self.assertNotIn('file_content', data)
+        self.assertEqual(data['file_md5'], md5(self.content).hexdigest())
+        self.assertEqual(data['file_size'], len(self.content))
+        response = self.client.get(data['file_url'])
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+
+    def test_detail_inline(self):
+        response = self.client.get('/api/paper_content', {'paperid': self.paper.id, 'inline': 'true'})
+        self.assertTrue(response.streaming)
+        data = json.loads(b''.join(response.streaming_content))['data']
+        self.assertEqual(base64.b64decode(data['file_content']), self.content)
+        self.assertEqual(data['title'], 'paper')
+
+
+class PaperPreviewTest(TemporaryMediaMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='owner', password='password')
+
+    def setUp(self):
+        super().setUp()
+        self.cache = os.path.join(self.directory.name, 'previews')
+        self.paper = make_paper(self.user, 'paper', file_content=write_object(make_pdf(5)))
+        self.client.force_login(self.user)
+
+    def preview(self, **params) -> list[str]:
+        response = self.client.get('/api/paper_content', {'paperid': self.paper.id, 'type': 'bytes', **params})
+        self.assertEqual(response.status_code, 200)
+        return pdf_pages_text(b''.join(response.streaming_content))
+
+    def cached(self) -> list[str]:
+        return sorted(os.path.join(self.cache, i) for i in os.listdir(self.cache))
+
+    def test_page_ranges(self):
+        self.assertEqual(self.preview(preview_page=2), ['page 1', 'page 2'])
+        self.assertEqual(self.preview(from_page=2, to_page=4), ['page 2', 'page 3', 'page 4'])
+        self.assertEqual(self.preview(from_page=4, to_page=100), ['page 4', 'page 5'])
+        response = self.client.get('/api/paper_content', {'paperid': self.paper.id, 'type': 'bytes', 'from_page': 3, 'to_page': 2})
+        self.assertEqual(response.status_code, 400)
+
+    def test_cached(self):
+        self.preview(preview_page=2)
+        self.assertEqual(len(self.cached()), 1)
+        with mock.patch('api.previews.render_preview') as render:
+            self.assertEqual(self.preview(preview_page=2), ['page 1', 'page 2'])
+        render.assert_not_called()
+
+    def test_ranges_past_the_end_share_a_preview(self):
+        for to_page in [5, 6, 100]:
+            self.assertEqual(self.preview(from_page=4, to_page=to_page), ['page 4', 'page 5'])
+        self.assertEqual([os.path.basename(i) for i in self.cached()], [f'{self.paper.content_id}_3_4.pdf'])
+
+    def test_invalidated_on_change(self):
+        self.preview(preview_page=1)
+        old = self.cached()
+        new_content = base64.b64encode(make_pdf(2)).decode()
+        changed, errors = self.paper.try_change_to({'file_content': new_content})
+        self.assertEqual((changed, errors), (True, ''))
+        self.assertEqual(self.cached(), [])
+        self.preview(preview_page=1)
+        self.assertNotEqual(self.cached(), old)
+
+    def test_eviction(self):
+        for i in range(1, 6):
+            self.preview(from_page=i, to_page=i)
+        paths = self.cached()
+        for age, path in enumerate(paths):
+            os.utime(path, (1000 + age, 1000 + age))
+        evict(sum(os.path.getsize(i) for i in paths[2:]))
+        self.assertEqual(self.cached(), paths[2:])
+
+
+class PaperUploadTest(TemporaryMediaMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='owner', password='password')
+
+    def setUp(self):
+        super().setUp()
+        self.content = make_pdf(3)
+        self.metadata = {
+                'title': 'uploaded',
+                'abstract': 'abstract',
+                'file_name': 'uploaded.pdf',
+                'publication_date': '2024-01-01',
+                'journal': 'journal',
+                'total_citations': 0,
+                'authors': ['author'],
+                }
+        self.client.force_login(self.user)
+
+    def assert_stored(self, paper: Paper, content: bytes):
+        self.assertEqual(paper.file_content.name, object_name(md5(content).hexdigest()))
+        with open(os.path.join(self.directory.name, paper.file_content.name), 'rb') as file:
+            self.assertEqual(file.read(), content)
+
+    def test_multipart(self):
+        upload = SimpleUploadedFile('paper.pdf', self.content, content_type='application/pdf')
+        response = self.client.post('/api/insert_paper', {'metadata': json.dumps(self.metadata), 'file_content': upload})
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assert_stored(Paper.objects.get(title='uploaded'), self.content)
+
+    def test_raw_pdf(self):
+        response = self.client.post(f'/api/insert_paper?metadata={quote(json.dumps(self.metadata))}',
+                                    self.content, content_type='application/pdf')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assert_stored(Paper.objects.get(title='uploaded'), self.content)
+
+    def test_base64_json(self):
+        payload = {**self.metadata, 'file_content': base64.b64encode(self.content).decode()}
+        response = self.client.post('/api/insert_paper', payload, content_type='application/json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assert_stored(Paper.objects.get(title='uploaded'), self.content)
+
+    def test_modify_raw_pdf(self):
+        paper = make_paper(self.user, 'paper')
+        new_content = make_pdf(1)
+        metadata = json.dumps({'paperid': paper.id})
+        response = self.client.post(f'/api/modify_paper?metadata={quote(metadata)}', new_content, content_type='application/pdf')
+        self.assertEqual(response.json()['message'], 'paper changed')
+        paper.refresh_from_db()
+        self.assert_stored(paper, new_content)
+
+    def test_missing_metadata(self):
+        response = self.client.post('/api/insert_paper', self.content, content_type='application/pdf')
+        self.assertEqual(response.status_code, 400)
+
+    def test_too_large(self):
+        with override_settings(MAX_PAPER_UPLOAD_SIZE=len(self.content) - 1):
+            upload = SimpleUploadedFile('paper.pdf', self.content, content_type='application/pdf')
+            response = self.client.post('/api/insert_paper', {'file_content': upload, 'metadata': json.dumps(self.metadata)})
+            self.assertEqual(response.status_code, 413, response.content)
+            response = self.client.post(f'/api/insert_paper?metadata={quote(json.dumps(self.metadata))}',
+                                        self.content, content_type='application/pdf')
+            self.assertEqual(response.status_code, 413, response.content)
+        self.assertFalse(Paper.objects.exists())
+        self.assertEqual(list(object_storage.iter_objects()), [])
+
+
+@override_settings(OBJECT_STORE_GRACE_SECONDS=0)
+class ObjectStoreTest(TemporaryMediaMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='owner', password='password')
+
+    def upload(self, title: str, content: bytes) -> Paper:
+        return make_paper(self.user, title, file_content=ContentFile(content, name=md5(content).hexdigest()))
+
+    def stored(self) -> list[str]:
+        return sorted(object_storage.iter_objects())
+
+    def test_identical_files_stored_once(self):
+        content = make_pdf(1)
+        first = self.upload('first', content)
+        second = self.upload('second', content)
+        self.assertEqual(first.file_content.name, second.file_content.name)
+        self.assertEqual(self.stored(), [object_name(md5(content).hexdigest())])
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertEqual(self.stored(), [second.file_content.name])
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertEqual(self.stored(), [])
+
+    def test_replaced_file_released(self):
+        paper = self.upload('paper', make_pdf(1))
+        new_content = make_pdf(2)
+        with self.captureOnCommitCallbacks(execute=True):
+            paper.try_change_to({'file_content': base64.b64encode(new_content).decode()})
+        self.assertEqual(self.stored(), [object_name(md5(new_content).hexdigest())])
+
+    @override_settings(OBJECT_STORE_GRACE_SECONDS=3600)
+    def test_recent_files_kept(self):
+        paper = self.upload('paper', make_pdf(1))
+        with self.captureOnCommitCallbacks(execute=True):
+            paper.delete()
+        self.assertEqual(len(self.stored()), 1)
+        call_command('gc_objects', stdout=StringIO())
+        self.assertEqual(len(self.stored()), 1)
+        call_command('gc_objects', grace=0, stdout=StringIO())
+        self.assertEqual(self.stored(), [])
+
+    def test_gc_objects(self):
+        paper = self.upload('paper', make_pdf(1))
+        orphan = write_object(make_pdf(3))
+        call_command('gc_objects', dry_run=True, stdout=StringIO())
+        self.assertEqual(self.stored(), sorted([paper.file_content.name, orphan]))
+        call_command('gc_objects', stdout=StringIO())
+        self.assertEqual(self.stored(), [paper.file_content.name])
+
+    def test_migrate_objects(self):
+        content = make_pdf(1)
+        os.makedirs(os.path.join(self.directory.name, 'objects'))
+        for name in ['objects/flat', 'objects/flat_suffixed']:
+            with open(os.path.join(self.directory.name, name), 'wb') as file:
+                file.write(content)
+        first = make_paper(self.user, 'first', file_content='objects/flat')
+        second = make_paper(self.user, 'second', file_content='objects/flat_suffixed')
+        stamp = read_stamp(settings.ROW_CACHE_STAMP)
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('migrate_objects', stdout=StringIO())
+        # the cached rows with the old names are dropped
+        self.assertNotEqual(read_stamp(settings.ROW_CACHE_STAMP), stamp)
+        self.assertFalse(os.path.exists(os.path.join(self.directory.name, 'objects/flat')))
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(first.file_content.name, object_name(md5(content).hexdigest()))
+        self.assertEqual(second.file_content.name, first.file_content.name)
+        self.assertEqual(read_object(first), content)
+        call_command('gc_objects', stdout=StringIO())
+        self.assertEqual(self.stored(), [first.file_content.name])
+
+    def test_interrupted_migrate_objects(self):
+        content = make_pdf(1)
+        os.makedirs(os.path.join(self.directory.name, 'objects'))
+        with open(os.path.join(self.directory.name, 'objects/flat'), 'wb') as file:
+            file.write(content)
+        paper = make_paper(self.user, 'paper', file_content='objects/flat')
+        with mock.patch('api.management.commands.migrate_objects.Paper.objects.filter', side_effect=KeyboardInterrupt), \
+                self.assertRaises(KeyboardInterrupt):
+            call_command('migrate_objects', stdout=StringIO())
+        # the paper still refers to its file
+        paper.refresh_from_db()
+        self.assertEqual(paper.file_content.name, 'objects/flat')
+        self.assertEqual(read_object(paper), content)
+
+
+class BulkInsertTest(TemporaryMediaMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='owner', password='password')
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    @staticmethod
+    def form(title: str, **kwargs) -> dict:
+        return {
+                'title': title,
+                'abstract': 'abstract',
+                'file_name': f'{title}.pdf',
+                'file_content': base64.b64encode(title.encode()).decode(),
+                'publication_date': '2024-01-01',
+                'journal': 'journal',
+                'total_citations': 0,
+                'authors': [f'{title} author', 'common author'],
+                **kwargs,
+                }
+
+    def test_bulk_insert(self):
+        forms = [self.form(f'paper {i}') for i in range(50)]
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post('/api/insert_papers', {'papers': forms}, content_type='application/json')
+        self.assertEqual(response.json()['status'], 'ok')
+        self.assertLess(len(context.captured_queries), 15)
+        results = response.json()['data']['results']
+        self.assertEqual(len(results), 50)
+        paper = Paper.objects.get(pk=results[7]['paperid'])
+        self.assertEqual(paper.title, 'paper 7')
+        self.assertEqual(read_object(paper), b'paper 7')
+        self.assertEqual(paper.simple_json['authors'], ['paper 7 author', 'common author'])
+
+    def test_per_item_results(self):
+        make_paper(self.user, 'exists')
+        forms = [
+                self.form('new'),
+                self.form('exists'),
+                self.form('new'),
+                self.form('bad date', publication_date='yesterday'),
+                {'title': 'missing fields'},
+                self.form('bad authors', authors='someone'),
+                ]
+        response = self.client.post('/api/insert_papers', {'papers': forms}, content_type='application/json')
+        self.assertEqual(response.json()['status'], 'warning')
+        statuses = [i['status'] for i in response.json()['data']['results']]
+        self.assertEqual(statuses, ['ok', 'error', 'error', 'error', 'error', 'error'])
+        self.assertEqual(Paper.objects.filter(title='new').count(), 1)
+        self.assertEqual(Paper.objects.count(), 2)
+
+
+class PapersetMembershipTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='owner', password='password')
+        cls.paperset = PaperSet.objects.create(user=cls.user, name='set', description='set')
+        cls.papers = [make_paper(cls.user, f'paper {i}') for i in range(40)]
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def post(self, url: str, papers: list[Paper]):
+        payload = {'papersetid': self.paperset.id, 'paperid_list': [i.id for i in papers]}
+        return self.client.post(url, payload, content_type='application/json')
+
+    def members(self) -> set[int]:
+        return set(self.paperset.has_paper.values_list('paper_id', flat=True))
+
+    def test_add(self):
+        self.post('/api/add_to_paperset', self.papers[:5])
+        with CaptureQueriesContext(connection) as context:
+            response = self.post('/api/add_to_paperset', self.papers)
+        self.assertLess(len(context.captured_queries), 15)
+        self.assertEqual(response.json()['status'], 'warning')
+        self.assertEqual([i['title'] for i in response.json()['data']['already_in']], [f'paper {i}' for i in range(5)])
+        self.assertEqual(self.members(), {i.id for i in self.papers})
+
+    def test_delete(self):
+        self.post('/api/add_to_paperset', self.papers[:30])
+        with CaptureQueriesContext(connection) as context:
+            response = self.post('/api/delete_from_paperset', self.papers[:20])
+        self.assertLess(len(context.captured_queries), 15)
+        self.assertEqual(response.json()['status'], 'ok')
+        self.assertEqual(self.members(), {i.id for i in self.papers[20:30]})
+
+    def test_delete_is_all_or_nothing(self):
+        self.post('/api/add_to_paperset', self.papers[:10])
+        response = self.post('/api/delete_from_paperset', self.papers[5:15])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(response.json()['data']['not_in']), 5)
+        self.assertEqual(self.members(), {i.id for i in self.papers[:10]})
+
+
+class PaperAuthorsTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='owner', password='password')
+
+    def setUp(self):
+        self.paper = make_paper(self.user, 'paper')
+        self.paper.set_authors(['a', 'b', 'c'])
+
+    def authors(self) -> list[str]:
+        return Paper.objects.get(pk=self.paper.pk).simple_json['authors']
+
+    def test_diff(self):
+        with CaptureQueriesContext(connection) as context:
+            self.assertTrue(self.paper.set_authors(['d', 'c', 'a', 'e', 'd']))
+        # read, delete, insert, update
+        self.assertEqual(len([i for i in context.captured_queries if 'api_paperbyscholar' in i['sql']]), 4)
+        self.assertEqual(self.authors(), ['d', 'c', 'a', 'e'])
+
+    def test_unchanged(self):
+        with CaptureQueriesContext(connection) as context:
+            self.assertFalse(self.paper.set_authors(['a', 'b', 'c']))
+        self.assertEqual(len(context.captured_queries), 1)
+
+    def test_try_change_to(self):
+        self.assertEqual(self.paper.try_change_to({'authors': ['c', 'b']}), (True, ''))
+        self.assertEqual(self.authors(), ['c', 'b'])
+        self.assertEqual(self.paper.try_change_to({'authors': ['c', 'b']}), (False, ''))
+
+
+class PaperRatingTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [User.objects.create_user(username=f'user{i}', password='password') for i in range(3)]
+        cls.papers = [make_paper(cls.users[0], f'paper {i}') for i in range(4)]
+
+    def review(self, user: User, paper: Paper, star: int):
+        self.client.force_login(user)
+        return self.client.post('/api/review_paper', {'paperid': paper.id, 'star': star}, content_type='application/json')
+
+    def get_review(self, paper: Paper) -> float:
+        return self.client.get('/api/get_paper_review', {'paperid': paper.id}).json()['data']['review']
+
+    def test_aggregates(self):
+        self.review(self.users[0], self.papers[0], 4)
+        self.review(self.users[1], self.papers[0], 5)
+        self.assertEqual(self.review(self.users[1], self.papers[0], 2).json()['message'], 'review changed')
+        paper = Paper.objects.get(pk=self.papers[0].pk)
+        self.assertEqual((paper.star_count, paper.star_sum), (2, 6))
+        self.assertEqual(self.get_review(paper), 3.0)
+        self.assertEqual(self.get_review(self.papers[1]), 0)
+        self.users[1].delete()
+        self.client.force_login(self.users[0])
+        self.assertEqual(self.get_review(paper), 4.0)
+
+    def test_deleted_user_stars(self):
+        for paper in self.papers:
+            self.review(self.users[0], paper, 4)
+            self.review(self.users[1], paper, 2)
+        with CaptureQueriesContext(connection) as context:
+            self.users[1].delete()
+        updates = [i['sql'] for i in context.captured_queries if i['sql'].startswith('UPDATE "api_paper"')]
+        self.assertEqual(len(updates), 1)
+        for paper in Paper.objects.filter(pk__in=[i.pk for i in self.papers]):
+            self.assertEqual((paper.star_count, paper.star_sum, paper.rating), (1, 4, 4.0))
+
+    def test_invalid_star(self):
+        self.assertEqual(self.review(self.users[0], self.papers[0], 11).status_code, 400)
+        self.assertEqual(Paper.objects.get(pk=self.papers[0].pk).star_count, 0)
+
+    def test_search_by_rating(self):
+        for paper, star in zip(self.papers, [3, 5, 1, 4]):
+            self.review(self.users[0], paper, star)
+        response = self.client.get('/api/search_paper', {'order': 'rating', 'min_rating': 3, 'per_page': 10})
+        self.assertEqual([i['title'] for i in response.json()['data']['data_list']], ['paper 1', 'paper 3', 'paper 0'])
+        response = self.client.get('/api/search_paper', {'order': 'rating', 'per_page': 2, 'after': ''})
+        cursor = response.json()['data']['next_cursor']
+        response = self.client.get('/api/search_paper', {'order': 'rating', 'per_page': 2, 'after': cursor})
+        self.assertEqual([i['title'] for i in response.json()['data']['data_list']], ['paper 0', 'paper 2'])
+
+    def test_repair_ratings(self):
+        self.review(self.users[0], self.papers[0], 4)
+        Paper.objects.update(star_count=7, star_sum=1, rating=1)
+        call_command('repair_ratings', stdout=StringIO())
+        paper = Paper.objects.get(pk=self.papers[0].pk)
+        self.assertEqual((paper.star_count, paper.star_sum, paper.rating), (1, 4, 4.0))
+        self.assertEqual(Paper.objects.get(pk=self.papers[1].pk).star_count, 0)
+
+    def test_modify_keeps_aggregates(self):
+        paper = Paper.objects.get(pk=self.papers[0].pk)
+        self.review(self.users[1], paper, 4)
+        # the paper loaded before the review is changed after it
+        changed, errors = paper.try_change_to({'title': 'changed'})
+        self.assertEqual((changed, errors), (True, ''))
+        paper = Paper.objects.get(pk=paper.pk)
+        self.assertEqual((paper.title, paper.star_count, paper.rating), ('changed', 1, 4.0))
+
+
+class RepairRatingsCacheTest(TransactionTestCase):
+    ''' the cached rows and responses are of committed reads, so this test commits '''
+
+    def test_repair_outdates_caches(self):
+        user = User.objects.create_user(username='owner', password='password')
+        paper = make_paper(user, 'paper')
+        self.client.force_login(user)
+        self.client.post('/api/review_paper', {'paperid': paper.id, 'star': 4}, content_type='application/json')
+        Paper.objects.update(star_count=0, star_sum=0, rating=0)
+        # cached with the corrupted rating
+        response = self.client.get('/api/get_paper_review', {'paperid': paper.id})
+        self.assertEqual(response.json()['data']['review'], 0)
+        search = self.client.get('/api/search_paper', {'order': 'rating', 'min_rating': 3})
+        self.assertEqual(search.json()['data']['data_list'], [])
+        call_command('repair_ratings', stdout=StringIO())
+        response = self.client.get('/api/get_paper_review', {'paperid': paper.id})
+        self.assertEqual(response.json()['data']['review'], 4.0)
+        search = self.client.get('/api/search_paper', {'order': 'rating', 'min_rating': 3})
+        self.assertEqual([i['title'] for i in search.json()['data']['data_list']], ['paper'])
+
+
+class DecoratorChainTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='owner', password='password')
+        cls.other = User.objects.create_user(username='other', password='password')
+        cls.paper = make_paper(cls.user, 'paper')
+        cls.private_paper = make_paper(cls.user, 'private', private=True)
+        cls.paperset = PaperSet.objects.create(user=cls.user, name='set', description='set')
+
+    def post(self, url: str, payload: dict):
+        return self.client.post(url, payload, content_type='application/json')
+
+    def test_payload_parsed_once(self):
+        self.client.force_login(self.user)
+        payload = {'papersetid': self.paperset.id, 'paperid_list': [self.paper.id]}
+        with mock.patch('api.decorators.json.loads', side_effect=json.loads) as loads:
+            response = self.post('/api/add_to_paperset', payload)
+        self.assertEqual(response.status_code, 200)
+        # the session is json too
+        bodies = [i for i in loads.call_args_list if i.args[0] == json.dumps(payload).encode()]
+        self.assertEqual(len(bodies), 1)
+
+    def test_owner_loaded_with_paper(self):
+        self.client.force_login(self.user)
+        self.post('/api/comment_paper', {'paperid': self.paper.id, 'comment': 'warm up'})
+        with CaptureQueriesContext(connection) as context:
+            response = self.post('/api/comment_paper', {'paperid': self.paper.id, 'comment': 'nice'})
+        self.assertEqual(response.status_code, 200)
+        # user, paper with its owner, insert, the session is cached
+        queries = [i for i in context.captured_queries if not i['sql'].startswith(('SAVEPOINT', 'RELEASE'))]
+        self.assertEqual(len(queries), 3)
+
+    def test_permissions(self):
+        self.client.force_login(self.other)
+        response = self.post('/api/comment_paper', {'paperid': self.private_paper.id, 'comment': 'nice'})
+        self.assertEqual(response.status_code, 401)
+        response = self.post('/api/delete_paper', {'paperid': self.paper.id})
+        self.assertEqual(response.status_code, 401)
+        response = self.post('/api/delete_paperset', {'papersetid': self.paperset.id})
+        self.assertEqual(response.status_code, 401)
+
+    def test_invalid_ids(self):
+        self.client.force_login(self.user)
+        for payload in [{}, {'paperid': 'one'}, {'paperid': True}, {'paperid': [1]}]:
+            self.assertEqual(self.post('/api/delete_paper', payload).status_code, 400)
+        response = self.client.get('/api/paper_detail', {'paperid': 'one'})
+        self.assertEqual(response.status_code, 400)
+        response = self.post('/api/add_to_paperset', {'papersetid': self.paperset.id, 'paperid_list': 1})
+        self.assertEqual(response.status_code, 400)
+
+
+class SearchCacheTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='reader', password='password')
+        cls.owner = User.objects.create_user(username='owner', password='password')
+        cls.paperset = PaperSet.objects.create(user=cls.owner, name='set', description='set')
+        cls.papers = [make_paper(cls.owner, f'cached paper {i}', ['someone']) for i in range(5)]
+
+    def setUp(self):
+        # the responses of the other tests are kept under the same generation
+        search_cache().clear()
+        self.client.force_login(self.user)
+
+    def search(self, **params) -> tuple[list[str], int]:
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/search_paper', params)
+        self.assertEqual(response.status_code, 200)
+        return [i['title'] for i in response.json()['data']['data_list']], len(context.captured_queries)
+
+    def test_hit_skips_the_search(self):
+        titles, misses = self.search(title='cached', per_page=10)
+        self.assertEqual(len(titles), 5)
+        # params in any order are the same search
+        response = self.client.get('/api/search_paper?per_page=10&title=cached')
+        self.assertEqual([i['title'] for i in response.json()['data']['data_list']], titles)
+        _, hits = self.search(per_page=10, title='cached')
+        self.assertLess(hits, misses)
+
+    def test_writes_outdate_responses(self):
+        self.search(title='cached', per_page=10)
+        self.papers[0].title = 'renamed'
+        self.papers[0].save()
+        titles, _ = self.search(title='cached', per_page=10)
+        self.assertEqual(len(titles), 4)
+
+    def test_hit_reads_no_generation(self):
+        self.search(title='cached', per_page=10)
+        with CaptureQueriesContext(connection) as context:
+            self.client.get('/api/search_paper', {'title': 'cached', 'per_page': 10})
+        # the session's user, and the private papers of the visibility scope
+        self.assertEqual(len(context.captured_queries), 2)
+
+    def test_renamed_uploader_outdates_responses(self):
+        self.assertEqual(len(self.search(uploader='owner', per_page=10)[0]), 5)
+        self.owner.username = 'renamed'
+        self.owner.save()
+        self.assertEqual(self.search(uploader='owner', per_page=10)[0], [])
+
+    def test_membership_outdates_responses(self):
+        params = {'papersetid': self.paperset.id, 'per_page': 10}
+        self.assertEqual(self.search(**params)[0], [])
+        self.client.force_login(self.owner)
+        self.client.post('/api/add_to_paperset', {'papersetid': self.paperset.id, 'paperid_list': [self.papers[1].id]},
+                         content_type='application/json')
+        self.client.force_login(self.user)
+        self.assertEqual(self.search(**params)[0], ['cached paper 1'])
+
+    def test_private_rows_are_not_shared(self):
+        make_paper(self.owner, 'cached secret', private=True)
+        self.client.force_login(self.owner)
+        self.assertEqual(len(self.search(title='cached', per_page=10)[0]), 6)
+        self.client.force_login(self.user)
+        self.assertEqual(len(self.search(title='cached', per_page=10)[0]), 5)
+        self.client.force_login(self.owner)
+        self.assertEqual(len(self.search(title='cached', per_page=10)[0]), 6)
+
+
+class RowCacheTest(TransactionTestCase):
+    ''' rows read in a transaction are never cached, so these tests commit '''
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', password='password')
+        self.paper = make_paper(self.user, 'paper')
+        self.paperset = PaperSet.objects.create(user=self.user, name='set', description='set')
+        self.client.force_login(self.user)
+
+    def detail(self) -> tuple[dict, int]:
+        ''' the response, and the number of queries of papers '''
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/paper_detail', {'paperid': self.paper.id})
+        return response, len([i for i in context.captured_queries if 'FROM "api_paper"' in i['sql']])
+
+    def test_hit_skips_the_query(self):
+        self.assertEqual(self.detail()[1], 1)
+        response, queries = self.detail()
+        self.assertEqual(queries, 0)
+        self.assertEqual(response.json()['data']['username'], 'owner')
+
+    def test_writes_outdate_rows(self):
+        self.detail()
+        self.client.post('/api/modify_paper', {'paperid': self.paper.id, 'title': 'changed'},
+                         content_type='application/json')
+        self.assertEqual(self.detail()[0].json()['data']['title'], 'changed')
+        self.user.username = 'renamed'
+        self.user.save()
+        self.assertEqual(self.detail()[0].json()['data']['username'], 'renamed')
+        Paper.objects.get(pk=self.paper.id).delete()
+        self.assertEqual(self.detail()[0].status_code, 400)
+
+    def test_permissions_follow_privacy(self):
+        other = User.objects.create_user(username='other', password='password')
+        self.client.force_login(other)
+        payload = {'papersetid': self.paperset.id, 'paperid_list': [self.paper.id]}
+        response = self.client.post('/api/add_to_paperset', payload, content_type='application/json')
+        self.assertEqual(response.status_code, 401)
+        self.paperset.can_modify = True
+        self.paperset.save()
+        response = self.client.post('/api/add_to_paperset', payload, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(ROW_CACHE_SIZE=1)
+    def test_bounded(self):
+        other = make_paper(self.user, 'other')
+        self.detail()
+        self.client.get('/api/paper_detail', {'paperid': other.id})
+        self.assertEqual(self.detail()[1], self.detail()[1] + 1)
+
+
+class SessionCacheTest(TransactionTestCase):
+    ''' users read in a transaction are never cached, so these tests commit '''
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', password='password')
+        response = self.client.post('/api/login', {'username': 'owner', 'password': 'password'},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+
+    def loggedin(self) -> tuple[bool, int]:
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/get_user_loggedin')
+        return response.json()['loggedin'], len(context.captured_queries)
+
+    def test_no_queries(self):
+        self.loggedin()
+        self.assertEqual(self.loggedin(), (True, 0))
+
+    def test_logout(self):
+        self.loggedin()
+        self.client.post('/api/logout')
+        self.assertFalse(self.loggedin()[0])
+
+    def test_logoff(self):
+        self.loggedin()
+        self.client.post('/api/logoff')
+        self.assertFalse(self.loggedin()[0])
+
+    def test_password_change(self):
+        self.loggedin()
+        self.user.set_password('changed')
+        self.user.save()
+        self.assertFalse(self.loggedin()[0])
+
+
+class AsyncReadTest(TemporaryMediaMixin, TestCase):
+    ''' the read endpoints served by an asgi server '''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='owner', password='password')
+
+    def setUp(self):
+        super().setUp()
+        self.content = bytes(range(256)) * 1000
+        self.paper = make_paper(self.user, 'async paper', ['someone'], file_content=write_object(self.content))
+        for i in range(5):
+            PaperTextComments.objects.create(paper=self.paper, user=self.user, comment=f'comment {i}')
+
+    async def get(self, url: str, params: dict, **headers):
+        await self.async_client.aforce_login(self.user)
+        return await self.async_client.get(url, params, headers=headers)
+
+    async def streamed(self, response) -> bytes:
+        self.assertTrue(response.is_async)
+        return b''.join([i async for i in response.streaming_content])
+
+    async def test_search(self):
+        response = await self.get('/api/search_paper', {'title': 'async'})
+        self.assertEqual([i['title'] for i in response.json()['data']['data_list']], ['async paper'])
+
+    async def test_detail(self):
+        response = await self.get('/api/paper_detail', {'paperid': self.paper.id})
+        self.assertEqual(response.json()['data']['authors'], ['someone'])
+
+    async def test_comments(self):
+        response = await self.get('/api/search_paper_comment', {'paperid': self.paper.id, 'per_page': 2, 'page': 3})
+        data = response.json()['data']
+        self.assertEqual((len(data['comment_list']), data['total_page'], data['current_page']), (1, 3, 3))
+        response = await self.get('/api/search_paper_comment', {'paperid': self.paper.id, 'per_page': 2, 'after': ''})
+        data = response.json()['data']
+        response = await self.get('/api/search_paper_comment', {'paperid': self.paper.id, 'per_page': 4, 'after': data['next_cursor']})
+        self.assertEqual([i['comment'] for i in response.json()['data']['comment_list']], ['comment 2', 'comment 3', 'comment 4'])
+
+    async def test_file_streamed(self):
+        response = await self.get('/api/paper_content', {'paperid': self.paper.id, 'type': 'bytes'})
+        self.assertEqual(await self.streamed(response), self.content)
+        self.assertEqual(response.headers['Content-Length'], str(len(self.content)))
+        self.assertIn('async paper.pdf', response.headers['Content-Disposition'])
+        response = await self.get('/api/paper_content', {'paperid': self.paper.id, 'type': 'bytes'}, Range='bytes=100-1099')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(await self.streamed(response), self.content[100:1100])
+
+    async def test_inline(self):
+        response = await self.get('/api/paper_content', {'paperid': self.paper.id, 'inline': 'true'})
+        data = json.loads(await self.streamed(response))['data']
+        self.assertEqual(base64.b64decode(data['file_content']), self.content)
+
+    async def test_permissions(self):
+        private = await Paper.objects.acreate(user=await User.objects.acreate(username='other'), title='private',
+                                              abstract='', file_name='', file_content='objects/private',
+                                              publication_date=date(2024, 1, 1), journal='', total_citations=0, private=True)
+        response = await self.get('/api/paper_detail', {'paperid': private.id})
+        self.assertEqual(response.status_code, 401)
+        response = await self.async_client.get('/api/paper_detail', {'paperid': 'one'})
+        self.assertEqual(response.status_code, 400)
+
+
+class SqliteProfileTest(TransactionTestCase):
+
+    def test_pragmas(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 5000)
+            cursor.execute('PRAGMA synchronous')
+            # normal
+            self.assertEqual(cursor.fetchone()[0], 1)
+        with tempfile.TemporaryDirectory() as directory:
+            database = sqlite3.connect(os.path.join(directory, 'db.sqlite3'))
+            apply_pragmas(database.cursor())
+            self.assertEqual(database.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+            database.close()
+
+    def view(self, errors: list[Exception]):
+        calls = []
+
+        @retry_when_locked()
+        def write(request):
+            calls.append(transaction.get_connection().in_atomic_block)
+            if errors:
+                raise errors.pop(0)
+            return JsonResponse({'status': 'ok'})
+        return write, calls
+
+    @override_settings(WRITE_RETRY_DELAY=0)
+    def test_retry_when_locked(self):
+        write, calls = self.view([OperationalError('database is locked')] * 2)
+        self.assertEqual(write(None).status_code, 200)
+        self.assertEqual(calls, [True] * 3)
+
+    @override_settings(WRITE_RETRY_DELAY=0)
+    def test_retries_are_bounded(self):
+        write, calls = self.view([OperationalError('database is locked')] * 3)
+        with self.assertRaises(OperationalError):
+            write(None)
+        self.assertEqual(len(calls), 3)
+        write, calls = self.view([OperationalError('no such table: api_paper')])
+        with self.assertRaises(OperationalError):
+            write(None)
+        self.assertEqual(len(calls), 1)
+        write, calls = self.view([OperationalError('database is locked')])
+        with transaction.atomic(), self.assertRaises(OperationalError):
+            write(None)
+        self.assertEqual(len(calls), 1)
+
+    def test_write_lock_is_taken_first(self):
+        write, _ = self.view([])
+        with CaptureQueriesContext(connection) as context:
+            write(None)
+            with transaction.atomic():
+                pass
+        self.assertEqual([i['sql'] for i in context.captured_queries if 'BEGIN' in i['sql']],
+                         ['BEGIN IMMEDIATE', 'BEGIN'])
+
+    @override_settings(WRITE_RETRY_DELAY=0)
+    def test_write_views_are_retried(self):
+        user = User.objects.create_user(username='owner', password='password')
+        paper = make_paper(user, 'paper')
+        self.client.force_login(user)
+        save = Paper.save
+        errors = [OperationalError('database is locked')]
+
+        def locked_once(*args, **kwargs):
+            if errors:
+                raise errors.pop()
+            return save(*args, **kwargs)
+        with mock.patch.object(Paper, 'save', locked_once):
+            response = self.client.post('/api/modify_paper', {'paperid': paper.id, 'title': 'changed'},
+                                        content_type='application/json')
+        self.assertEqual(response.json()['message'], 'paper changed')
+        paper.refresh_from_db()
+        self.assertEqual(paper.title, 'changed')
+        create = PaperSet.objects.create
+        errors.append(OperationalError('database is locked'))
+
+        def create_locked_once(**kwargs):
+            if errors:
+                raise errors.pop()
+            return create(**kwargs)
+        with mock.patch.object(PaperSet.objects, 'create', create_locked_once):
+            response = self.client.post('/api/insert_paperset', {'name': 'set', 'description': 'set'},
+                                        content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(PaperSet.objects.count(), 1)
+
+
+class QueryPlanTest(TestCase):
+    ''' the main query of each view is answered from an index, not a full scan '''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='owner', password='password')
+        cls.paper = make_paper(cls.user, 'paper', ['someone'])
+        cls.paperset = PaperSet.objects.create(user=cls.user, name='set', description='set')
+
+    def plan(self, queryset) -> list[str]:
+        return [i.split(' ', 3)[-1] for i in queryset.explain().splitlines()]
+
+    def assert_indexed(self, queryset, listing: bool = False):
+        '''
+        no table is scanned, only a listing of every visible row may scan the
+        table in primary key order, which stops after the page
+        and no page is sorted, except by full-text rank
+        '''
+        plan = self.plan(queryset)
+        for i in plan:
+            if re.fullmatch(r'SCAN \w+', i) and not listing:
+                self.fail(f'full scan in {plan}')
+            if i == 'USE TEMP B-TREE FOR ORDER BY':
+                self.fail(f'sorted in {plan}')
+
+    def test_duplicate_titles(self):
+        self.assert_indexed(Paper.objects.filter(title='paper'))
+        self.assert_indexed(Paper.objects.filter(title__in=['paper', 'other']).values_list('title', flat=True))
+
+    def test_comments(self):
+        self.assert_indexed(PaperTextComments.objects.filter(paper=self.paper).order_by('commented_on', 'id')[:3])
+        self.assert_indexed(PaperSetTextComments.objects.filter(paperset=self.paperset).order_by('commented_on', 'id')[:3])
+
+    def test_visibility(self):
+        self.assert_indexed(Paper.objects.filter(user=self.user, private=True))
+        self.assert_indexed(PaperSet.objects.filter(user=self.user, private=True))
+
+    def test_membership(self):
+        self.assert_indexed(PaperSetContent.objects.filter(paper_set=self.paperset, paper__in=[self.paper]))
+        self.assert_indexed(search_paper(QueryDict(f'papersetid={self.paperset.id}'), self.user).order_by('id')[:3])
+
+    def test_search(self):
+        self.assert_indexed(search_paper(QueryDict(''), self.user).order_by('id')[:3], listing=True)
+        self.assert_indexed(search_paper(QueryDict(''), self.user).order_by('-rating', 'id')[:3], listing=True)
+        self.assert_indexed(search_paper(QueryDict('title=paper'), self.user).order_by('id')[:3])
+        self.assert_indexed(search_paperset(QueryDict(''), self.user).order_by('id')[:3], listing=True)
+        self.assert_indexed(search_paperset(QueryDict('papertitle=paper'), self.user).order_by('id')[:3])
+
+    def test_authors(self):
+        self.assert_indexed(PaperByScholar.objects.filter(paper__in=[self.paper]))
+
+    def test_reviews(self):
+        self.assert_indexed(PaperStarComments.objects.filter(paper=self.paper, user=self.user))
+
+
+class CitationGraphTest(TemporaryMediaMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='owner', password='password')
+        cls.other = User.objects.create_user(username='other', password='password')
+        cls.papers = [make_paper(cls.user, f'paper {i}') for i in range(6)]
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def cite(self, paper: Paper, cited: list[Paper], url: str = '/api/add_citations'):
+        payload = {'paperid': paper.id, 'paperid_list': [i.id for i in cited]}
+        return self.client.post(url, payload, content_type='application/json')
+
+    def totals(self) -> list[int]:
+        return [Paper.objects.get(pk=i.id).total_citations for i in self.papers]
+
+    def graph(self, paper: Paper, **params) -> dict:
+        response = self.client.get('/api/citation_graph', {'paperid': paper.id, **params})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()['data']
+        return {i['title']: i['depth'] for i in data['data_list']}
+
+    def test_total_citations(self):
+        p = self.papers
+        self.assertEqual(self.cite(p[1], [p[0], p[2]]).json()['status'], 'ok')
+        self.cite(p[2], [p[0]])
+        response = self.cite(p[3], [p[0], p[0]])
+        self.assertEqual(response.json()['status'], 'ok')
+        self.assertEqual(self.totals(), [3, 0, 1, 0, 0, 0])
+        response = self.cite(p[1], [p[0], p[4]])
+        self.assertEqual(response.json()['data']['already_cited'], [str(p[0].id)])
+        self.assertEqual(self.totals(), [3, 0, 1, 0, 1, 0])
+        response = self.cite(p[1], [p[0], p[5]], '/api/delete_citations')
+        self.assertEqual(response.json()['data']['not_cited'], [str(p[5].id)])
+        self.assertEqual(self.totals(), [2, 0, 1, 0, 1, 0])
+        Paper.objects.get(pk=p[2].id).delete()
+        self.assertEqual(Paper.objects.get(pk=p[0].id).total_citations, 1)
+
+    def test_payload_total_is_ignored(self):
+        self.client.post('/api/insert_paper', {
+                'title': 'typed', 'abstract': '', 'authors': [], 'publication_date': '2024-01-01',
+                'journal': '', 'total_citations': 100, 'file_name': 'typed.pdf',
+                'file_content': base64.b64encode(b'%PDF').decode()}, content_type='application/json')
+        self.assertEqual(Paper.objects.get(title='typed').total_citations, 0)
+
+    def test_permissions(self):
+        p = self.papers
+        self.assertEqual(self.cite(p[0], [p[0]]).status_code, 400)
+        self.client.force_login(self.other)
+        self.assertEqual(self.cite(p[0], [p[1]]).status_code, 401)
+
+    def test_neighborhood(self):
+        p = self.papers
+        # 1 and 2 cite 0, 3 cites 1 and 2, 4 cites 3, 0 cites 4
+        for citing, cited in [(1, [0]), (2, [0]), (3, [1, 2]), (4, [3]), (0, [4])]:
+            self.cite(p[citing], [p[i] for i in cited])
+        self.assertEqual(self.graph(p[0]), {'paper 0': 0, 'paper 1': 1, 'paper 2': 1})
+        self.assertEqual(self.graph(p[0], depth=3),
+                         {'paper 0': 0, 'paper 1': 1, 'paper 2': 1, 'paper 3': 2, 'paper 4': 3})
+        self.assertEqual(self.graph(p[0], depth=3, fanout=1), {'paper 0': 0, 'paper 1': 1, 'paper 3': 2, 'paper 4': 3})
+        self.assertEqual(self.graph(p[0], depth=5, limit=2), {'paper 0': 0, 'paper 1': 1})
+        self.assertEqual(self.graph(p[4], direction='cites', depth=2), {'paper 4': 0, 'paper 3': 1, 'paper 1': 2, 'paper 2': 2})
+        response = self.client.get('/api/citation_graph', {'paperid': p[0].id})
+        citations = {(i['cite_paperid'], i['paperid']) for i in response.json()['data']['citations']}
+        self.assertEqual(citations, {(str(p[1].id), str(p[0].id)), (str(p[2].id), str(p[0].id))})
+
+    def test_private_papers_are_not_followed(self):
+        p = self.papers
+        hidden = make_paper(self.other, 'hidden', private=True)
+        PaperCited.objects.create(paper=p[0], cite_paper=hidden)
+        PaperCited.objects.create(paper=hidden, cite_paper=p[1])
+        self.assertEqual(self.graph(p[0], depth=2), {'paper 0': 0})
+        self.client.force_login(self.other)
+        self.assertEqual(self.graph(p[0], depth=2), {'paper 0': 0, 'hidden': 1, 'paper 1': 2})
+
+    def test_invalid_params(self):
+        for params in [{'direction': 'up'}, {'depth': 'two'}, {'depth': 100}, {'fanout': 0}, {'limit': -1}]:
+            response = self.client.get('/api/citation_graph', {'paperid': self.papers[0].id, **params})
+            self.assertEqual(response.status_code, 400)
+
+
+class PageRankTest(TemporaryMediaMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='owner', password='password')
+        cls.papers = [make_paper(cls.user, f'paper {i}') for i in range(5)]
+
+    def cite(self, edges: list[tuple[int, int]]):
+        PaperCited.objects.bulk_create([PaperCited(paper=self.papers[cited], cite_paper=self.papers[citing])
+                                        for citing, cited in edges])
+
+    def compute(self, *args) -> str:
+        out = StringIO()
+        call_command('compute_pagerank', *args, stdout=out)
+        return out.getvalue()
+
+    def ranks(self) -> list[float]:
+        return [Paper.objects.get(pk=i.id).pagerank for i in self.papers]
+
+    def check_pagerank(self):
+        # a cycle ranks every paper the same
+        scores, _ = pagerank.pagerank(3, array('q', [0, 1, 2]), array('q', [1, 2, 0]))
+        for i in scores:
+            self.assertAlmostEqual(i, 1 / 3)
+        # 1 and 2 cite 0, 3 cites 1 and 2, 4 cites nothing and isn't cited
+        scores, _ = pagerank.pagerank(5, array('q', [1, 2, 3, 3]), array('q', [0, 0, 1, 2]))
+        self.assertAlmostEqual(sum(scores), 1)
+        self.assertGreater(scores[0], scores[1])
+        self.assertAlmostEqual(scores[1], scores[2])
+        self.assertGreater(scores[1], scores[3])
+        self.assertAlmostEqual(scores[3], scores[4])
+        return scores
+
+    def test_python_pagerank(self):
+        with mock.patch.object(pagerank, 'numpy', None):
+            self.check_pagerank()
+
+    def test_numpy_pagerank(self):
+        self.assertIsNotNone(pagerank.numpy, 'numpy is in requirements.txt')
+        scores = self.check_pagerank()
+        with mock.patch.object(pagerank, 'numpy', None):
+            for a, b in zip(scores, self.check_pagerank()):
+                self.assertAlmostEqual(a, b)
+
+    def test_order_by_influence(self):
+        self.cite([(1, 0), (2, 0), (3, 1), (3, 2), (4, 3)])
+        self.compute()
+        self.client.force_login(self.user)
+        response = self.client.get('/api/search_paper', {'order': 'influence', 'per_page': 5})
+        titles = [i['title'] for i in response.json()['data']['data_list']]
+        self.assertEqual(titles[0], 'paper 0')
+        self.assertEqual(titles[-1], 'paper 4')
+
+    def test_repairs_counts(self):
+        self.cite([(1, 0), (2, 0), (2, 1)])
+        Paper.objects.filter(pk=self.papers[0].id).update(total_citations=7)
+        self.compute()
+        paper = Paper.objects.get(pk=self.papers[0].id)
+        self.assertEqual(paper.total_citations, 2)
+        self.assertEqual(Paper.objects.get(pk=self.papers[2].id).reference_count, 2)
+
+    def test_incremental_rerun(self):
+        self.cite([(1, 0), (2, 0), (3, 1)])
+        self.assertIn('with numpy, updated 5', self.compute())
+        ranks = self.ranks()
+        # nothing changed, nothing is written and the stored scores are kept
+        self.assertIn('updated 0', self.compute())
+        self.cite([(4, 3)])
+        self.compute('--tolerance', '1e-12')
+        warm = self.ranks()
+        self.compute('--from-scratch', '--tolerance', '1e-12')
+        for a, b in zip(warm, self.ranks()):
+            self.assertAlmostEqual(a, b)
+        self.assertGreater(warm[3], ranks[3])
+
+    @override_settings(WRITE_RETRY_DELAY=0)
+    def test_locked_run_is_retried(self):
+        self.cite([(1, 0)])
+        load_graph = pagerank.load_graph
+        with mock.patch.object(pagerank, 'load_graph',
+                               side_effect=[OperationalError('database is locked'), load_graph()]) as loaded:
+            self.assertIn('updated 5', self.compute())
+        self.assertEqual(loaded.call_count, 2)
+
+    def test_reference_count(self):
+        self.client.force_login(self.user)
+        p = self.papers
+        self.client.post('/api/add_citations', {'paperid': p[1].id, 'paperid_list': [p[0].id, p[2].id]},
+                         content_type='application/json')
+        self.assertEqual(Paper.objects.get(pk=p[1].id).reference_count, 2)
+        self.client.post('/api/delete_citations', {'paperid': p[1].id, 'paperid_list': [p[2].id]},
+                         content_type='application/json')
+        self.assertEqual(Paper.objects.get(pk=p[1].id).reference_count, 1)
+        Paper.objects.get(pk=p[0].id).delete()
+        self.assertEqual(Paper.objects.get(pk=p[1].id).reference_count, 0)
+
+
+class BenchmarkTest(TemporaryMediaMixin, TestCase):
+
+    def test_every_route_runs(self):
+        self.assertEqual(benchmark.missing_routes(), [])
+        benchmark.seed_data(20)
+        self.assertEqual(Paper.objects.count(), 20)
+        dataset = benchmark.Dataset()
+        target = benchmark.TestClientTarget()
+        for name in benchmark.ROUTES:
+            result = benchmark.run_route(target, dataset, name, 2, 1)
+            self.assertEqual(result['errors'], 0, name)
+            self.assertEqual(result['requests'], 2)
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+            self.assertGreater(result['queries'], 0, name)
+
+    def test_regressions(self):
+        baseline = {'search_paper': {'p95_ms': 10, 'queries': 4, 'errors': 0}}
+        result = {'p50_ms': 5, 'p95_ms': 11, 'p99_ms': 12, 'queries': 4, 'errors': 0}
+        self.assertEqual(benchmark.regressions({'search_paper': result}, baseline, 0.2), [])
+        self.assertEqual(len(benchmark.regressions({'search_paper': dict(result, p95_ms=13)}, baseline, 0.2)), 1)
+        self.assertEqual(len(benchmark.regressions({'search_paper': dict(result, queries=5)}, baseline, 0.2)), 1)
+        self.assertEqual(benchmark.regressions({'paper_detail': dict(result, p95_ms=100)}, baseline, 0.2), [])
+
+    def test_server_is_not_seeded_by_default(self):
+        server = ['benchmark', '--server', 'http://localhost:8000', '--routes', 'userid']
+        with self.assertRaisesMessage(CommandError, '--password'):
+            call_command(*server)
+        # the tests run with DEBUG off
+        with self.assertRaisesMessage(CommandError, 'DEBUG'):
+            call_command(*server, '--seed-server')
+        self.assertFalse(User.objects.exists())
+
+
+class MicroBenchmarkTest(TemporaryMediaMixin, TestCase):
+
+    def test_every_group_runs(self):
+        results = microbench.run(microbench.GROUPS, 1, [2], [1], [3])
+        self.assertEqual(len(results), 9)
+        for name, result in results.items():
+            self.assertLessEqual(result['min_ms'], result['mean_ms'], name)
+        # the base64 payload is decoded whole, the raw body is streamed in chunks
+        self.assertGreater(results['file_md5 1 MB']['peak_kb'], 1024)
+        self.assertLess(results['receive_raw_upload 1 MB']['peak_kb'], 1024)
+
+
+class MetricsTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='owner', password='password')
+        cls.paper = make_paper(cls.user, 'measured')
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        override = override_settings(METRICS_DIR=self.directory, METRICS_TOKEN='token')
+        override.enable()
+        self.addCleanup(override.disable)
+        metrics.store.clear()
+        self.addCleanup(metrics.store.clear)
+        self.client.force_login(self.user)
+
+    def scrape(self) -> dict[str, float]:
+        response = self.client.get('/metrics', headers={'Authorization': 'Bearer token'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        samples = {}
+        for line in response.content.decode().splitlines():
+            if not line.startswith('#'):
+                name, value = line.rsplit(' ', 1)
+                samples[name] = float(value)
+        return samples
+
+    def test_per_route(self):
+        for _ in range(3):
+            self.client.get('/api/get_paper_review', {'paperid': self.paper.id})
+        self.client.get('/api/get_paper_review', {'paperid': 0})
+        response = self.client.get('/api/get_paper_review', {'paperid': self.paper.id})
+        samples = self.scrape()
+        route = 'route="api/get_paper_review"'
+        self.assertEqual(samples[f'paperlist_requests_total{{{route},status="200"}}'], 4)
+        self.assertEqual(samples[f'paperlist_requests_total{{{route},status="400"}}'], 1)
+        self.assertEqual(samples[f'paperlist_request_duration_seconds_count{{{route}}}'], 5)
+        self.assertEqual(samples[f'paperlist_request_duration_seconds_bucket{{{route},le="+Inf"}}'], 5)
+        self.assertGreater(samples[f'paperlist_db_queries_total{{{route}}}'], 0)
+        self.assertGreater(samples[f'paperlist_db_query_seconds_total{{{route}}}'], 0)
+        self.assertGreaterEqual(samples[f'paperlist_response_bytes_total{{{route}}}'], 5 * len(response.content) - 100)
+        self.client.get('/api/nothing')
+        self.assertEqual(self.scrape()['paperlist_requests_total{route="unmatched",status="404"}'], 1)
+
+    def test_access(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', headers={'Authorization': 'Bearer other'}).status_code, 403)
+        with override_settings(METRICS_ALLOWED_IPS=['127.0.0.1']):
+            self.assertEqual(self.client.get('/metrics').status_code, 200)
+        self.client.force_login(User.objects.create_user(username='staff', is_staff=True))
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+        self.client.logout()
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+
+    def test_workers_are_summed(self):
+        self.client.get('/api/userid')
+        other = {
+                'requests': [['api/userid', 200, 2]],
+                'routes': {'api/userid': [2] + [0] * len(metrics.BUCKETS) + [0.002, 2, 0.001, 100]},
+                }
+        with open(os.path.join(self.directory, 'exited_worker.json'), 'w') as file:
+            json.dump(other, file)
+        samples = self.scrape()
+        self.assertEqual(samples['paperlist_requests_total{route="api/userid",status="200"}'], 3)
+        self.assertEqual(samples['paperlist_request_duration_seconds_bucket{route="api/userid",le="0.005"}'], 3)
+        self.assertEqual(samples['paperlist_request_duration_seconds_count{route="api/userid"}'], 3)
+
+    def test_exited_workers_are_merged(self):
+        self.client.get('/api/userid')
+        other = {'requests': [['api/userid', 200, 2]], 'routes': {'api/userid': [2] + [0] * (len(metrics.BUCKETS) + 4)}}
+        # pids above the kernel's limit, of no process
+        for name in ['999999998_a.json', '999999999_b.json']:
+            with open(os.path.join(self.directory, name), 'w') as file:
+                json.dump(other, file)
+        for _ in range(2):
+            samples = self.scrape()
+            self.assertEqual(samples['paperlist_requests_total{route="api/userid",status="200"}'], 5)
+        self.assertEqual(sorted(i for i in os.listdir(self.directory) if i.endswith('.json')),
+                         sorted([metrics.EXITED, metrics.store.name]))
+
+
+@override_settings(PROFILER_ENABLED=True)
+class ProfilerTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user(username='staff', password='password', is_staff=True)
+        cls.user = User.objects.create_user(username='owner', password='password')
+        cls.paper = make_paper(cls.user, 'profiled')
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        override = override_settings(PROFILE_DIR=self.directory)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def get(self, user: User, **headers):
+        self.client.force_login(user)
+        return self.client.get('/api/get_paper_review', {'paperid': self.paper.id}, headers=headers)
+
+    def profiles(self) -> list[str]:
+        return sorted(i.removesuffix('.speedscope.json') for i in os.listdir(self.directory) if i.endswith('.speedscope.json'))
+
+    def check_profile(self, name: str, view: str):
+        with open(os.path.join(self.directory, f'{name}.speedscope.json')) as file:
+            profile = json.load(file)
+        frames = [i['name'] for i in profile['shared']['frames']]
+        self.assertIn(view, frames)
+        stack = []
+        last = 0
+        for event in profile['profiles'][0]['events']:
+            self.assertGreaterEqual(event['at'], last)
+            last = event['at']
+            if event['type'] == 'O':
+                stack.append(event['frame'])
+            else:
+                self.assertEqual(stack.pop(), event['frame'])
+        self.assertEqual(stack, [])
+        with open(os.path.join(self.directory, f'{name}.sql')) as file:
+            sql = file.read()
+        self.assertIn('"api_paper"', sql)
+        self.assertEqual(os.stat(self.directory).st_mode & 0o777, 0o700)
+        for suffix in ['.sql', '.speedscope.json']:
+            self.assertEqual(os.stat(os.path.join(self.directory, name + suffix)).st_mode & 0o777, 0o600)
+
+    def test_secrets_are_redacted(self):
+        tracer = profiler.Tracer()
+        queries = profiler.QueryLog(tracer)
+        with connection.execute_wrapper(queries):
+            User.objects.filter(password='hash').exists()
+            Paper.objects.filter(title='profiled').exists()
+        text = queries.text()
+        self.assertNotIn('hash', text)
+        self.assertIn(profiler.REDACTED, text)
+        self.assertIn("'profiled'", text)
+
+    def test_staff_header(self):
+        response = self.get(self.staff, **{'X-Profile': '1'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.profiles(), [response['X-Profile-Id']])
+        self.check_profile(response['X-Profile-Id'], 'get_get_paper_review')
+        # only staff can ask for a profile
+        self.assertNotIn('X-Profile-Id', self.get(self.user, **{'X-Profile': '1'}))
+        self.assertEqual(len(self.profiles()), 1)
+
+    @override_settings(PROFILE_SAMPLE_RATE=1, PROFILE_KEEP=2)
+    def test_sampled_and_rotated(self):
+        names = [self.get(self.user)['X-Profile-Id'] for _ in range(3)]
+        self.assertEqual(self.profiles(), names[1:])
+        self.assertEqual(len(os.listdir(self.directory)), 4)
+
+    async def test_async_view(self):
+        await self.async_client.aforce_login(self.staff)
+        response = await self.async_client.get('/api/paper_detail', {'paperid': self.paper.id}, headers={'X-Profile': '1'})
+        self.assertEqual(response.status_code, 200)
+        # the checks and queries run in the profiled thread
+        self.check_profile(response['X-Profile-Id'], 'paperid_exist.<locals>.check')
+
+    @override_settings(PROFILER_ENABLED=False, PROFILE_SAMPLE_RATE=1)
+    def test_disabled(self):
+        self.assertNotIn('X-Profile-Id', self.get(self.staff, **{'X-Profile': '1'}))
+        self.assertEqual(self.profiles(), [])
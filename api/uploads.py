@@ -0,0 +1,69 @@
+'''
+stream uploaded pdfs to disk chunk by chunk, hashing them on the way, so an
+upload never has to fit in memory
+'''
+
+from hashlib import md5
+
+from django.conf import settings
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.core.files.uploadhandler import StopUpload, TemporaryFileUploadHandler
+
+CHUNK_SIZE = 0x10000  # 64 KB
+
+
+class UploadTooLarge(Exception):
+    ''' the uploaded pdf is over settings.MAX_PAPER_UPLOAD_SIZE '''
+
+    def __init__(self):
+        super().__init__(f'file_content larger than {settings.MAX_PAPER_UPLOAD_SIZE} bytes')
+
+
+class MD5TemporaryFileUploadHandler(TemporaryFileUploadHandler):
+    '''
+    multipart upload handler, the uploaded file gets an md5 attribute, too_large
+    is set when the upload was stopped for being over the size limit
+    '''
+    too_large = False
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.md5 = md5()
+
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) > settings.MAX_PAPER_UPLOAD_SIZE:
+            self.too_large = True
+            # the parser drops the file, and leaves the rest of the body unread
+            raise StopUpload(connection_reset=True)
+        self.md5.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        file.md5 = self.md5.hexdigest()
+        return file
+
+
+def receive_raw_upload(request, content_type: str = 'application/pdf') -> TemporaryUploadedFile:
+    '''
+    copy the raw request body to a temporary file, which gets an md5 attribute,
+    raise UploadTooLarge past settings.MAX_PAPER_UPLOAD_SIZE
+    '''
+    file = TemporaryUploadedFile('upload', content_type, 0, None)
+    hasher = md5()
+    while chunk := request.read(CHUNK_SIZE):
+        if file.tell() + len(chunk) > settings.MAX_PAPER_UPLOAD_SIZE:
+            file.close()
+            raise UploadTooLarge()
+        hasher.update(chunk)
+        file.write(chunk)
+    file.size = file.tell()
+    file.seek(0)
+    file.md5 = hasher.hexdigest()
+    return file
+
+
+def named_by_md5(file: TemporaryUploadedFile) -> TemporaryUploadedFile:
+    ''' the file is stored under its md5, like the base64 uploads '''
+    file.name = file.md5
+    return file
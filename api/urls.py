@@ -13,6 +13,10 @@ urlpatterns = [
     path('get_user_detail', get_user_detail),
     path('get_user_loggedin', get_user_loggedin),
     path('insert_paper', post_insert_paper),
+    path('insert_papers', post_insert_papers),
+    path('add_citations', post_add_citations),
+    path('delete_citations', post_delete_citations),
+    path('citation_graph', get_citation_graph),
     path('delete_paper', post_delete_paper),
     path('search_paper', get_search_paper),
     path('paper_detail', get_paper_detail),
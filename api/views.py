@@ -1,18 +1,36 @@
+import copy
+import os
 from http import HTTPStatus
 
+from asgiref.sync import sync_to_async
 from django.contrib.auth.models import User
 from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
+from django.core.exceptions import ValidationError
 from django.core.files.base import ContentFile
-from django.db import transaction
-from django.db.models import QuerySet, Q, Avg
+from django.db import OperationalError, transaction
+from django.db.models import QuerySet, Q
 from django.http import HttpResponse, JsonResponse
+from django.urls import reverse
+from django.utils.http import urlencode
 
-from .models import Paper, PaperByScholar, PaperSet, PaperTextComments, \
-        PaperStarComments, PaperSetContent, PaperSetTextComments
-from .decorators import allow_methods, get_with_pages, login_required, has_json_payload, \
-        paperid_exist, paperid_list_exist, paperset_exists, user_can_modify_paper, has_query_params, \
-        user_can_comment_paper, user_can_view_paper, user_paperset_action
-from .widgets import file_md5
+from .models import Paper, PaperByScholar, PaperCited, PaperSet, PaperTextComments, \
+        PaperStarComments, PaperSetContent, PaperSetTextComments, bump_generation, review_paper
+from .decorators import allow_methods, cache_response, get_with_pages, login_required, has_json_payload, has_paper_payload, \
+        metrics_allowed, paperid_exist, paperid_list_exist, paperset_exists, user_can_modify_paper, has_query_params, \
+        retry_when_locked, user_can_comment_paper, user_can_view_paper, user_paperset_action
+from .citations import DIRECTIONS, add_citations, neighborhood, remove_citations
+from .fts import fts_available, fts_filter, fts_match, fts_rank
+from .metrics import collect, render
+from .responses import file_response, json_with_file_response
+from .rowcache import outdate_rows
+from .serializers import comment_list_json, paper_list_json, paperset_list_json
+from .widgets import encode_cursor, file_md5
+
+
+MAX_BULK_PAPERS = 1000
+MAX_CITATION_DEPTH = 5
+MAX_CITATION_FANOUT = 1000
+MAX_CITATION_PAPERS = 10000
 
 
 def paginate_queryset(queryset: QuerySet, per_page: int, page: int = 1):
@@ -28,15 +46,134 @@ def paginate_queryset(queryset: QuerySet, per_page: int, page: int = 1):
     return page_list, paginator.num_pages, page_list.number
 
 
-def save_paper(request):
-    form: dict = request.json_payload
-    form['user'] = request.user
-    file_binary, file_name = file_md5(form['file_content'])
-    form['file_content'] = ContentFile(content=file_binary, name=file_name)
+async def apaginate_queryset(queryset: QuerySet, per_page: int, page: int = 1):
+    ''' paginate_queryset with the async ORM, pages out of range are the last page '''
+    total_page = max(1, -(-await queryset.acount() // per_page))
+    if page < 1 or page > total_page:
+        page = total_page
+    rows = [i async for i in queryset[(page - 1) * per_page:page * per_page]]
+    return rows, total_page, page
+
+
+def cursor_value(queryset: QuerySet, field: str, value):
+    ''' the cursor value as the type of the ordering field, raise ValueError if it can't be one '''
+    annotation = queryset.query.annotations.get(field)
+    model_field = annotation.output_field if annotation is not None else queryset.model._meta.get_field(field)
+    # the cursor comes from the client, it may hold anything json can
+    try:
+        return model_field.to_python(value)
+    except (TypeError, ValidationError) as err:
+        raise ValueError(f'bad value for {field}') from err
+
+
+def cursor_query(queryset: QuerySet, ordering: list[str], per_page: int, after: list | None) -> QuerySet:
+    '''
+    keyset pagination, the rows after the cursor, and one more to tell if
+    there is a next page
+    rows are compared on the ordering fields, so no OFFSET scan is needed,
+    a field starting with - is in descending order
+    '''
+    fields = [i.lstrip('-') for i in ordering]
+    if after:
+        if len(after) != len(ordering):
+            raise ValueError('cursor does not match this query')
+        after = [cursor_value(queryset, field, value) for field, value in zip(fields, after)]
+        # (a, b) > (x, y)  <=>  a > x or (a = x and b > y)
+        condition = Q()
+        for i, field in enumerate(fields):
+            lookup = 'lt' if ordering[i].startswith('-') else 'gt'
+            condition |= Q(**dict(zip(fields[:i], after[:i])), **{f'{field}__{lookup}': after[i]})
+        queryset = queryset.filter(condition)
+    return queryset.order_by(*ordering)[:per_page + 1]
+
+
+def cursor_page(rows: list, ordering: list[str], per_page: int):
+    ''' the rows of the page, and the cursor of the next page, None on the last page '''
+    if len(rows) <= per_page:
+        return rows, None
+    rows = rows[:per_page]
+    return rows, encode_cursor([getattr(rows[-1], i.lstrip('-')) for i in ordering])
+
+
+def paginate_cursor(queryset: QuerySet, ordering: list[str], per_page: int, after: list | None):
+    ''' the rows after the cursor and the cursor of the next page, see cursor_query '''
+    return cursor_page(list(cursor_query(queryset, ordering, per_page, after)), ordering, per_page)
+
+
+async def apaginate_cursor(queryset: QuerySet, ordering: list[str], per_page: int, after: list | None):
+    rows = [i async for i in cursor_query(queryset, ordering, per_page, after)]
+    return cursor_page(rows, ordering, per_page)
+
+
+def paged_json_response(request, queryset: QuerySet, ordering: list[str], list_key: str, serialize) -> JsonResponse:
+    '''
+    respond with one page of queryset, page numbers by default, or cursors
+    if the request has an after param, total_page is only counted in cursor
+    mode when with_total=true
+    '''
+    if request.after is None:
+        page, total_page, current_page = paginate_queryset(queryset.order_by(*ordering), request.per_page, request.page)
+        return JsonResponse({'status': 'ok', 'data': {
+                list_key: serialize(page),
+                'total_page': total_page,
+                'current_page': current_page,
+            }})
+    try:
+        page, next_cursor = paginate_cursor(queryset, ordering, request.per_page, request.after)
+    except ValueError as err:
+        return JsonResponse({'status': 'error', 'error': f'invalid cursor: {err}'}, status=HTTPStatus.BAD_REQUEST)
+    data = {
+            list_key: serialize(page),
+            'next_cursor': next_cursor,
+        }
+    if request.GET.get('with_total') in ['true', 'True']:
+        data['total_page'] = max(1, -(-queryset.count() // request.per_page))
+    return JsonResponse({'status': 'ok', 'data': data})
+
+
+async def apaged_json_response(request, queryset: QuerySet, ordering: list[str], list_key: str, serialize) -> JsonResponse:
+    '''
+    paged_json_response with the async ORM, serialize still runs in a thread,
+    prefetching has no async API
+    '''
+    if request.after is None:
+        page, total_page, current_page = await apaginate_queryset(queryset.order_by(*ordering), request.per_page, request.page)
+        return JsonResponse({'status': 'ok', 'data': {
+                list_key: await sync_to_async(serialize)(page),
+                'total_page': total_page,
+                'current_page': current_page,
+            }})
+    try:
+        page, next_cursor = await apaginate_cursor(queryset, ordering, request.per_page, request.after)
+    except ValueError as err:
+        return JsonResponse({'status': 'error', 'error': f'invalid cursor: {err}'}, status=HTTPStatus.BAD_REQUEST)
+    data = {
+            list_key: await sync_to_async(serialize)(page),
+            'next_cursor': next_cursor,
+        }
+    if request.GET.get('with_total') in ['true', 'True']:
+        data['total_page'] = max(1, -(-await queryset.acount() // request.per_page))
+    return JsonResponse({'status': 'ok', 'data': data})
+
+
+def build_paper(form: dict, user: User, uploaded_file=None) -> tuple[Paper, list[str]]:
+    ''' an unsaved paper from the payload, and its authors '''
+    form = dict(form, user=user)
+    # counted from the citations
+    for i in ['total_citations', 'reference_count', 'pagerank']:
+        form.pop(i, None)
+    if uploaded_file is not None:
+        form['file_content'] = uploaded_file
+    else:
+        file_binary, file_name = file_md5(form['file_content'])
+        form['file_content'] = ContentFile(content=file_binary, name=file_name)
     # extract authors
     authors: list[str] = form.pop('authors')
-    # TODO: make these atomic
-    paper = Paper(**form)
+    return Paper(**form), authors
+
+
+def save_paper(request):
+    paper, authors = build_paper(request.json_payload, request.user, request.uploaded_file)
     paper.save()
     return paper, authors
 
@@ -56,12 +193,33 @@ def search_paper(params: dict[str, str], user: User) -> QuerySet:
     if not__papersetid:
         papers_excluded = PaperSetContent.objects.filter(paper_set_id=not__papersetid).values_list('paper_id', flat=True)
         queryset = queryset.exclude(id__in=papers_excluded)
-    if params.get('title'):
+    # keyword filters are answered by the full-text index, unless regex is
+    # asked for, or the client falls back with fts=false
+    use_fts = not use_regex and params.get('fts', 'true') not in ['false', 'False'] and fts_available()
+    keyword = params.get('keyword')
+    match = fts_match(keyword) if keyword and use_fts else None
+    if match:
+        queryset = fts_rank(fts_filter(queryset, match), match)
+    elif keyword:
+        lookup = 'regex' if use_regex else 'icontains'
+        queryset = queryset.filter(
+                Q(**{f'title__{lookup}': keyword}) | Q(**{f'abstract__{lookup}': keyword}) | Q(**{f'journal__{lookup}': keyword})
+                | Q(id__in=PaperByScholar.objects.filter(**{f'scholar__{lookup}': keyword}).values('paper_id')))
+    # word-prefix matches from the index, 'ention' finds no 'attention' unless
+    # fts=false, input without any word, like '!!!', has nothing to look up in
+    # the index and is matched as a substring
+    matched = set()
+    for field, column in [('title', 'title'), ('journal', 'journal'), ('author', 'authors')]:
+        match = fts_match(params.get(field), column) if params.get(field) and use_fts else None
+        if match:
+            queryset = fts_filter(queryset, match)
+            matched.add(field)
+    if params.get('title') and 'title' not in matched:
         if use_regex:
             queryset = queryset.filter(title__regex=params.get('title'))
         elif params.get('title') != '':
             queryset = queryset.filter(title__icontains=params.get('title'))
-    if params.get('journal'):
+    if params.get('journal') and 'journal' not in matched:
         if use_regex:
             queryset = queryset.filter(journal__regex=params.get('journal'))
         elif params.get('journal') != '':
@@ -71,11 +229,13 @@ def search_paper(params: dict[str, str], user: User) -> QuerySet:
             queryset = queryset.filter(user__username__regex=params.get('uploader'))
         elif params.get('uploader') != '':
             queryset = queryset.filter(user__username__icontains=params.get('uploader'))
-    if params.get('author'):
+    if params.get('author') and 'author' not in matched:
         if use_regex:
             queryset = queryset.filter(paperbyscholar__scholar__regex=params.get('author'))
         elif params.get('author') != '':
             queryset = queryset.filter(paperbyscholar__scholar__icontains=params.get('author'))
+    if params.get('min_rating'):
+        queryset = queryset.filter(rating__gte=float(params.get('min_rating')))
     # then filter private
     # test this some day
     return queryset.filter(Q(private=False) | Q(user=user))
@@ -109,7 +269,7 @@ def search_paperset_only(params: dict[str, str], user: User) -> QuerySet:
 
 def search_paperset_bypaper(params: dict[str, str], user: User) -> QuerySet:
     search_paper_params = {}
-    for i in ['papertitle', 'paperjournal', 'paperuploader', 'paperauthor']:
+    for i in ['paperkeyword', 'papertitle', 'paperjournal', 'paperuploader', 'paperauthor']:
         if i in params:
             search_paper_params[i[len('paper'):]] = params[i]
     paper_queryset = search_paper(search_paper_params, user)
@@ -119,7 +279,7 @@ def search_paperset_bypaper(params: dict[str, str], user: User) -> QuerySet:
 
 
 def search_paperset(params: dict[str, str], user: User) -> QuerySet:
-    for i in ['papertitle', 'paperjournal', 'paperuploader', 'paperauthor']:
+    for i in ['paperkeyword', 'papertitle', 'paperjournal', 'paperuploader', 'paperauthor']:
         if params.get(i):
             return search_paperset_bypaper(params, user)
     return search_paperset_only(params, user)
@@ -128,28 +288,90 @@ def search_paperset(params: dict[str, str], user: User) -> QuerySet:
 # Create your views here.
 @allow_methods(['POST'])
 @login_required()
-@has_json_payload()
+@has_paper_payload()
+@retry_when_locked()
 def post_insert_paper(request):
     ''' create scholar if not exist '''
     title = request.json_payload['title']
-    if len(Paper.objects.filter(title=title)) != 0:
+    if Paper.objects.filter(title=title).exists():
         return JsonResponse({'status': 'error', 'error': f'paper of title {title} already exists'}, status=HTTPStatus.BAD_REQUEST)
     try:
-        with transaction.atomic():
+        # a failure rolls back the view's transaction, which retry_when_locked opened
+        with transaction.atomic(savepoint=False):
             paper, authors = save_paper(request)
-            for i in authors:
-                PaperByScholar.objects.create(paper=paper, scholar=i)
+            paper.set_authors(authors)
+    except OperationalError:
+        raise
     except Exception as err:
         return JsonResponse({'status': 'error', 'error': f'exception occured: {err}'}, status=HTTPStatus.INTERNAL_SERVER_ERROR)
     return JsonResponse({'status': 'ok', 'message': 'paper inserted'})
 
 
+@allow_methods(['POST'])
+@login_required()
+@has_json_payload()
+@retry_when_locked()
+def post_insert_papers(request):
+    '''
+    insert a list of papers in one transaction, payload is {'papers': [...]}
+    with each paper like insert_paper's, invalid papers and duplicated titles
+    are skipped, the result of each paper is returned in order
+    '''
+    forms = request.json_payload.get('papers')
+    if not isinstance(forms, list):
+        return JsonResponse({'status': 'error', 'error': 'papers should be a list'}, status=HTTPStatus.BAD_REQUEST)
+    if len(forms) > MAX_BULK_PAPERS:
+        return JsonResponse({'status': 'error', 'error': f'at most {MAX_BULK_PAPERS} papers at a time'}, status=HTTPStatus.BAD_REQUEST)
+    titles = [i['title'] for i in forms if isinstance(i, dict) and isinstance(i.get('title'), str)]
+    existing = set(Paper.objects.filter(title__in=titles).values_list('title', flat=True))
+    results: list[dict] = []
+    papers: list[tuple[int, Paper, list[str]]] = []
+    for index, form in enumerate(forms):
+        try:
+            if form['title'] in existing:
+                raise ValueError(f'paper of title {form["title"]} already exists')
+            paper, authors = build_paper(form, request.user)
+            paper.clean_fields(exclude=['user', 'file_content'])
+            if not isinstance(authors, list) or not all(isinstance(i, str) for i in authors):
+                raise ValueError('authors should be a list of names')
+        except ValidationError as err:
+            results.append({'status': 'error', 'error': f'invalid paper: {err.message_dict}'})
+            continue
+        except (KeyError, TypeError, ValueError) as err:
+            results.append({'status': 'error', 'error': f'invalid paper: {err!r}'})
+            continue
+        # titles are unique within the batch too
+        existing.add(paper.title)
+        papers.append((index, paper, authors))
+        results.append({'status': 'ok'})
+    try:
+        with transaction.atomic(savepoint=False):
+            Paper.objects.bulk_create([i[1] for i in papers])
+            PaperByScholar.objects.bulk_create(
+                    [PaperByScholar(paper=paper, scholar=author, order=order)
+                     for _, paper, authors in papers for order, author in enumerate(dict.fromkeys(authors))])
+            bump_generation()
+            outdate_rows()
+    except OperationalError:
+        raise
+    except Exception as err:
+        return JsonResponse({'status': 'error', 'error': f'exception occured: {err}'}, status=HTTPStatus.INTERNAL_SERVER_ERROR)
+    for index, paper, _ in papers:
+        results[index]['paperid'] = str(paper.id)
+    return JsonResponse({
+            'status': 'ok' if len(papers) == len(forms) else 'warning',
+            'message': f'{len(papers)} of {len(forms)} papers inserted',
+            'data': { 'results': results },
+        })
+
+
 # Create your views here.
 @allow_methods(['POST'])
 @login_required()
 @has_json_payload()
 @paperid_exist('POST')
 @user_can_modify_paper()
+@retry_when_locked()
 def post_delete_paper(request):
     ''' create scholar if not exist '''
     request.paper.delete()
@@ -159,16 +381,33 @@ def post_delete_paper(request):
 @allow_methods(['GET'])
 @get_with_pages()
 @login_required()
-def get_search_paper(request):
-    ''' search by title/uploader/author/journal '''
+@cache_response([Paper])
+async def get_search_paper(request):
+    '''
+    search by keyword/title/uploader/author/journal, and min_rating
+    on sqlite, keyword, title, journal and author match the words starting
+    with each given word, not any substring, fts=false or regex=true match
+    substrings again, keyword in the title, abstract, journal or authors,
+    uploader always matches a substring
+    order=rating for the best rated first, order=influence for the highest
+    pagerank in the citation graph first
+    '''
     params: dict = request.GET
-    queryset = search_paper(params, request.user)
-    page, total_page, current_page = paginate_queryset(queryset.order_by('id'), request.per_page, request.page)
-    return JsonResponse({'status': 'ok', 'data': {
-            'data_list': [i.simple_json for i in page],
-            'total_page': total_page,
-            'current_page': current_page,
-        }})
+    try:
+        # a papersetid is looked up while building the query
+        queryset = await sync_to_async(search_paper)(params, request.user)
+    except ValueError as err:
+        return JsonResponse({'status': 'error', 'error': f'invalid search params: {err}'}, status=HTTPStatus.BAD_REQUEST)
+    if params.get('order') == 'rating':
+        ordering = ['-rating', 'id']
+    elif params.get('order') == 'influence':
+        ordering = ['-pagerank', 'id']
+    elif 'fts_rank' in queryset.query.annotations:
+        # best full-text matches first when searching by keyword
+        ordering = ['fts_rank', 'id']
+    else:
+        ordering = ['id']
+    return await apaged_json_response(request, queryset.select_related('user'), ordering, 'data_list', paper_list_json)
 
 
 @allow_methods(['POST'])
@@ -176,6 +415,7 @@ def get_search_paper(request):
 @has_json_payload()
 @paperid_exist('POST')
 @user_can_comment_paper()
+@retry_when_locked()
 def post_comment_paper(request):
     ''' create scholar if not exist '''
     try:
@@ -191,6 +431,7 @@ def post_comment_paper(request):
 @has_json_payload()
 @paperid_exist('POST')
 @user_can_comment_paper()
+@retry_when_locked()
 def post_review_paper(request):
     ''' make stars '''
     try:
@@ -199,12 +440,12 @@ def post_review_paper(request):
         return JsonResponse({'error': 'star does not exist!'}, status=HTTPStatus.BAD_REQUEST)
     except ValueError:
         return JsonResponse({'error': 'star gotta be a number 1-5'}, status=HTTPStatus.BAD_REQUEST)
-    queryset = PaperStarComments.objects.filter(paper=request.paper, user=request.user)
-    if len(queryset) == 0:
-        PaperStarComments.objects.create(paper=request.paper, user=request.user, star=star)
+    try:
+        PaperStarComments._meta.get_field('star').run_validators(star)
+    except ValidationError as err:
+        return JsonResponse({'error': ' '.join(err.messages)}, status=HTTPStatus.BAD_REQUEST)
+    if not review_paper(request.paper, request.user, star):
         return JsonResponse({'status': 'ok'})
-    queryset[0].star = star
-    queryset[0].save()
     return JsonResponse({'status': 'ok', 'message': 'review changed'})
 
 
@@ -214,18 +455,9 @@ def post_review_paper(request):
 @has_query_params(['paperid'])
 @paperid_exist('GET')
 @user_can_view_paper()
-def get_search_paper_comment(request):
-    paper_comment = PaperTextComments.objects.filter(paper=request.paper).order_by('commented_on')
-    paper_comment, total_page, current_page = paginate_queryset(paper_comment, request.per_page, request.page)
-    return JsonResponse(
-            {
-                'status': 'ok',
-                'data': {
-                    'comment_list': [i.json for i in paper_comment],
-                    'total_page': total_page,
-                    'current_page': current_page,
-                }
-            })
+async def get_search_paper_comment(request):
+    paper_comment = PaperTextComments.objects.filter(paper=request.paper).select_related('user')
+    return await apaged_json_response(request, paper_comment, ['commented_on', 'id'], 'comment_list', comment_list_json)
 
 
 @allow_methods(['GET'])
@@ -234,18 +466,9 @@ def get_search_paper_comment(request):
 @has_query_params(['papersetid'])
 @paperset_exists('GET')
 @user_paperset_action('read')
-def get_search_paperset_comment(request):
-    paperset_comment = PaperSetTextComments.objects.filter(paperset=request.paperset).order_by('commented_on')
-    paperset_comment, total_page, current_page = paginate_queryset(paperset_comment, request.per_page, request.page)
-    return JsonResponse(
-            {
-                'status': 'ok',
-                'data': {
-                    'comment_list': [i.json for i in paperset_comment],
-                    'total_page': total_page,
-                    'current_page': current_page,
-                }
-            })
+async def get_search_paperset_comment(request):
+    paperset_comment = PaperSetTextComments.objects.filter(paperset=request.paperset).select_related('user')
+    return await apaged_json_response(request, paperset_comment, ['commented_on', 'id'], 'comment_list', comment_list_json)
 
 
 @allow_methods(['POST'])
@@ -253,6 +476,7 @@ def get_search_paperset_comment(request):
 @has_json_payload()
 @paperset_exists('post')
 @user_paperset_action('comment')
+@retry_when_locked()
 def post_comment_paperset(request):
     ''' create scholar if not exist '''
     try:
@@ -269,9 +493,8 @@ def post_comment_paperset(request):
 @paperid_exist('GET')
 @user_can_view_paper()
 def get_get_paper_review(request):
-    # review is the avg of all
-    review: float | None = PaperStarComments.objects.filter(paper=request.paper).aggregate(Avg('star'))['star__avg']
-    return JsonResponse({'status': 'ok', 'data': { 'review':  0 if review is None else round(review, 1) }})
+    # review is the avg of all, kept on the paper
+    return JsonResponse({'status': 'ok', 'data': { 'review': request.paper.review }})
 
 
 @allow_methods(['GET'])
@@ -279,8 +502,9 @@ def get_get_paper_review(request):
 @has_query_params(['paperid'])
 @paperid_exist('GET')
 @user_can_view_paper()
-def get_paper_detail(request):
-    detail_json = request.paper.simple_json
+async def get_paper_detail(request):
+    # the authors are read with the json
+    detail_json = await sync_to_async(lambda: request.paper.simple_json)()
     return JsonResponse({'status': 'ok', 'data': detail_json})
 
 
@@ -289,20 +513,43 @@ def get_paper_detail(request):
 @has_query_params(['paperid'])
 @paperid_exist('GET')
 @user_can_view_paper()
-def get_paper_content(request):
+async def get_paper_content(request):
+    '''
+    type=bytes for the pdf, preview_page=n for its first n pages, or
+    from_page/to_page for a range of pages, counting from 1
+    otherwise the detail with the file's hash, size and url, inline=true adds
+    the file in base64 as file_content
+    '''
     if request.GET.get('type') == 'bytes':
-        if request.GET.get('preview_page'):
-            return HttpResponse(content=request.paper.file_bytes_preview(num_pages=int(request.GET.get('preview_page'))))
-        return HttpResponse(content=request.paper.file_bytes)
-    return JsonResponse({'status': 'ok', 'data': request.paper.full_json})
+        if request.GET.get('preview_page') or request.GET.get('from_page') or request.GET.get('to_page'):
+            try:
+                first = int(request.GET.get('from_page', 1))
+                last = int(request.GET.get('preview_page') or request.GET.get('to_page', first))
+            except ValueError:
+                return JsonResponse({'status': 'error', 'error': 'preview pages should be integers'}, status=HTTPStatus.BAD_REQUEST)
+            if first < 1 or last < first:
+                return JsonResponse({'status': 'error', 'error': f'invalid page range {first}-{last}'}, status=HTTPStatus.BAD_REQUEST)
+            # rendering a preview takes a while, not in the thread of the database
+            path = await sync_to_async(request.paper.file_preview_path, thread_sensitive=False)(first - 1, last - 1)
+            return file_response(request, path, f'"{os.path.basename(path)}"', f'preview_{request.paper.file_name}')
+        return file_response(request, request.paper.file_content.path, request.paper.file_etag, request.paper.file_name)
+    data = await sync_to_async(lambda: request.paper.full_json)()
+    data['file_url'] = f"{reverse(get_paper_content)}?{urlencode({'paperid': request.paper.id, 'type': 'bytes'})}"
+    if request.GET.get('inline') in ['true', 'True']:
+        return json_with_file_response(request, data, 'file_content', request.paper.file_content.path)
+    return JsonResponse({'status': 'ok', 'data': data})
 
 
 @allow_methods(['POST'])
 @login_required()
 @has_json_payload()
+@retry_when_locked()
 def post_insert_paperset(request):
     try:
-        PaperSet.objects.create(user=request.user, **request.json_payload)
+        with transaction.atomic(savepoint=False):
+            PaperSet.objects.create(user=request.user, **request.json_payload)
+    except OperationalError:
+        raise
     except Exception:
         return JsonResponse({'error': 'paper set cannot be created'}, status=HTTPStatus.BAD_REQUEST)
     return JsonResponse({'status': 'ok', 'message': 'paperset created'})
@@ -313,6 +560,7 @@ def post_insert_paperset(request):
 @has_json_payload()
 @paperset_exists('POST')
 @user_paperset_action('write')
+@retry_when_locked()
 def post_change_paperset(request):
     changed = False
     if request.json_payload.get('name'):
@@ -333,6 +581,7 @@ def post_change_paperset(request):
 @allow_methods(['GET'])
 @get_with_pages()
 @login_required()
+@cache_response([Paper, PaperSet], ('creater_me',))
 def get_search_paperset(request):
     '''
     now this is complicated, you can search papserset's name, description, user
@@ -340,12 +589,7 @@ def get_search_paperset(request):
     and in the end, don't forget the private
     '''
     queryset = search_paperset(request.GET, request.user)
-    page, total_page, current_page = paginate_queryset(queryset.order_by('id'), request.per_page, request.page)
-    return JsonResponse({'status': 'ok', 'data': {
-            'data_list': [i.json for i in page],
-            'total_page': total_page,
-            'current_page': current_page,
-        }})
+    return paged_json_response(request, queryset.select_related('user'), ['id'], 'data_list', paperset_list_json)
 
 
 @allow_methods(['POST'])
@@ -354,14 +598,18 @@ def get_search_paperset(request):
 @paperid_list_exist('POST')
 @paperset_exists('POST')
 @user_paperset_action('modify')
+@retry_when_locked()
 def post_add_to_paperset(request):
-    already_in: list[Paper] = []
-    for paper in request.paper_list:
-        param = { 'paper': paper, 'paper_set': request.paperset }
-        if len(PaperSetContent.objects.filter(**param)) != 0:
-            already_in.append(paper)
-        else:
-            PaperSetContent.objects.create(**param)
+    papers = list(request.paper_list)
+    with transaction.atomic():
+        members = PaperSetContent.objects.filter(paper_set=request.paperset, paper__in=papers)
+        existing = set(members.values_list('paper_id', flat=True))
+        PaperSetContent.objects.bulk_create(
+                [PaperSetContent(paper=i, paper_set=request.paperset) for i in papers if i.id not in existing],
+                ignore_conflicts=True)
+        if len(existing) != len(papers):
+            bump_generation()
+    already_in = [i for i in papers if i.id in existing]
     if len(already_in) == 0:
         return JsonResponse({'status': 'ok', 'message': 'all is added'})
     return JsonResponse(
@@ -369,7 +617,7 @@ def post_add_to_paperset(request):
                 'status': 'warning',
                 'warning': 'some papers are already in paperset',
                 'data': {
-                    'already_in': [i.simple_json for i in already_in]
+                    'already_in': paper_list_json(already_in)
                     }
             })
 
@@ -380,13 +628,27 @@ def post_add_to_paperset(request):
 @paperid_list_exist('POST')
 @paperset_exists('POST')
 @user_paperset_action('modify')
+@retry_when_locked()
 def post_delete_from_paperset(request):
-    for paper in request.paper_list:
-        param = { 'paper': paper, 'paper_set': request.paperset }
-        queryset = PaperSetContent.objects.filter(**param)
-        if len(queryset) != 1:
-            return JsonResponse({'status': 'error', 'error': 'paper not in paperset', 'data': { 'paper': paper.simple_json }}, status=HTTPStatus.BAD_REQUEST)
-        queryset[0].delete()
+    ''' remove all the papers, or none if any of them is not in the paperset '''
+    papers = list(request.paper_list)
+    with transaction.atomic():
+        members = PaperSetContent.objects.filter(paper_set=request.paperset, paper__in=papers)
+        existing = set(members.values_list('paper_id', flat=True))
+        not_in = [i for i in papers if i.id not in existing]
+        if len(not_in) == 0:
+            members.delete()
+            bump_generation()
+    if len(not_in) != 0:
+        return JsonResponse(
+                {
+                    'status': 'error',
+                    'error': 'paper not in paperset',
+                    'data': {
+                        'paper': paper_list_json(not_in[:1])[0],
+                        'not_in': paper_list_json(not_in),
+                    }
+                }, status=HTTPStatus.BAD_REQUEST)
     return JsonResponse({'status': 'ok', 'message': 'all is removed'})
 
 
@@ -413,7 +675,7 @@ def get_get_papers_paperset(request):
     else:
         queryset = queryset.filter(Q(private=False) | Q(user=request.user))
     return JsonResponse({'status': 'ok', 'data': {
-            'data_list': [i.json for i in queryset],
+            'data_list': paperset_list_json(queryset.select_related('user')),
         }})
 
 
@@ -425,17 +687,22 @@ def get_userid(request):
 
 @allow_methods(['POST'])
 @login_required()
+@has_paper_payload()
 @paperid_exist('POST')
-@has_json_payload()
 @user_can_modify_paper()
+@retry_when_locked()
 def post_modify_paper(request):
-    ''' change the paper's info, and return the changed paper detail '''
-    changed, errors = request.paper.try_change_to(request.json_payload)
+    '''
+    change the paper's info, and return the changed paper detail, a retried
+    attempt starts again from the paper as it was loaded
+    '''
+    paper = copy.copy(request.paper)
+    changed, errors = paper.try_change_to(request.json_payload, request.uploaded_file)
     if errors != '':
         return JsonResponse({'status': 'error', 'error': errors}, status=HTTPStatus.INTERNAL_SERVER_ERROR)
     if changed:
-        return JsonResponse({'status': 'ok', 'message': 'paper changed', 'data': request.paper.simple_json})
-    return JsonResponse({'status': 'ok', 'message': 'paper not changed', 'data': request.paper.simple_json})
+        return JsonResponse({'status': 'ok', 'message': 'paper changed', 'data': paper.simple_json})
+    return JsonResponse({'status': 'ok', 'message': 'paper not changed', 'data': paper.simple_json})
 
 
 @allow_methods(['POST'])
@@ -443,7 +710,93 @@ def post_modify_paper(request):
 @has_json_payload()
 @paperset_exists('POST')
 @user_paperset_action('delete')
+@retry_when_locked()
 def post_delete_paperset(request):
     ''' create scholar if not exist '''
     request.paperset.delete()
     return JsonResponse({'status': 'ok', 'message': 'paperset deleted'})
+
+
+@allow_methods(['POST'])
+@login_required()
+@has_json_payload()
+@paperid_exist('POST')
+@user_can_modify_paper()
+@paperid_list_exist('POST')
+@retry_when_locked()
+def post_add_citations(request):
+    ''' the paper cites every paper of paperid_list '''
+    cited = list(request.paper_list.filter(Q(private=False) | Q(user=request.user)).values_list('id', flat=True))
+    if request.paper.id in cited:
+        return JsonResponse({'status': 'error', 'error': 'a paper can not cite itself'}, status=HTTPStatus.BAD_REQUEST)
+    already_cited = add_citations(request.paper, cited)
+    if len(already_cited) == 0:
+        return JsonResponse({'status': 'ok', 'message': 'all is cited'})
+    return JsonResponse({
+            'status': 'warning',
+            'warning': 'some papers are already cited',
+            'data': { 'already_cited': [str(i) for i in already_cited] },
+        })
+
+
+@allow_methods(['POST'])
+@login_required()
+@has_json_payload()
+@paperid_exist('POST')
+@user_can_modify_paper()
+@paperid_list_exist('POST')
+@retry_when_locked()
+def post_delete_citations(request):
+    ''' the paper no longer cites any paper of paperid_list '''
+    not_cited = remove_citations(request.paper, list(request.paper_list.values_list('id', flat=True)))
+    if len(not_cited) == 0:
+        return JsonResponse({'status': 'ok', 'message': 'all is removed'})
+    return JsonResponse({
+            'status': 'warning',
+            'warning': 'some papers are not cited',
+            'data': { 'not_cited': [str(i) for i in not_cited] },
+        })
+
+
+@allow_methods(['GET'])
+@login_required()
+@has_query_params(['paperid'])
+@paperid_exist('GET')
+@user_can_view_paper()
+def get_citation_graph(request):
+    '''
+    the papers within depth hops, direction=cited_by for the papers citing
+    this one and the papers citing them, or cites for the papers it cites,
+    fanout limits the papers followed from each paper, limit the papers
+    returned, papers have their depth, citations are the edges among them
+    '''
+    direction = request.GET.get('direction', 'cited_by')
+    if direction not in DIRECTIONS:
+        return JsonResponse({'status': 'error', 'error': f'direction should be one of {list(DIRECTIONS)}'}, status=HTTPStatus.BAD_REQUEST)
+    try:
+        depth = int(request.GET.get('depth', 1))
+        fanout = int(request.GET.get('fanout', 100))
+        limit = int(request.GET.get('limit', 1000))
+    except ValueError:
+        return JsonResponse({'status': 'error', 'error': 'depth, fanout and limit should be integers'}, status=HTTPStatus.BAD_REQUEST)
+    if not (0 <= depth <= MAX_CITATION_DEPTH and 0 < fanout <= MAX_CITATION_FANOUT and 0 < limit <= MAX_CITATION_PAPERS):
+        return JsonResponse({'status': 'error', 'error': f'depth should be at most {MAX_CITATION_DEPTH}, '
+                             f'fanout at most {MAX_CITATION_FANOUT}, limit at most {MAX_CITATION_PAPERS}'},
+                            status=HTTPStatus.BAD_REQUEST)
+    depths = neighborhood(request.paper, request.user, direction, depth, fanout, limit)
+    papers = sorted(Paper.objects.filter(id__in=depths).select_related('user'), key=lambda i: (depths[i.id], i.id))
+    data_list = paper_list_json(papers)
+    for paper, data in zip(papers, data_list):
+        data['depth'] = depths[paper.id]
+    citations = PaperCited.objects.filter(paper__in=depths, cite_paper__in=depths).order_by('id')
+    return JsonResponse({'status': 'ok', 'data': {
+            'data_list': data_list,
+            'citations': [{'paperid': str(i.paper_id), 'cite_paperid': str(i.cite_paper_id)} for i in citations],
+        }})
+
+
+@allow_methods(['GET'])
+@metrics_allowed()
+def get_metrics(request):
+    ''' the metrics of every worker in the prometheus text format, served at /metrics, see metrics_allowed '''
+    return HttpResponse(render(*collect()), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -1,7 +1,26 @@
 import base64
+import json
+from datetime import datetime
 from hashlib import md5
 
 
 def file_md5(file_content: str) -> tuple[bytes, str]:
     file_binary = base64.b64decode(file_content)
     return file_binary, md5(file_binary).hexdigest()
+
+
+def encode_cursor(values: list) -> str:
+    ''' opaque pagination cursor from the ordering values of the last row '''
+    values = [i.isoformat() if isinstance(i, datetime) else i for i in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> list:
+    ''' raise ValueError if the cursor is not one made by encode_cursor '''
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError) as err:
+        raise ValueError(f'malformed cursor: {err}') from err
+    if not isinstance(values, list):
+        raise ValueError('malformed cursor')
+    return values
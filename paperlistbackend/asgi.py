@@ -3,6 +3,23 @@ ASGI config for paperlistbackend project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+The read endpoints (search_paper, paper_detail, paper_content and the comment
+listings) are async views, under ASGI a slow download holds no worker thread.
+Serve it with gunicorn and uvicorn workers, as the Dockerfile does:
+
+    gunicorn --workers 3 --worker-class uvicorn.workers.UvicornWorker paperlistbackend.asgi:application
+
+or with uvicorn alone for development:
+
+    uvicorn paperlistbackend.asgi:application --reload
+
+The WSGI entry point still works, each async view then runs to completion in
+the thread of its request.
+
+Keep DB_CONN_MAX_AGE at its default of 0 under ASGI. A connection belongs to
+the thread that opened it, and the sync parts of each request may run in a
+different thread, so connections kept alive pile up instead of being reused.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.0/howto/deployment/asgi/
 """
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+import tempfile
 from os import environ
 from pathlib import Path
 
@@ -46,11 +47,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     #'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # removed unless PROFILER_ENABLED
+    'api.profiler.ProfilerMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -81,11 +85,28 @@ WSGI_APPLICATION = 'paperlistbackend.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        # django's sqlite backend, with the write transactions of api/sqlite3
+        'ENGINE': 'api.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # seconds a connection is kept for the following requests, 0 closes
+        # it after each request, as needed under ASGI, where the views run in
+        # threads of their own and kept connections pile up, WSGI workers can
+        # keep them for a minute
+        'CONN_MAX_AGE': int(environ.get('DB_CONN_MAX_AGE', 0)),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# pragmas of every sqlite connection, see api/database.py
+SQLITE_JOURNAL_MODE = environ.get('SQLITE_JOURNAL_MODE', 'wal')
+SQLITE_SYNCHRONOUS = environ.get('SQLITE_SYNCHRONOUS', 'normal')
+SQLITE_MMAP_SIZE = int(environ.get('SQLITE_MMAP_SIZE', 0x10000000))  # 256 MB
+SQLITE_BUSY_TIMEOUT = int(environ.get('SQLITE_BUSY_TIMEOUT', 5000))  # ms
+# write views still locked out after the busy timeout are retried, waiting
+# WRITE_RETRY_DELAY seconds, doubled after each attempt
+WRITE_RETRY_ATTEMPTS = int(environ.get('WRITE_RETRY_ATTEMPTS', 3))
+WRITE_RETRY_DELAY = float(environ.get('WRITE_RETRY_DELAY', 0.05))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -130,3 +151,79 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 
 DATA_UPLOAD_MAX_MEMORY_SIZE = 0x1000000  # 16 MB
+# pdfs streamed from multipart or raw bodies skip the limit above, they are
+# counted on the way to disk and rejected past this size
+MAX_PAPER_UPLOAD_SIZE = int(environ.get('MAX_PAPER_UPLOAD_SIZE', 0x1000000))  # 16 MB
+
+# rendered pdf previews, least recently used ones are removed past the size limit
+PREVIEW_CACHE_DIR = environ.get('PREVIEW_CACHE_DIR', BASE_DIR / 'previews')
+PREVIEW_CACHE_SIZE = int(environ.get('PREVIEW_CACHE_SIZE', 0x10000000))  # 256 MB
+
+# paper files unused for less than this long are kept, a new paper may be
+# about to refer to them
+OBJECT_STORE_GRACE_SECONDS = int(environ.get('OBJECT_STORE_GRACE_SECONDS', 600))
+
+# search responses, valid until a write replaces the generation token in
+# their keys, the token is kept in the stamp file, which the workers of one
+# host share, so a per process cache is correct with any number of workers
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'search': {
+        'BACKEND': environ.get('SEARCH_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': environ.get('SEARCH_CACHE_LOCATION', 'search'),
+    },
+    # shared by the workers, a session ended in one worker is ended in all,
+    # holds a session and a user per logged in client, past MAX_ENTRIES a
+    # third of the entries are dropped and their clients go to the database
+    'sessions': {
+        'BACKEND': environ.get('SESSION_CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': environ.get('SESSION_CACHE_LOCATION', Path(tempfile.gettempdir()) / 'paperlist_sessions'),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(environ.get('SESSION_CACHE_MAX_ENTRIES', 100000)),
+        },
+    },
+}
+SEARCH_CACHE_ALIAS = 'search'
+SEARCH_CACHE_TIMEOUT = int(environ.get('SEARCH_CACHE_TIMEOUT', 300))
+SEARCH_CACHE_STAMP = environ.get('SEARCH_CACHE_STAMP', Path(tempfile.gettempdir()) / 'paperlist_search_cache.stamp')
+
+# rows loaded by the permission checks, cached in each worker until a write
+# replaces the stamp file, which the workers of one host share
+ROW_CACHE_SIZE = int(environ.get('ROW_CACHE_SIZE', 1024))
+ROW_CACHE_STAMP = environ.get('ROW_CACHE_STAMP', Path(tempfile.gettempdir()) / 'paperlist_row_cache.stamp')
+
+# sessions and their users are read from the sessions cache, the database is
+# only asked on a miss, SESSION_ENGINE=django.contrib.sessions.backends.signed_cookies
+# keeps sessions in the cookie instead
+SESSION_ENGINE = environ.get('SESSION_ENGINE', 'django.contrib.sessions.backends.cached_db')
+SESSION_CACHE_ALIAS = 'sessions'
+# ModelBackend still resolves sessions created before the cached backend
+AUTHENTICATION_BACKENDS = [
+    'api.backends.CachedModelBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+USER_CACHE_ALIAS = 'sessions'
+USER_CACHE_TIMEOUT = int(environ.get('USER_CACHE_TIMEOUT', 300))
+
+# per route metrics, each worker writes its counts to its own file in the
+# directory at most every interval seconds, /metrics sums them, the files of
+# exited workers are merged into one and kept so counters never go down, empty
+# the directory to reset them
+METRICS_DIR = environ.get('METRICS_DIR', Path(tempfile.gettempdir()) / 'paperlist_metrics')
+METRICS_FLUSH_INTERVAL = float(environ.get('METRICS_FLUSH_INTERVAL', 1))
+# /metrics answers staff users, the comma separated addresses, and requests
+# with an Authorization: Bearer <token> header if a token is set
+METRICS_ALLOWED_IPS = [i for i in environ.get('METRICS_ALLOWED_IPS', '').split(',') if i]
+METRICS_TOKEN = environ.get('METRICS_TOKEN', '')
+
+# writes the metrics of the tests to a temporary directory
+TEST_RUNNER = 'api.runner.TestRunner'
+
+# profiles of a sampled fraction of requests, and of the requests of staff
+# users with an X-Profile: 1 header, only when enabled, see api/profiler.py
+PROFILER_ENABLED = environ.get('PROFILER_ENABLED', 'false') in ['true', 'True', '1']
+PROFILE_SAMPLE_RATE = float(environ.get('PROFILE_SAMPLE_RATE', 0))
+PROFILE_DIR = environ.get('PROFILE_DIR', Path(tempfile.gettempdir()) / 'paperlist_profiles')
+PROFILE_KEEP = int(environ.get('PROFILE_KEEP', 100))